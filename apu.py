@@ -0,0 +1,586 @@
+from functools import partial
+
+import numpy as np
+
+import tables
+
+CPU_HZ = 1789773
+SAMPLE_RATE = 44100
+# CPU cycles of one video frame, synthesis runs at least this often
+FRAME_CYCLES = 29781
+
+LENGTHS = [
+    10, 254, 20, 2, 40, 4, 80, 6, 160, 8, 60, 10, 14, 12, 26, 14,
+    12, 16, 24, 18, 48, 20, 96, 22, 192, 24, 72, 26, 16, 28, 32, 30,
+]  # fmt: skip
+DUTY = np.array(
+    [
+        [0, 1, 0, 0, 0, 0, 0, 0],
+        [0, 1, 1, 0, 0, 0, 0, 0],
+        [0, 1, 1, 1, 1, 0, 0, 0],
+        [1, 0, 0, 1, 1, 1, 1, 1],
+    ],
+    dtype=np.uint8,
+)
+TRIANGLE = np.concatenate([np.arange(15, -1, -1), np.arange(16)]).astype(
+    np.uint8
+)
+# in CPU cycles
+NOISE_PERIODS = [
+    4, 8, 16, 32, 64, 96, 128, 160, 202, 254, 380, 508, 762, 1016, 2034, 4068,
+]  # fmt: skip
+DMC_RATES = [
+    428, 380, 340, 320, 286, 254, 226, 214,
+    190, 160, 142, 128, 106, 84, 72, 54,
+]  # fmt: skip
+
+# non-linear mixer, indexed by pulse1 + pulse2 and 3 * triangle + 2 * noise
+# + dmc, see https://www.nesdev.org/wiki/APU_Mixer
+PULSE_TABLE = np.zeros((31,), dtype=np.float32)
+PULSE_TABLE[1:] = 95.52 / (8128.0 / np.arange(1, 31) + 100)
+TND_TABLE = np.zeros((203,), dtype=np.float32)
+TND_TABLE[1:] = 163.67 / (24329.0 / np.arange(1, 203) + 100)
+
+# frame counter steps as (CPU cycle, quarter frame, half frame, IRQ)
+FOUR_STEP = (
+    (7457, True, False, False),
+    (14913, True, True, False),
+    (22371, True, False, False),
+    (29829, True, True, True),
+)
+FIVE_STEP = (
+    (7457, True, False, False),
+    (14913, True, True, False),
+    (22371, True, False, False),
+    (29829, False, False, False),
+    (37281, True, True, False),
+)
+FOUR_STEP_PERIOD = 29830
+FIVE_STEP_PERIOD = 37282
+
+
+def noise_sequence(short):
+    # output of the 15 bit LFSR over a full period, kept on disk by `tables`
+    return tables.get("noise_short" if short else "noise_long")
+
+
+class AudioBuffer:
+    # ring of mixed samples in [0, 1), the frontend drains it. when it falls
+    # behind the oldest samples are dropped to keep latency bounded
+    def __init__(self, capacity=SAMPLE_RATE):
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity,), dtype=np.float32)
+        # both are absolute sample counts, the ring index is `n % capacity`
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def write(self, samples):
+        samples = samples[-self.capacity :]
+        start = self.head % self.capacity
+        split = min(samples.shape[0], self.capacity - start)
+        self.buffer[start : start + split] = samples[:split]
+        self.buffer[: samples.shape[0] - split] = samples[split:]
+        self.head += samples.shape[0]
+        self.tail = max(self.tail, self.head - self.capacity)
+
+    def drain(self, size=None):
+        size = len(self) if size is None else min(size, len(self))
+        index = np.arange(self.tail, self.tail + size) % self.capacity
+        self.tail += size
+        return self.buffer[index]
+
+
+class Envelope:
+    def __init__(self):
+        self.start = False
+        self.divider = 0
+        self.decay = 0
+        self.loop = False
+        self.constant = False
+        self.volume = 0
+
+    def write(self, value):
+        self.loop = bool(value & 0x20)
+        self.constant = bool(value & 0x10)
+        self.volume = value & 0x0F
+
+    def clock(self):
+        if self.start:
+            self.start = False
+            self.decay = 15
+            self.divider = self.volume
+        elif self.divider:
+            self.divider -= 1
+        else:
+            self.divider = self.volume
+            if self.decay:
+                self.decay -= 1
+            elif self.loop:
+                self.decay = 15
+
+    @property
+    def output(self):
+        return self.volume if self.constant else self.decay
+
+
+class Pulse:
+    def __init__(self, negate_offset):
+        # pulse 1 negates in one's complement, pulse 2 in two's complement
+        self.negate_offset = negate_offset
+        self.enabled = False
+        self.envelope = Envelope()
+        self.duty = 0
+        self.halt = False
+        self.length = 0
+        self.period = 0
+        self.sweep_enabled = False
+        self.sweep_period = 0
+        self.sweep_negate = False
+        self.sweep_shift = 0
+        self.sweep_reload = False
+        self.sweep_divider = 0
+        # position in the 8 step sequence
+        self.phase = 0.0
+
+    def write(self, register, value):
+        match register:
+            case 0:
+                self.duty = value >> 6
+                self.halt = bool(value & 0x20)
+                self.envelope.write(value)
+            case 1:
+                self.sweep_enabled = bool(value & 0x80)
+                self.sweep_period = (value >> 4) & 0x07
+                self.sweep_negate = bool(value & 0x08)
+                self.sweep_shift = value & 0x07
+                self.sweep_reload = True
+            case 2:
+                self.period = (self.period & 0x700) | value
+            case 3:
+                self.period = (self.period & 0xFF) | ((value & 0x07) << 8)
+                if self.enabled:
+                    self.length = LENGTHS[value >> 3]
+                self.phase = 0.0
+                self.envelope.start = True
+
+    def quarter_frame(self):
+        self.envelope.clock()
+
+    def half_frame(self):
+        if (
+            not self.sweep_divider
+            and self.sweep_enabled
+            and self.sweep_shift
+            and not self.muted
+        ):
+            self.period = self._sweep_target()
+        if not self.sweep_divider or self.sweep_reload:
+            self.sweep_divider = self.sweep_period
+            self.sweep_reload = False
+        else:
+            self.sweep_divider -= 1
+        if self.length and not self.halt:
+            self.length -= 1
+
+    def _sweep_target(self):
+        change = self.period >> self.sweep_shift
+        if self.sweep_negate:
+            return self.period - change - self.negate_offset
+        return self.period + change
+
+    @property
+    def muted(self):
+        return self.period < 8 or self._sweep_target() > 0x7FF
+
+    def render(self, offsets, span):
+        # `offsets` are the sample times in CPU cycles from the span start,
+        # the sequencer steps every 2 * (period + 1) cycles
+        step = 2 * (self.period + 1)
+        if not self.length or self.muted or not self.envelope.output:
+            output = np.zeros(offsets.shape, dtype=np.uint8)
+        else:
+            index = (self.phase + offsets / step).astype(np.intp) & 7
+            output = DUTY[self.duty][index] * np.uint8(self.envelope.output)
+        self.phase = (self.phase + span / step) % 8
+        return output
+
+
+class Triangle:
+    def __init__(self):
+        self.enabled = False
+        self.control = False
+        self.linear_reload_value = 0
+        self.linear_reload = False
+        self.linear = 0
+        self.length = 0
+        self.period = 0
+        self.phase = 0.0
+
+    def write(self, register, value):
+        match register:
+            case 0:
+                self.control = bool(value & 0x80)
+                self.linear_reload_value = value & 0x7F
+            case 2:
+                self.period = (self.period & 0x700) | value
+            case 3:
+                self.period = (self.period & 0xFF) | ((value & 0x07) << 8)
+                if self.enabled:
+                    self.length = LENGTHS[value >> 3]
+                self.linear_reload = True
+
+    def quarter_frame(self):
+        if self.linear_reload:
+            self.linear = self.linear_reload_value
+        elif self.linear:
+            self.linear -= 1
+        if not self.control:
+            self.linear_reload = False
+
+    def half_frame(self):
+        if self.length and not self.control:
+            self.length -= 1
+
+    def render(self, offsets, span):
+        # stopped or ultrasonic, the output holds its current step
+        if not self.length or not self.linear or self.period < 2:
+            return np.full(
+                offsets.shape, TRIANGLE[int(self.phase) & 31], np.uint8
+            )
+        step = self.period + 1
+        index = (self.phase + offsets / step).astype(np.intp) & 31
+        self.phase = (self.phase + span / step) % 32
+        return TRIANGLE[index]
+
+
+class Noise:
+    def __init__(self):
+        self.enabled = False
+        self.envelope = Envelope()
+        self.halt = False
+        self.length = 0
+        self.short = False
+        self.period = NOISE_PERIODS[0]
+        self.phase = 0.0
+
+    def write(self, register, value):
+        match register:
+            case 0:
+                self.halt = bool(value & 0x20)
+                self.envelope.write(value)
+            case 2:
+                self.short = bool(value & 0x80)
+                self.period = NOISE_PERIODS[value & 0x0F]
+            case 3:
+                if self.enabled:
+                    self.length = LENGTHS[value >> 3]
+                self.envelope.start = True
+
+    def quarter_frame(self):
+        self.envelope.clock()
+
+    def half_frame(self):
+        if self.length and not self.halt:
+            self.length -= 1
+
+    def render(self, offsets, span):
+        sequence = noise_sequence(self.short)
+        if not self.length or not self.envelope.output:
+            output = np.zeros(offsets.shape, dtype=np.uint8)
+        else:
+            index = (self.phase + offsets / self.period).astype(np.intp)
+            output = sequence[index % sequence.shape[0]] * np.uint8(
+                self.envelope.output
+            )
+        self.phase = (self.phase + span / self.period) % sequence.shape[0]
+        return output
+
+
+class DMC:
+    def __init__(self, bus):
+        self.bus = bus
+        self.irq_enabled = False
+        self.loop = False
+        self.rate = DMC_RATES[0]
+        self.level = 0
+        self.sample_address = 0xC000
+        self.sample_length = 1
+        # deltas of the sample being played, one per bit, and how far in
+        self.deltas = None
+        self.position = 0.0
+        self.irq = False
+
+    def write(self, register, value):
+        match register:
+            case 0:
+                self.irq_enabled = bool(value & 0x80)
+                self.loop = bool(value & 0x40)
+                self.rate = DMC_RATES[value & 0x0F]
+                if not self.irq_enabled:
+                    self.irq = False
+            case 1:
+                self.level = value & 0x7F
+            case 2:
+                self.sample_address = 0xC000 + value * 64
+            case 3:
+                self.sample_length = value * 16 + 1
+
+    @property
+    def active(self):
+        return self.deltas is not None
+
+    @property
+    def bytes_remaining(self):
+        if not self.active:
+            return 0
+        return -(-(self.deltas.shape[0] - int(self.position)) // 8)
+
+    def cycles_left(self):
+        return (self.deltas.shape[0] - self.position) * self.rate
+
+    def start(self):
+        # the whole sample is fetched at once, a page at a time
+        data = []
+        address = self.sample_address
+        remaining = self.sample_length
+        while remaining:
+            size = min(remaining, 0x100 - (address & 0xFF))
+            data.append(self.bus.read_chunk(address, size))
+            remaining -= size
+            # samples wrap around to $8000
+            address = ((address + size) & 0xFFFF) or 0x8000
+        bits = np.unpackbits(np.concatenate(data), bitorder="little")
+        self.deltas = bits.astype(np.int16) * 4 - 2
+        self.position = 0.0
+
+    def stop(self):
+        self.deltas = None
+
+    def render(self, offsets, span):
+        if not self.active:
+            output = np.full(offsets.shape, self.level, dtype=np.uint8)
+            return output
+        # levels after each bit, the counter saturates at 0 and 127. clipping
+        # the running sum only approximates that when it hits a bound
+        levels = np.clip(self.level + np.cumsum(self.deltas), 0, 127)
+        played = (self.position + offsets / self.rate).astype(np.intp)
+        played = np.minimum(played, self.deltas.shape[0])
+        output = np.where(
+            played > 0, levels[np.maximum(played - 1, 0)], self.level
+        ).astype(np.uint8)
+        self.advance(span, levels)
+        return output
+
+    def advance(self, span, levels=None):
+        if not self.active:
+            return
+        if levels is None:
+            levels = np.clip(self.level + np.cumsum(self.deltas), 0, 127)
+        position = self.position + span / self.rate
+        played = min(int(position), self.deltas.shape[0])
+        if played:
+            self.level = int(levels[played - 1])
+            self.deltas = self.deltas[played:]
+        self.position = position - played
+        if not self.deltas.shape[0]:
+            if self.loop:
+                self.start()
+            else:
+                self.stop()
+                if self.irq_enabled:
+                    self.irq = True
+
+
+class APU:
+    def __init__(self, bus, sample_rate=SAMPLE_RATE, synthesize=True):
+        self.bus = bus
+        self.sample_rate = sample_rate
+        # headless users can turn synthesis off, timing and IRQs still run
+        self.synthesize = synthesize
+        self.buffer = AudioBuffer(sample_rate)
+        self.pulse1 = Pulse(1)
+        self.pulse2 = Pulse(0)
+        self.triangle = Triangle()
+        self.noise = Noise()
+        self.dmc = DMC(bus)
+        self.channels = (
+            self.pulse1,
+            self.pulse2,
+            self.triangle,
+            self.noise,
+            self.dmc,
+        )
+        # register writes are only queued with their cycle and applied while
+        # synthesizing, in order with the frame counter steps
+        self.writes = []
+        # synthesized up to this CPU cycle
+        self.cycle = 0
+        self.next_sample = 0.0
+        self.sample_period = CPU_HZ / sample_rate
+        self.next_render = 0
+        self.steps = FOUR_STEP
+        self.sequence_period = FOUR_STEP_PERIOD
+        self.sequence_start = 0
+        self.step = 0
+        self.irq_inhibit = False
+        self.frame_irq = False
+
+        io = bus.io
+        for register in range(0x14):
+            io.writers[register] = partial(self.write, register)
+        io.writers[0x15] = self.write_status
+        io.readers[0x15] = self.read_status
+        io.writers[0x17] = self.write_frame_counter
+
+    def _now(self):
+        cpu = self.bus.cpu
+        return self.cycle if cpu is None else max(cpu.cycles, self.cycle)
+
+    def write(self, register, data):
+        self.writes.append((self._now(), register, int(data)))
+
+    def write_status(self, data):
+        self._render(self._now())
+        data = int(data)
+        for bit, channel in enumerate(self.channels[:4]):
+            channel.enabled = bool(data & (1 << bit))
+            if not channel.enabled:
+                channel.length = 0
+        if not data & 0x10:
+            self.dmc.stop()
+        elif not self.dmc.active:
+            self.dmc.start()
+        self.dmc.irq = False
+        self._update_irq()
+        # the next DMC IRQ may have moved
+        self.bus.schedule(0)
+
+    def read_status(self):
+        self._render(self._now())
+        value = (
+            (self.pulse1.length > 0)
+            | (self.pulse2.length > 0) << 1
+            | (self.triangle.length > 0) << 2
+            | (self.noise.length > 0) << 3
+            | (self.dmc.bytes_remaining > 0) << 4
+            | self.frame_irq << 6
+            | self.dmc.irq << 7
+        )
+        self.frame_irq = False
+        self._update_irq()
+        return np.uint8(value)
+
+    def write_frame_counter(self, data):
+        self._render(self._now())
+        data = int(data)
+        if data & 0x80:
+            self.steps = FIVE_STEP
+            self.sequence_period = FIVE_STEP_PERIOD
+            self._quarter_frame()
+            self._half_frame()
+        else:
+            self.steps = FOUR_STEP
+            self.sequence_period = FOUR_STEP_PERIOD
+        self.irq_inhibit = bool(data & 0x40)
+        if self.irq_inhibit:
+            self.frame_irq = False
+        self.sequence_start = self.cycle
+        self.step = 0
+        self._update_irq()
+        self.bus.schedule(0)
+
+    # clocked through the bus event scheduler, like the PPU
+
+    def run_until(self, cycle):
+        if cycle >= self.next_render:
+            self.next_render = cycle + FRAME_CYCLES
+        self._render(cycle)
+        self._update_irq()
+
+        events = [self.next_render]
+        if not self.irq_inhibit and not self.frame_irq:
+            if self.steps is FOUR_STEP:
+                events.append(self.sequence_start + FOUR_STEP[-1][0])
+        if self.dmc.active and self.dmc.irq_enabled and not self.dmc.loop:
+            events.append(self.cycle + int(self.dmc.cycles_left()) + 1)
+        return min(events)
+
+    def _update_irq(self):
+        if self.frame_irq or self.dmc.irq:
+            self.bus.irq.add(self)
+        else:
+            self.bus.irq.discard(self)
+
+    def _render(self, until):
+        writes = self.writes
+        done = 0
+        while True:
+            step_cycle = self.sequence_start + self.steps[self.step][0]
+            write_cycle = writes[done][0] if done < len(writes) else None
+            if write_cycle is not None and write_cycle <= min(
+                step_cycle, until
+            ):
+                _, register, data = writes[done]
+                self._synthesize(write_cycle)
+                channel = self.channels[register >> 2]
+                channel.write(register & 0x03, data)
+                done += 1
+            elif step_cycle <= until:
+                self._synthesize(step_cycle)
+                self._clock_sequencer()
+            else:
+                self._synthesize(until)
+                break
+        del writes[:done]
+
+    def _clock_sequencer(self):
+        _, quarter, half, irq = self.steps[self.step]
+        if quarter:
+            self._quarter_frame()
+        if half:
+            self._half_frame()
+        if irq and not self.irq_inhibit:
+            self.frame_irq = True
+        self.step += 1
+        if self.step == len(self.steps):
+            self.step = 0
+            self.sequence_start += self.sequence_period
+
+    def _quarter_frame(self):
+        for channel in self.channels[:4]:
+            channel.quarter_frame()
+
+    def _half_frame(self):
+        for channel in self.channels[:4]:
+            channel.half_frame()
+
+    def _synthesize(self, cycle):
+        # one span with constant registers, every channel is generated as a
+        # whole array of samples
+        span = cycle - self.cycle
+        if span <= 0:
+            return
+        if not self.synthesize:
+            self.dmc.advance(span)
+            self.cycle = cycle
+            self.next_sample = float(cycle)
+            return
+
+        count = max(0, -int(-(cycle - self.next_sample) // self.sample_period))
+        offsets = (
+            self.next_sample - self.cycle
+        ) + self.sample_period * np.arange(count)
+        pulse = self.pulse1.render(offsets, span) + self.pulse2.render(
+            offsets, span
+        )
+        tnd = (
+            3 * self.triangle.render(offsets, span).astype(np.intp)
+            + 2 * self.noise.render(offsets, span)
+            + self.dmc.render(offsets, span)
+        )
+        self.buffer.write(PULSE_TABLE[pulse] + TND_TABLE[tnd])
+        self.next_sample += count * self.sample_period
+        self.cycle = cycle
@@ -0,0 +1,327 @@
+import argparse
+import re
+
+import numpy as np
+
+from opcodes import MNEMONICS, OPCODES, SIZES
+from rom import CHR_BANK_SIZE, HEADER_SIZE, PRG_BANK_SIZE
+
+# first opcode per (mnemonic, mode), the table lists the official ones
+# first so e.g. `sbc #` is $E9 and not $EB
+ENCODINGS = {}
+for _opcode, (_mnemonic, _mode, _, _) in OPCODES.items():
+    ENCODINGS.setdefault((_mnemonic, _mode), _opcode)
+MNEMONIC_SET = frozenset(MNEMONICS)
+BRANCHES = frozenset(
+    mnemonic for mnemonic, mode in ENCODINGS if mode == "relative"
+)
+# other names the illegal opcodes go by
+ALIASES = {"isb": "isc", "asr": "alr", "axs": "sbx", "dcm": "dcp"}
+
+TOKEN = re.compile(
+    r"\s*(?:\$(?P<hexadecimal>[0-9A-Fa-f]+)|%(?P<binary>[01]+)"
+    r"|(?P<decimal>\d+)|'(?P<char>.)'|(?P<symbol>[A-Za-z_.][\w.]*)"
+    r"|(?P<star>\*)|(?P<operator>[-+]))"
+)
+LABEL = re.compile(r"^\s*([A-Za-z_.][\w.]*):")
+DEFINE = re.compile(r"^\s*(?:define\s+([A-Za-z_][\w.]*)\s+|([A-Za-z_][\w.]*)"
+                    r"\s*=\s*)(.+)$", re.IGNORECASE)  # fmt: skip
+
+VECTORS = ("nmi", "reset", "irq")
+
+
+class Program:
+    def __init__(self, data, origin, symbols):
+        # `data` covers `origin` up to the highest byte emitted, gaps
+        # between .org blocks are zero
+        self.data = data
+        self.origin = origin
+        self.symbols = symbols
+
+    def __len__(self):
+        return len(self.data)
+
+
+def evaluate(expression, symbols, pc):
+    # $hex, %binary, decimal, 'c', symbols and * joined by + and -, a
+    # leading < or > takes the low or high byte. None if a symbol is not
+    # defined yet
+    expression = expression.strip()
+    if expression[:1] in ("<", ">"):
+        value = evaluate(expression[1:], symbols, pc)
+        if value is None:
+            return None
+        return value & 0xFF if expression[0] == "<" else (value >> 8) & 0xFF
+
+    total = 0
+    sign = 1
+    position = 0
+    expect_term = True
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Invalid expression {expression!r}")
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "operator":
+            if expect_term:
+                # unary minus
+                sign = -sign if text == "-" else sign
+            else:
+                sign = -1 if text == "-" else 1
+                expect_term = True
+            continue
+        if not expect_term:
+            raise ValueError(f"Invalid expression {expression!r}")
+        match kind:
+            case "hexadecimal":
+                value = int(text, 16)
+            case "binary":
+                value = int(text, 2)
+            case "decimal":
+                value = int(text)
+            case "char":
+                value = ord(text)
+            case "star":
+                value = pc
+            case "symbol":
+                value = symbols.get(text)
+                if value is None:
+                    return None
+        total += sign * value
+        sign = 1
+        expect_term = False
+    if expect_term:
+        raise ValueError(f"Invalid expression {expression!r}")
+    return total
+
+
+def parse_operand(mnemonic, operand):
+    # (addressing mode, expression), zero page modes are picked later once
+    # the value is known
+    operand = operand.strip()
+    upper = operand.upper().replace(" ", "")
+    if not operand:
+        if (mnemonic, "implied") in ENCODINGS:
+            return "implied", None
+        return "accumulator", None
+    if upper == "A" and (mnemonic, "accumulator") in ENCODINGS:
+        return "accumulator", None
+    if operand.startswith("#"):
+        return "immediate", operand[1:]
+    if upper.startswith("(") and upper.endswith(",X)"):
+        return "indirect_x", operand[1 : operand.rindex(",")]
+    if upper.startswith("(") and upper.endswith("),Y"):
+        return "indirect_y", operand[1 : operand.rindex(")")]
+    if upper.startswith("(") and upper.endswith(")"):
+        return "indirect", operand[1:-1]
+    if upper.endswith(",X"):
+        return "absolute_x", operand[: operand.rindex(",")]
+    if upper.endswith(",Y"):
+        return "absolute_y", operand[: operand.rindex(",")]
+    if mnemonic in BRANCHES:
+        return "relative", operand
+    return "absolute", operand
+
+
+ZERO_PAGE = {
+    "absolute": "zero_page",
+    "absolute_x": "zero_page_x",
+    "absolute_y": "zero_page_y",
+}
+
+
+def choose_mode(mnemonic, mode, value):
+    # zero page whenever the value is known, fits and the opcode exists
+    short = ZERO_PAGE.get(mode)
+    if (
+        short is not None
+        and value is not None
+        and 0 <= value < 0x100
+        and (mnemonic, short) in ENCODINGS
+    ):
+        return short
+    if (mnemonic, mode) not in ENCODINGS and (mnemonic, short) in ENCODINGS:
+        # e.g. `stx $10,y` only exists in zero page
+        return short
+    return mode
+
+
+def _split_data(operand):
+    # comma separated values, strings stay whole
+    return re.findall(r'"[^"]*"|[^,]+', operand)
+
+
+def _statements(source):
+    # (line number, label, mnemonic or directive, operand)
+    for number, line in enumerate(source.splitlines(), 1):
+        line = line.split(";", 1)[0].rstrip()
+        if not line.strip():
+            continue
+        define = DEFINE.match(line)
+        if define is not None:
+            name = define.group(1) or define.group(2)
+            yield number, None, "=", (name, define.group(3))
+            continue
+        label = LABEL.match(line)
+        if label is not None:
+            line = line[label.end() :]
+            label = label.group(1)
+        op, _, operand = line.strip().partition(" ")
+        yield number, label, op.lower() or None, operand
+
+
+def assemble(source, origin=0x8000):
+    # two passes, the first sizes every statement and collects the labels,
+    # the second emits with every symbol known. operands of forward
+    # references are sized as absolute in both passes
+    symbols = {}
+    modes = {}
+    for final in (False, True):
+        pc = origin
+        output = {}
+        for number, label, op, operand in _statements(source):
+            try:
+                if label is not None:
+                    if not final and label in symbols:
+                        raise ValueError(f"Duplicate label {label}")
+                    symbols[label] = pc
+                if op is None:
+                    continue
+                if op == "=":
+                    name, expression = operand
+                    value = evaluate(expression, symbols, pc)
+                    if value is None:
+                        raise ValueError(f"Undefined symbol in {expression}")
+                    symbols[name] = value
+                elif op == ".org":
+                    pc = evaluate(operand, symbols, pc)
+                    if pc is None:
+                        raise ValueError(f"Undefined symbol in {operand}")
+                elif op in (".byte", ".db", ".word", ".dw"):
+                    width = 1 if op in (".byte", ".db") else 2
+                    for part in _split_data(operand):
+                        part = part.strip()
+                        if part.startswith('"'):
+                            for char in part[1:-1]:
+                                output[pc] = ord(char)
+                                pc += 1
+                            continue
+                        value = evaluate(part, symbols, pc)
+                        if value is None:
+                            if final:
+                                raise ValueError(f"Undefined symbol {part}")
+                            value = 0
+                        for shift in range(width):
+                            output[pc] = (value >> (8 * shift)) & 0xFF
+                            pc += 1
+                else:
+                    pc = _instruction(
+                        op, operand, symbols, pc, output, modes, number, final
+                    )
+            except ValueError as e:
+                raise ValueError(f"line {number}: {e}") from None
+
+    if not output:
+        return Program(b"", origin, symbols)
+    start = min(output)
+    data = np.zeros((max(output) - start + 1,), dtype=np.uint8)
+    data[np.array(list(output)) - start] = list(output.values())
+    return Program(data.tobytes(), start, symbols)
+
+
+def _instruction(op, operand, symbols, pc, output, modes, number, final):
+    mnemonic = ALIASES.get(op, op)
+    if mnemonic not in MNEMONIC_SET:
+        raise ValueError(f"Unknown instruction {op}")
+    mode, expression = parse_operand(mnemonic, operand)
+    value = None
+    if expression is not None:
+        value = evaluate(expression, symbols, pc)
+    if final:
+        mode = modes[number]
+        if expression is not None and value is None:
+            raise ValueError(f"Undefined symbol in {expression}")
+    else:
+        mode = modes[number] = choose_mode(mnemonic, mode, value)
+    if (mnemonic, mode) not in ENCODINGS:
+        raise ValueError(f"{mnemonic} has no {mode} addressing mode")
+
+    opcode = ENCODINGS[(mnemonic, mode)]
+    size = SIZES[opcode]
+    if final:
+        if mode == "relative":
+            offset = value - (pc + 2)
+            if not -128 <= offset < 128:
+                raise ValueError(f"Branch to {value:04X} is out of range")
+            value = offset & 0xFF
+        elif size > 1 and not 0 <= value < (1 << (8 * (size - 1))):
+            raise ValueError(f"Operand {value:X} does not fit {mode}")
+        output[pc] = opcode
+        for offset in range(1, size):
+            output[pc + offset] = (value >> (8 * (offset - 1))) & 0xFF
+    return pc + size
+
+
+def to_ines(
+    program, vectors=None, chr_data=b"", mapper=0, mirroring="vertical"
+):
+    # NROM style image, one 16KB bank if the program fits in $8000-$BFFF
+    # (mirrored at $C000) or two. vectors the program doesn't assemble itself
+    # default to the `nmi`, `reset` and `irq` labels, then to the start of
+    # the program. `vectors` overrides both
+    assert program.origin >= 0x8000, "PRG has to start at $8000 or above"
+    end = program.origin + len(program)
+    banks = 1 if end <= 0xC000 or program.origin >= 0xC000 else 2
+    size = banks * PRG_BANK_SIZE
+    prg = np.zeros((size,), dtype=np.uint8)
+    offset = (program.origin - 0x8000) % size
+    assert offset + len(program) <= size, "Program does not fit in PRG"
+    prg[offset : offset + len(program)] = np.frombuffer(
+        program.data, dtype=np.uint8
+    )
+
+    vectors = dict(vectors or {})
+    for i, name in enumerate(VECTORS):
+        low = size - 6 + 2 * i
+        covered = [offset <= a < offset + len(program) for a in (low, low + 1)]
+        if name not in vectors:
+            if all(covered):
+                continue
+            assert not any(covered), f"Program ends inside the {name} vector"
+            vectors[name] = program.symbols.get(name, program.origin)
+        address = vectors[name]
+        if isinstance(address, str):
+            address = program.symbols[address]
+        prg[low] = address & 0xFF
+        prg[low + 1] = address >> 8
+
+    chr_banks = -(-len(chr_data) // CHR_BANK_SIZE)
+    chr_ = np.zeros((chr_banks * CHR_BANK_SIZE,), dtype=np.uint8)
+    chr_[: len(chr_data)] = np.frombuffer(bytes(chr_data), dtype=np.uint8)
+    flags6 = ((mapper & 0x0F) << 4) | (mirroring == "vertical")
+    flags6 |= (mirroring == "four_screen") << 3
+    header = bytes([0x4E, 0x45, 0x53, 0x1A, banks, chr_banks, flags6])
+    header += bytes([mapper & 0xF0]).ljust(HEADER_SIZE - len(header), b"\0")
+    return header + prg.tobytes() + chr_.tobytes()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assemble 6502 source")
+    parser.add_argument("source")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--origin", type=lambda x: int(x, 0), default=0x8000)
+    parser.add_argument(
+        "--raw", action="store_true", help="plain binary, no iNES header"
+    )
+    args = parser.parse_args()
+
+    with open(args.source) as fp:
+        program = assemble(fp.read(), args.origin)
+    with open(args.output, "wb") as fp:
+        fp.write(program.data if args.raw else to_ines(program))
+    print(
+        f"{len(program)} bytes at ${program.origin:04X},"
+        f" {len(program.symbols)} symbols"
+    )
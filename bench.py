@@ -0,0 +1,427 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+import movie
+from assembler import assemble
+from conformance import load_reference, nestest_cpu
+from opcodes import HANDLERS, MNEMONICS, MODES, SIZES
+
+BASELINE = "bench_baseline.json"
+
+# micro benchmark layout, everything lives in the 2KB of CPU RAM
+PROGRAM_START = 0x0600
+PROGRAM_END = 0x07E0
+SUBROUTINE = 0x07F0
+JUMP_TABLE = 0x0200
+DATA = 0x0400
+ZERO_PAGE_OPERAND = 0x40
+POINTER_OPERAND = 0x20
+
+# pulls only make sense right after their push, and txs has to restore the
+# stack pointer it was given. rts runs from the subroutine jsr calls
+PAIRS = {0x48: (0x48, 0x68), 0x08: (0x08, 0x28), 0x9A: (0xBA, 0x9A)}
+PAIRED = {0x68, 0x28, 0x60}
+# rti needs a crafted stack frame and jam halts the CPU
+EXCLUDED = {"rti", "jam"}
+
+
+def benchmarkable(engine, opcode):
+    return (
+        opcode not in PAIRED
+        and MNEMONICS[opcode] not in EXCLUDED
+        and hasattr(engine, HANDLERS[opcode])
+    )
+
+
+def encode(opcode, address, jump_slot):
+    match MODES[opcode]:
+        case "implied" | "accumulator":
+            return [opcode]
+        case "immediate":
+            return [opcode, 0x01]
+        case "relative":
+            # taken or not, a zero offset lands on the next instruction
+            return [opcode, 0x00]
+        case "zero_page" | "zero_page_x" | "zero_page_y":
+            return [opcode, ZERO_PAGE_OPERAND]
+        case "indirect_x" | "indirect_y":
+            return [opcode, POINTER_OPERAND]
+        case "indirect":
+            return [opcode, jump_slot & 0xFF, jump_slot >> 8]
+        case _ if MNEMONICS[opcode] == "jmp":
+            target = address + SIZES[opcode]
+            return [opcode, target & 0xFF, target >> 8]
+        case _ if MNEMONICS[opcode] == "jsr":
+            return [opcode, SUBROUTINE & 0xFF, SUBROUTINE >> 8]
+        case _:
+            return [opcode, DATA & 0xFF, DATA >> 8]
+
+
+def assemble_loop(opcodes):
+    # repeat the body until RAM is full, then jump back to the start
+    program = []
+    jump_table = []
+    while True:
+        body = []
+        targets = []
+        for opcode in opcodes:
+            for part in PAIRS.get(opcode, (opcode,)):
+                address = PROGRAM_START + len(program) + len(body)
+                slot = JUMP_TABLE + 2 * (len(jump_table) + len(targets))
+                encoded = encode(part, address, slot)
+                if MODES[part] == "indirect":
+                    targets.append(address + len(encoded))
+                body += encoded
+        if PROGRAM_START + len(program) + len(body) + 3 > PROGRAM_END:
+            break
+        program += body
+        jump_table += targets
+    assert program, "Loop body does not fit in RAM"
+    program += [0x4C, PROGRAM_START & 0xFF, PROGRAM_START >> 8]
+    return program, jump_table
+
+
+# generated workloads for the macro benchmarks, assembled into CPU RAM
+WORKLOADS = {
+    # 256 byte block copies through zero page pointers
+    "copy": """
+source = $00
+destination = $02
+        lda #$00
+        sta source
+        sta destination
+        lda #$03
+        sta source + 1
+        lda #$04
+        sta destination + 1
+copy:   ldy #$00
+byte:   lda (source),y
+        sta (destination),y
+        iny
+        bne byte
+        jmp copy
+""",
+    # a taken and an untaken branch per flag, in a counted loop
+    "branches": """
+start:  ldx #$00
+loop:   txa
+        and #$01
+        beq even
+        bne odd
+even:   clc
+        bcs start
+        bcc next
+odd:    sec
+        bcc start
+next:   cpx #$80
+        bmi negative
+        bpl positive
+negative:
+        clv
+        bvs start
+positive:
+        dex
+        bne loop
+        jmp start
+""",
+}
+
+
+def workload_cpu(engine, name):
+    program = assemble(WORKLOADS[name], PROGRAM_START)
+    cpu = engine()
+    cpu.load_rom("snake.nes", synthesize=False)
+    cpu.reset()
+    cpu.bus.write_chunk(
+        program.origin, np.frombuffer(program.data, dtype=np.uint8)
+    )
+    cpu.program_counter.write(program.origin)
+    return cpu
+
+
+def micro_cpu(engine, opcodes):
+    program, jump_table = assemble_loop(opcodes)
+    cpu = engine()
+    cpu.load_rom("snake.nes", synthesize=False)
+    cpu.reset()
+    # every zero page pointer points into the data area
+    pointers = np.array([DATA & 0xFF, DATA >> 8] * 0x80, dtype=np.uint8)
+    cpu.bus.write_chunk(0x0000, pointers)
+    for i, target in enumerate(jump_table):
+        cpu.bus.write16(JUMP_TABLE + 2 * i, target)
+    cpu.bus.write(SUBROUTINE, 0x60)
+    cpu.bus.write_chunk(PROGRAM_START, np.array(program, dtype=np.uint8))
+    cpu.program_counter.write(PROGRAM_START)
+    return cpu
+
+
+def micro_benchmarks(engine, steps):
+    groups = {}
+    for opcode in range(0x100):
+        if benchmarkable(engine, opcode):
+            groups.setdefault(f"micro/op/{MNEMONICS[opcode]}", []).append(
+                opcode
+            )
+            groups.setdefault(f"micro/mode/{MODES[opcode]}", []).append(opcode)
+
+    def benchmark(opcodes):
+        def setup():
+            return micro_cpu(engine, opcodes)
+
+        def run(cpu):
+            cpu.main_loop(steps)
+            return steps
+
+        return setup, run
+
+    return {name: benchmark(groups[name]) for name in sorted(groups)}
+
+
+def macro_benchmarks(engine, frames, steps, replay=None):
+    # pulls in pygame, only needed for the snake workload
+    import snake
+
+    def nestest_setup():
+        return nestest_cpu(engine)
+
+    def nestest_run(cpu):
+        steps = len(load_reference()) - 1
+        cpu.main_loop(steps)
+        return steps
+
+    def snake_setup():
+        cpu = engine()
+        cpu.load_rom("snake.nes", synthesize=False)
+        cpu.reset()
+        rng = np.random.default_rng(0)
+        # boot up to the first pass of the game loop
+        snake.run_frame(cpu, rng)
+        return cpu, rng
+
+    def snake_run(state):
+        cpu, rng = state
+        return sum(snake.run_frame(cpu, rng) for _ in range(frames))
+
+    def startup_setup():
+        return None
+
+    def startup_run(_):
+        cpu = engine()
+        cpu.load_rom("snake.nes", synthesize=False)
+        cpu.reset()
+        return 0
+
+    # a fresh interpreter up to the first instruction, imports included
+    cold_start = (
+        f"from {engine.__module__} import {engine.__name__} as engine\n"
+        "cpu = engine()\n"
+        "cpu.load_rom('snake.nes', synthesize=False)\n"
+        "cpu.reset()\n"
+        "cpu.main_loop(1)\n"
+    )
+
+    def cold_start_run(_):
+        subprocess.run([sys.executable, "-c", cold_start], check=True)
+        return 0
+
+    def workload(name):
+        def setup():
+            return workload_cpu(engine, name)
+
+        def run(cpu):
+            cpu.main_loop(steps)
+            return steps
+
+        return setup, run
+
+    benchmarks = {
+        "macro/nestest": (nestest_setup, nestest_run),
+        "macro/snake_frames": (snake_setup, snake_run),
+        "macro/startup": (startup_setup, startup_run),
+        "macro/cold_start": (startup_setup, cold_start_run),
+    }
+    for name in WORKLOADS:
+        benchmarks[f"macro/{name}"] = workload(name)
+    if replay is not None:
+        # a recorded input movie, replayed headless from power on
+        rom, filepath = replay
+        recording = movie.Movie.load(filepath)
+
+        def replay_setup():
+            return movie.load(rom, engine)
+
+        def replay_run(cpu):
+            return movie.play(cpu, recording)[1]
+
+        benchmarks["macro/replay"] = (replay_setup, replay_run)
+    return benchmarks
+
+
+def measure(setup, run, repeat, memory):
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        instructions = run(state)
+        best = min(best, time.perf_counter() - start)
+
+    result = {
+        "instructions": instructions,
+        "seconds": best,
+        # process-wide high-water mark, in KiB on Linux
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if instructions:
+        result["instructions_per_second"] = instructions / best
+        result["ns_per_instruction"] = best / instructions * 1e9
+    if memory:
+        # separate pass, tracemalloc slows the emulator down by an order
+        # of magnitude and would skew the timings above
+        state = setup()
+        tracemalloc.start()
+        run(state)
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def format_result(name, result):
+    line = f"{name:<28}"
+    if result["instructions"]:
+        line += f"{result['instructions_per_second']:>12,.0f} instr/s"
+        line += f"{result['ns_per_instruction']:>14,.0f} ns/instr"
+    else:
+        line += f"{result['seconds'] * 1e3:>12,.2f} ms"
+    if "peak_memory_bytes" in result:
+        line += f"{result['peak_memory_bytes'] / 1024:>10,.0f} KiB peak"
+    return line
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        key = (
+            "ns_per_instruction"
+            if "ns_per_instruction" in result
+            else "seconds"
+        )
+        before = baseline[name][key]
+        after = result[key]
+        if after > before * (1 + threshold):
+            regressions.append((name, key, before, after))
+    return regressions
+
+
+def import_times(engine, top=15):
+    # (cumulative ms, module) of the slowest imports of a cold start, from
+    # python -X importtime
+    module = engine.__module__
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    times = []
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        times.append((int(cumulative) / 1e3, name.rstrip()))
+    return sorted(times, reverse=True)[:top]
+
+
+def load_engine(path):
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hines benchmarks")
+    parser.add_argument("--engine", default="cpu:CPU")
+    parser.add_argument("--only", choices=["micro", "macro"])
+    parser.add_argument("--filter", default="")
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--frames", type=int, default=3)
+    parser.add_argument("--replay", nargs=2, metavar=("ROM", "MOVIE"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", action="store_true")
+    parser.add_argument("--output")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument(
+        "--imports",
+        action="store_true",
+        help="list the slowest imports of the engine and exit",
+    )
+    args = parser.parse_args()
+
+    engine = load_engine(args.engine)
+    if args.imports:
+        for milliseconds, name in import_times(engine):
+            print(f"{milliseconds:>10,.2f} ms  {name}")
+        return 0
+    benchmarks = {}
+    if args.only != "macro":
+        benchmarks.update(micro_benchmarks(engine, args.steps))
+    if args.only != "micro":
+        benchmarks.update(
+            macro_benchmarks(engine, args.frames, args.steps, args.replay)
+        )
+
+    # unhandled bus accesses are still counted, only the log is quiet
+    logging.getLogger("diagnostics").setLevel(logging.ERROR)
+    results = {}
+    for name, (setup, run) in benchmarks.items():
+        if args.filter not in name:
+            continue
+        result = measure(setup, run, args.repeat, args.memory)
+        results[name] = result
+        print(format_result(name, result))
+
+    report = {
+        "meta": {
+            "engine": args.engine,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as fp:
+            json.dump(report, fp, indent=2)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    for name, key, before, after in regressions:
+        print(
+            f"REGRESSION {name}: {key} {before:.4g} -> {after:.4g}"
+            f" (+{after / before - 1:.1%})"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,5 +1,14 @@
+import mmap
+import os
+
 import numpy as np
 
+from apu import APU
+from controller import Controller
+from diagnostics import Diagnostics
+from disassembler import Disassembler
+from mappers import create_mapper
+from ppu import PPU
 from rom import ROM
 
 
@@ -10,27 +19,172 @@ class Bus:
     PPU_REGS_START = 0x2000
     PPU_REGS_SIZE = 0x8
     PPU_REGS_MIRRORS_END = 0x3FFF
+    IO_REGS_START = 0x4000
+    IO_REGS_SIZE = 0x20
+    OAM_DMA = 0x4014
+    CONTROLLER1 = 0x4016
+    CONTROLLER2 = 0x4017
+    PRG_RAM_START = 0x6000
+    PRG_RAM_SIZE = 0x2000
     PRG_ROM_START = 0x8000
-    PRG_ROM_SIZE = 0x4000
-    PRG_ROM_MIRRORS_END = 0xFFFF
 
     def __init__(self):
         self.cpu_vram = RAM(self.RAM_SIZE)
-        self.fake_io = FakeIO()
+        # counts what the bus can't serve, see `Diagnostics`
+        self.diagnostics = Diagnostics()
+        self.fake_io = FakeIO(self.diagnostics)
+        self.io = IO(self.IO_REGS_START, self.IO_REGS_SIZE, self.diagnostics)
+        # a $4016 write strobes both ports, $4017 writes go to the APU
+        self.controllers = (Controller(), Controller())
+        self.io.writers[self.CONTROLLER1 - self.IO_REGS_START] = self.strobe
+        port1, port2 = self.controllers
+        self.io.readers[self.CONTROLLER1 - self.IO_REGS_START] = port1.read
+        self.io.readers[self.CONTROLLER2 - self.IO_REGS_START] = port2.read
+        self.mapper = None
+        self.prg_ram = None
+        self.ppu = None
+        self.apu = None
+        self.disassembler = None
+        # devices clocked by the CPU, see `run_events`
+        self.devices = []
+        self.next_event = float("inf")
+        # interrupt lines, taken by the CPU between instructions. IRQ is
+        # shared, each device holds it down by adding itself to the set
+        self.nmi = False
+        self.irq = set()
+        # set by the CPU, devices timestamp register accesses with its cycles
+        self.cpu = None
+        # cycles the CPU loses to DMA, added once the instruction is done
+        self.stall = 0
+        self._build_page_table()
+
+    def load_rom(
+        self, filepath: str, persist: bool = False, synthesize: bool = True
+    ):
+        self.rom = ROM.shared(filepath)
+        # CHR goes to the PPU, which keeps it decoded
+        self.ppu = PPU(self.rom, self)
+        self.mapper = create_mapper(self.rom, self)
+        # battery carts only keep their <rom>.sav with `persist`, otherwise
+        # every run starts from a private blank PRG RAM
+        if self.rom.battery_ram and persist:
+            save = os.path.splitext(filepath)[0] + ".sav"
+            self.prg_ram = SaveRAM(save, self.PRG_RAM_SIZE)
+        else:
+            self.prg_ram = RAM(self.PRG_RAM_SIZE)
+        # the APU registers its $4000-$4017 handlers with `io`. headless runs
+        # turn `synthesize` off, nobody listens to them
+        self.apu = APU(self, synthesize=synthesize)
+        self.devices = [self.ppu, self.apu]
+        # mappers with a scanline counter are clocked like the PPU
+        if hasattr(self.mapper, "run_until"):
+            self.devices.append(self.mapper)
+        self.next_event = 0
+        self.io.writers[self.OAM_DMA - self.IO_REGS_START] = self.oam_dma
+        self._build_page_table()
+        self.mapper.reset()
+        self.disassembler = Disassembler(self)
+
+    def close(self):
+        if isinstance(self.prg_ram, SaveRAM):
+            self.prg_ram.close()
+        self.diagnostics.report()
+
+    def map_prg(self, start, size, bank):
+        # bank switching only repoints page table entries
+        pages = size >> 8
+        first = start >> 8
+        self.page_table[first : first + pages] = [(bank, start, size - 1)] * (
+            pages
+        )
+        if self.disassembler is not None:
+            self.disassembler.stale = True
+        self._rewatch()
+
+    def schedule(self, cycle):
+        self.next_event = min(self.next_event, cycle)
+
+    def run_events(self, cycle):
+        # catch every device up to `cycle`, each one returns the cycle of its
+        # next event so the CPU only calls back when something is due
+        self.next_event = float("inf")
+        for device in self.devices:
+            self.schedule(device.run_until(cycle))
+
+    def oam_dma(self, page):
+        # 256 bytes from $XX00 in one copy instead of 256 bus round trips
+        start = int(page) << 8
+        component, _, mask = self.page_table[int(page)]
+        if mask is not None and hasattr(component, "read_chunk"):
+            data = self.read_chunk(start, 0x100)
+        else:
+            data = np.array(
+                [self.read(start + i) for i in range(0x100)], dtype=np.uint8
+            )
+        self.ppu.write_oam(data)
+        # 513 cycles, plus one to align on odd cycles, see `CPU.service_events`
+        self.stall += 513
+        self.next_event = 0
 
-    def load_rom(self, filepath: str):
-        self.rom = ROM(filepath)
-        self.PRG_ROM_SIZE = self.rom.number_prg_rom_banks * 0x4000
-        self.prg_rom = RAM(self.PRG_ROM_SIZE)
-        # self.chr_rom = RAM(self.CHR_ROM_SIZE)
+    def strobe(self, data):
+        for controller in self.controllers:
+            controller.write(data)
 
-        self.prg_rom.write_chunk(0x0000, self.rom.prg_rom_data)
-        # self.chr_rom.write_chunk(0x0000, self.rom.chr_rom_data)
+    def request_nmi(self):
+        self.nmi = True
+        # taken after the current instruction
+        self.next_event = 0
+
+    def _build_page_table(self):
+        # one entry per 256-byte page: (component, region start, mirror mask)
+        # a mask of None means the access is not supported and goes to
+        # FakeIO
+        self.page_table = [(self.fake_io, 0, None)] * 0x100
+        self._map_pages(
+            self.RAM_START,
+            self.RAM_MIRRORS_END,
+            self.cpu_vram,
+            self.RAM_SIZE - 1,
+        )
+        if self.ppu is not None:
+            self._map_pages(
+                self.PPU_REGS_START,
+                self.PPU_REGS_MIRRORS_END,
+                self.ppu,
+                self.PPU_REGS_SIZE - 1,
+            )
+        else:
+            self._map_pages(
+                self.PPU_REGS_START,
+                self.PPU_REGS_MIRRORS_END,
+                self.fake_io,
+                None,
+            )
+        # $4000-$401F, the rest of the page is cartridge space
+        self._map_pages(
+            self.IO_REGS_START, self.IO_REGS_START + 0xFF, self.io, 0xFF
+        )
+        if self.prg_ram is not None:
+            self._map_pages(
+                self.PRG_RAM_START,
+                self.PRG_RAM_START + self.PRG_RAM_SIZE - 1,
+                self.prg_ram,
+                self.PRG_RAM_SIZE - 1,
+            )
+        self._rewatch()
+
+    def _rewatch(self):
+        # remapped pages lose their watchpoint proxies, put them back
+        debugger = None if self.cpu is None else self.cpu.debugger
+        if debugger is not None and debugger.watchpoints:
+            debugger.wrap_pages()
+
+    def _map_pages(self, start, end, component, mask):
+        for page in range(start >> 8, (end >> 8) + 1):
+            self.page_table[page] = (component, start, mask)
 
     def read(self, address: np.uint16):
         component, address = self._memory_map(address)
-        if address is None:
-            return component.read()
         return component.read(address)
 
     def read16(self, address: np.uint16, page_wrap: bool = False):
@@ -44,10 +198,7 @@ class Bus:
 
     def write(self, address: np.uint16, data: np.uint8):
         component, address = self._memory_map(address)
-        if address is None:
-            component.write(data)
-        else:
-            component.write(address, data)
+        component.write(address, data)
 
     def write16(self, address, data):
         component, address = self._memory_map(address)
@@ -59,22 +210,11 @@ class Bus:
         component.write_chunk(address, data)
 
     def _memory_map(self, address):
-        if self.RAM_START <= address <= self.RAM_MIRRORS_END:
-            address -= self.RAM_START
-            address &= np.uint16(self.RAM_SIZE - 1)
-            return self.cpu_vram, address
-        elif self.PPU_REGS_START <= address <= self.PPU_REGS_MIRRORS_END:
-            address -= self.PPU_REGS_START
-            address &= np.uint16(self.PPU_REGS_SIZE - 1)
-            print("PPU not supported yet")
-            return self.fake_io, None
-        elif self.PRG_ROM_START <= address <= self.PRG_ROM_MIRRORS_END:
-            address -= self.PRG_ROM_START
-            address &= np.uint16(self.PRG_ROM_SIZE - 1)
-            return self.prg_rom, address
-        else:
-            print(f"Ignoring mem access at {hex(address)}")
-            return self.fake_io, None
+        component, start, mask = self.page_table[address >> 8]
+        if mask is None:
+            # unhandled, FakeIO reports it by its full address
+            return component, address
+        return component, (address - start) & mask
 
 
 class RAM:
@@ -118,12 +258,92 @@ class RAM:
         return np.uint16((hi.astype(np.uint16) << 8) + lo.astype(np.uint16))
 
 
+class SaveRAM(RAM):
+    # battery backed PRG RAM, the array is a view of the mmap'd save file so
+    # loading copies nothing and stores only mark their OS page dirty
+    def __init__(self, filepath, size):
+        mode = "r+b" if os.path.exists(filepath) else "w+b"
+        self.file = open(filepath, mode)
+        if os.path.getsize(filepath) < size:
+            self.file.truncate(size)
+        self.mmap = mmap.mmap(self.file.fileno(), size)
+        self.data = np.frombuffer(self.mmap, dtype=np.uint8)
+        self.dirty = np.zeros((-(-size // mmap.PAGESIZE),), dtype=bool)
+
+    def write(self, address, data):
+        super().write(address, data)
+        self.dirty[int(address) // mmap.PAGESIZE] = True
+
+    def write16(self, address, data):
+        super().write16(address, data)
+        self.dirty[int(address) // mmap.PAGESIZE] = True
+        self.dirty[(int(address) + 1) // mmap.PAGESIZE] = True
+
+    def write_chunk(self, address, data):
+        super().write_chunk(address, data)
+        first = int(address) // mmap.PAGESIZE
+        last = (int(address) + data.shape[0] - 1) // mmap.PAGESIZE
+        self.dirty[first : last + 1] = True
+
+    def flush(self):
+        # only the pages written since the last flush go to disk
+        for page in np.flatnonzero(self.dirty):
+            self.mmap.flush(
+                int(page) * mmap.PAGESIZE,
+                min(mmap.PAGESIZE, len(self.mmap) - int(page) * mmap.PAGESIZE),
+            )
+        self.dirty[:] = False
+
+    def __deepcopy__(self, memo):
+        # copies, e.g. emulator snapshots, are detached from the save file
+        ram = RAM(self.data.shape[0])
+        ram.data[:] = self.data
+        return ram
+
+    def close(self):
+        self.flush()
+        # the array holds an export of the mmap buffer, it has to go first
+        del self.data
+        self.mmap.close()
+        self.file.close()
+
+
+class IO:
+    # APU and I/O registers, each one is handled by the device registered
+    # for its offset in `readers`/`writers`
+    def __init__(self, start, size, diagnostics):
+        self.start = start
+        self.size = size
+        self.diagnostics = diagnostics
+        self.readers = {}
+        self.writers = {}
+
+    def read(self, address):
+        reader = self.readers.get(int(address))
+        if reader is None:
+            self.diagnostics.unhandled(self.start + address)
+            return np.uint8(0)
+        return reader()
+
+    def write(self, address, data):
+        writer = self.writers.get(int(address))
+        if writer is None:
+            self.diagnostics.unhandled(self.start + address, write=True)
+            return
+        writer(data)
+
+
 class FakeIO:
-    def read(*args, **kwargs):
-        ...
+    def __init__(self, diagnostics):
+        self.diagnostics = diagnostics
+
+    def read(self, address):
+        # unmapped reads see 0 instead of breaking the instruction
+        self.diagnostics.unhandled(address)
+        return np.uint8(0)
 
-    def write(*args, **kwargs):
-        ...
+    def write(self, address, data):
+        self.diagnostics.unhandled(address, write=True)
 
 
 if __name__ == "__main__":
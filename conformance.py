@@ -0,0 +1,208 @@
+import os
+import re
+
+import numpy as np
+
+from cpu import CPU
+from opcodes import SIZES
+
+NESTEST_ROM = "nestest.nes"
+NESTEST_LOG = "logs/nestest.log"
+
+STATE_DTYPE = np.dtype(
+    [
+        ("pc", "<u2"),
+        ("size", "u1"),
+        ("bytes", "u1", (3,)),
+        ("a", "u1"),
+        ("x", "u1"),
+        ("y", "u1"),
+        ("p", "u1"),
+        ("sp", "u1"),
+        ("cycle", "<u8"),
+    ]
+)
+
+LINE_PATTERN = re.compile(
+    r"^(?P<pc>[0-9A-F]{4})  (?P<bytes>(?:[0-9A-F]{2} ){1,3}).*"
+    r"A:(?P<a>[0-9A-F]{2}) X:(?P<x>[0-9A-F]{2}) Y:(?P<y>[0-9A-F]{2}) "
+    r"P:(?P<p>[0-9A-F]{2}) SP:(?P<sp>[0-9A-F]{2}) .*CYC:(?P<cycle>\d+)"
+)
+
+
+def load_reference(log=NESTEST_LOG):
+    # parsed once and cached next to the log, reparsed if the log is newer
+    cache = os.path.splitext(log)[0] + ".npy"
+    if os.path.exists(cache):
+        if os.path.getmtime(cache) >= os.path.getmtime(log):
+            return np.load(cache)
+
+    with open(log) as fp:
+        lines = fp.readlines()
+    reference = np.zeros((len(lines),), dtype=STATE_DTYPE)
+    for i, line in enumerate(lines):
+        match = LINE_PATTERN.match(line)
+        assert match is not None, f"Unexpected line {i + 1} in {log}"
+        opcode_bytes = [int(x, 16) for x in match["bytes"].split()]
+        reference[i]["pc"] = int(match["pc"], 16)
+        reference[i]["size"] = len(opcode_bytes)
+        reference[i]["bytes"][: len(opcode_bytes)] = opcode_bytes
+        for field in ("a", "x", "y", "p", "sp"):
+            reference[i][field] = int(match[field], 16)
+        reference[i]["cycle"] = int(match["cycle"])
+    np.save(cache, reference)
+    return reference
+
+
+def probe(cpu, state):
+    pc = cpu.program_counter.read()
+    opcode = cpu.bus.read(pc)
+    size = SIZES[opcode]
+    state["pc"] = pc
+    state["size"] = size
+    state["bytes"] = 0
+    state["bytes"][0] = opcode
+    for offset in range(1, size):
+        state["bytes"][offset] = cpu.bus.read(pc + np.uint16(offset))
+    state["a"] = cpu.accumulator.data
+    state["x"] = cpu.register_x.data
+    state["y"] = cpu.register_y.data
+    state["p"] = cpu.status.read()
+    state["sp"] = cpu.stack_pointer.data
+    state["cycle"] = cpu.cycles
+    return opcode
+
+
+def format_state(state):
+    opcode_bytes = " ".join(
+        f"{byte:02X}" for byte in state["bytes"][: state["size"]]
+    )
+    return (
+        f"{state['pc']:04X}  {opcode_bytes:<8}  "
+        f"A:{state['a']:02X} X:{state['x']:02X} Y:{state['y']:02X} "
+        f"P:{state['p']:02X} SP:{state['sp']:02X} CYC:{state['cycle']}"
+    )
+
+
+class Mismatch:
+    def __init__(self, step, fields, expected, actual, start):
+        self.step = step
+        self.fields = fields
+        self.expected = expected
+        self.actual = actual
+        self.start = start
+
+    def __str__(self):
+        lines = [f"Mismatch at step {self.step} on {', '.join(self.fields)}"]
+        for name, states in (
+            ("expected", self.expected),
+            ("actual", self.actual),
+        ):
+            lines.append(f"{name}:")
+            for offset, state in enumerate(states):
+                marker = ">" if self.start + offset == self.step else " "
+                lines.append(f"{marker} {format_state(state)}")
+        return "\n".join(lines)
+
+
+class ConformanceResult:
+    def __init__(self, steps, total, mismatch=None):
+        self.steps = steps
+        self.total = total
+        self.mismatch = mismatch
+
+    @property
+    def passed(self):
+        return self.mismatch is None and self.steps == self.total
+
+    def __str__(self):
+        summary = (
+            f"Lines executed: {self.steps}/{self.total}"
+            f" ({self.steps / self.total:.1%})"
+        )
+        if self.mismatch is None:
+            return summary
+        return f"{summary}\n{self.mismatch}"
+
+
+def nestest_cpu(engine=CPU, rom=NESTEST_ROM):
+    cpu = engine()
+    cpu.load_rom(rom, synthesize=False)
+    cpu.reset()
+    # automated mode starts at $C000 instead of the reset vector
+    cpu.program_counter.write(0xC000)
+    # the reset sequence decrements SP three times without writing, so a
+    # real 6502 comes out of it with SP = $FD, which is what the log has
+    cpu.stack_pointer.write(0xFD)
+    return cpu
+
+
+def run_nestest(
+    engine=CPU,
+    rom=NESTEST_ROM,
+    log=NESTEST_LOG,
+    chunk_size=1024,
+    context=3,
+    fields=STATE_DTYPE.names,
+):
+    reference = load_reference(log)
+    cpu = nestest_cpu(engine, rom)
+    actual = np.zeros((len(reference),), dtype=STATE_DTYPE)
+
+    for start in range(0, len(reference), chunk_size):
+        stop = min(start + chunk_size, len(reference))
+        error = None
+        step = start
+        try:
+            for step in range(start, stop):
+                opcode = probe(cpu, actual[step])
+                # the last reference line is only compared, never executed
+                if step + 1 < len(reference):
+                    cpu.operation(opcode)
+        except Exception as e:
+            # keep what was probed so far, the divergence may explain it
+            error = e
+            stop = step + 1
+
+        mismatch = _first_mismatch(
+            reference, actual, start, stop, context, fields
+        )
+        if mismatch is not None:
+            return ConformanceResult(mismatch.step, len(reference), mismatch)
+        if error is not None:
+            raise error
+
+    return ConformanceResult(len(reference), len(reference))
+
+
+def _first_mismatch(reference, actual, start, stop, context, fields):
+    mask = np.zeros((stop - start,), dtype=bool)
+    for field in fields:
+        differs = reference[field][start:stop] != actual[field][start:stop]
+        if differs.ndim > 1:
+            differs = differs.any(axis=1)
+        mask |= differs
+    hits = np.flatnonzero(mask)
+    if not hits.size:
+        return None
+
+    step = start + int(hits[0])
+    differing = [
+        field
+        for field in fields
+        if np.any(reference[step][field] != actual[step][field])
+    ]
+    context_start = max(step - context, 0)
+    return Mismatch(
+        step=step,
+        fields=differing,
+        expected=reference[context_start : step + context + 1],
+        actual=actual[context_start : step + 1],
+        start=context_start,
+    )
+
+
+if __name__ == "__main__":
+    result = run_nestest()
+    print(result)
+    raise SystemExit(0 if result.passed else 1)
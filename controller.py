@@ -0,0 +1,37 @@
+import numpy as np
+
+# standard controller buttons, in the order they are shifted out
+A = 0x01
+B = 0x02
+SELECT = 0x04
+START = 0x08
+UP = 0x10
+DOWN = 0x20
+LEFT = 0x40
+RIGHT = 0x80
+
+# upper bits of $4016/$4017 reads are open bus, usually the $40 of the
+# address high byte
+OPEN_BUS = 0x40
+
+
+class Controller:
+    def __init__(self):
+        # buttons held right now, set by the frontend or a movie
+        self.buttons = 0
+        self.strobe = False
+        self.shift = 0
+
+    def write(self, data):
+        # while the strobe is high the shift register keeps reloading
+        self.strobe = bool(int(data) & 0x01)
+        if self.strobe:
+            self.shift = self.buttons
+
+    def read(self):
+        if self.strobe:
+            self.shift = self.buttons
+        bit = self.shift & 0x01
+        # official controllers read 1 after the 8th button
+        self.shift = (self.shift >> 1) | 0x80
+        return np.uint8(OPEN_BUS | bit)
@@ -1,8 +1,10 @@
-from datetime import datetime
+from itertools import count
+from time import perf_counter_ns
 
 import numpy as np
 
 from bus import Bus
+from opcodes import CYCLES, PAGE_PENALTY
 
 # https://skilldrick.github.io/easy6502/
 # https://bugzmanov.github.io/nes_ebook/
@@ -21,22 +23,138 @@ class CPU:
         self.program_counter = Register(dtype=np.uint16)
         self.status = Status()
         self.bus = Bus()
-        self.log = log is not None
-        if self.log:
-            self.log_file = open(
-                f"logs/{log}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log",
-                "w",
-            )
+        self.bus.cpu = self
+        self.cycles = 0
+        self.page_crossed = False
+        self.tracer = None
+        self.write_tracer = None
+        if log is not None:
+            # only needed when tracing, kept out of the startup path
+            from datetime import datetime
+
+            from tracer import WRITE_DTYPE, TraceWriter
+
+            log = f"logs/{log}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            self.tracer = TraceWriter(f"{log}.trace")
+            self.write_tracer = TraceWriter(f"{log}.writes", WRITE_DTYPE)
+        self.profiler = None
+        self.debugger = None
+        self._select_loop()
+
+    def main_loop(self, steps=None):
+        steps = count() if steps is None else range(steps)
+        self._run(steps)
+
+    def attach_profiler(self, profiler):
+        self.profiler = profiler
+        self._select_loop()
+
+    def detach_profiler(self):
+        self.profiler = None
+        self._select_loop()
+
+    def _select_loop(self):
+        # pick the loop once instead of checking for instrumentation on
+        # every step, the plain loop pays nothing for the unused features
+        if self.debugger is not None and self.debugger.active:
+            self._run = self._debug_loop
+        elif self.profiler is not None:
+            self._run = self._profiled_loop
+        elif self.tracer is not None:
+            self._run = self._traced_loop
+        else:
+            self._run = self._loop
 
-    def main_loop(self):
-        while True:
-            if self.log:
-                curr_pc = np.base_repr(self.program_counter.read(), 16)
-                curr_pc = "0" * (4 - len(curr_pc)) + curr_pc
-                self.log_file.write(f"{curr_pc}\n")
+    def _loop(self, steps):
+        for _ in steps:
             opcode = self.bus.read(self.program_counter.read())
             self.operation(opcode)
 
+    def _traced_loop(self, steps):
+        # shadow the bus writes only while tracing, the plain loop stays as is
+        self.bus.write = self._traced_write
+        self.bus.write16 = self._traced_write16
+        try:
+            for _ in steps:
+                opcode = self.bus.read(self.program_counter.read())
+                self.trace(opcode)
+                self.operation(opcode)
+        finally:
+            del self.bus.write, self.bus.write16
+            self.tracer.flush()
+            self.write_tracer.flush()
+
+    def _debug_loop(self, steps):
+        debugger = self.debugger
+        breakpoints = debugger.breakpoints
+        debugger.stop = None
+        # don't stop again on the breakpoint the last run stopped at, any
+        # other PC, including a fresh run's first one, is checked
+        resume = debugger.resume_pc
+        debugger.resume_pc = None
+        try:
+            for _ in steps:
+                pc = int(self.program_counter.data)
+                if pc in breakpoints and pc != resume:
+                    if debugger.check_breakpoint(pc):
+                        debugger.resume_pc = pc
+                        return
+                resume = None
+                debugger.pc = pc
+                self.operation(self.bus.read(pc))
+                # watchpoints let the instruction finish, then stop here
+                if debugger.stop is not None:
+                    return
+        finally:
+            debugger.pc = None
+
+    def _profiled_loop(self, steps):
+        opcode_counts = self.profiler.opcode_counts
+        pc_counts = self.profiler.pc_counts
+        handler_ns = self.profiler.handler_ns
+        handler_samples = self.profiler.handler_samples
+        sample_every = self.profiler.sample_every
+        for step in steps:
+            pc = self.program_counter.read()
+            opcode = self.bus.read(pc)
+            opcode_counts[opcode] += 1
+            pc_counts[pc] += 1
+            if step % sample_every:
+                self.operation(opcode)
+            else:
+                start = perf_counter_ns()
+                self.operation(opcode)
+                handler_ns[opcode] += perf_counter_ns() - start
+                handler_samples[opcode] += 1
+
+    def _traced_write(self, address, data):
+        self.write_tracer.record(self.tracer.head - 1, address, data)
+        Bus.write(self.bus, address, data)
+
+    def _traced_write16(self, address, data):
+        step = self.tracer.head - 1
+        self.write_tracer.record(step, address, data & 0xFF)
+        self.write_tracer.record(step, address + 1, (data >> 8) & 0xFF)
+        Bus.write16(self.bus, address, data)
+
+    def trace(self, opcode):
+        self.tracer.record(
+            self.program_counter.data,
+            opcode,
+            self.accumulator.data,
+            self.register_x.data,
+            self.register_y.data,
+            self.status.read(),
+            self.stack_pointer.data,
+            self.cycles,
+        )
+
+    def close(self):
+        if self.tracer is not None:
+            self.tracer.close()
+            self.write_tracer.close()
+        self.bus.close()
+
     def reset(self):
         self.accumulator.write(0)
         self.register_x.write(0)
@@ -44,9 +162,13 @@ class CPU:
         self.status.reset()
         self.program_counter.write(self.bus.read16(0xFFFC))
         self.stack_pointer.write(0xFF)
+        # the reset sequence takes 7 cycles before the first instruction
+        self.cycles = 7
 
-    def load_rom(self, filepath: str):
-        self.bus.load_rom(filepath)
+    def load_rom(
+        self, filepath: str, persist: bool = False, synthesize: bool = True
+    ):
+        self.bus.load_rom(filepath, persist, synthesize)
 
     def stack_push(self, data: np.uint8):
         if self.stack_pointer.read() == np.uint8(0x00):
@@ -77,6 +199,7 @@ class CPU:
         return data
 
     def operation(self, opcode):
+        self.page_crossed = False
         match opcode:
             case 0x69:
                 self.adc("immediate")
@@ -678,6 +801,36 @@ class CPU:
 
         self.status.break_command = False
         self.program_counter.increment()
+        self.cycles += CYCLES[opcode]
+        if self.page_crossed and PAGE_PENALTY[opcode]:
+            self.cycles += 1
+        if self.cycles >= self.bus.next_event:
+            self.service_events()
+
+    def service_events(self):
+        bus = self.bus
+        if bus.stall:
+            # DMA halts the CPU, one more cycle if it started on an odd one
+            self.cycles += bus.stall + (self.cycles & 1)
+            bus.stall = 0
+        bus.run_events(self.cycles)
+        if bus.nmi:
+            bus.nmi = False
+            self.interrupt(0xFFFA)
+        elif bus.irq:
+            if self.status.interrupt_flag:
+                # the line is level triggered, keep polling until unmasked
+                bus.schedule(self.cycles)
+            else:
+                self.interrupt(0xFFFE)
+
+    def interrupt(self, vector):
+        # like brk, but the pushed status has the B flag clear
+        self.stack_push16(self.program_counter.read())
+        self.stack_push(self.status.read())
+        self.status.interrupt_flag = True
+        self.program_counter.write(self.bus.read16(vector))
+        self.cycles += 7
 
     def load_operation_arg(self, addressing_mode):
         match addressing_mode:
@@ -712,18 +865,16 @@ class CPU:
                 return address
             case "absolute_x":
                 self.program_counter.increment()
-                address = (
-                    self.bus.read16(self.program_counter.read())
-                    + self.register_x.read()
-                )
+                base = self.bus.read16(self.program_counter.read())
+                address = base + self.register_x.read()
+                self.page_crossed = (base ^ address) > 0xFF
                 self.program_counter.increment()
                 return address
             case "absolute_y":
                 self.program_counter.increment()
-                address = (
-                    self.bus.read16(self.program_counter.read())
-                    + self.register_y.read()
-                )
+                base = self.bus.read16(self.program_counter.read())
+                address = base + self.register_y.read()
+                self.page_crossed = (base ^ address) > 0xFF
                 self.program_counter.increment()
                 return address
             case "indirect":
@@ -744,10 +895,9 @@ class CPU:
             case "indirect_y":
                 self.program_counter.increment()
                 reference = self.bus.read(self.program_counter.read())
-                address = (
-                    self.bus.read16(reference, page_wrap=True)
-                    + self.register_y.read()
-                )
+                base = self.bus.read16(reference, page_wrap=True)
+                address = base + self.register_y.read()
+                self.page_crossed = (base ^ address) > 0xFF
                 return address
             case _:
                 raise ValueError(f"Invalid addressing mode {addressing_mode}")
@@ -1240,7 +1390,13 @@ class CPU:
         data = self.bus.read(self.load_operation_arg("immediate"))
         if condition:
             offset = data.astype(np.int8)
-            self.program_counter.write(self.program_counter.read() + offset)
+            origin = self.program_counter.read()
+            self.program_counter.write(origin + offset)
+            # +1 cycle for a taken branch, +1 more if it lands on another page
+            self.cycles += 1
+            next_address = int(origin) + 1
+            if next_address >> 8 != (next_address + int(offset)) >> 8:
+                self.cycles += 1
 
     def _compare(self, register, mode):
         data = self.bus.read(self.load_operation_arg(mode))
@@ -1344,59 +1500,6 @@ class Status:
 
 
 if __name__ == "__main__":
-    import re
-
-    def hex_format(data, n_bytes=1):
-        hex_repr = np.base_repr(data, 16)
-        return "0" * (2 * n_bytes - len(hex_repr)) + hex_repr
-
-    def print_binaries(d1, d2):
-        # to debug process status register, d1 is str (p variable), d2 is int
-        d1 = bin(int(d1, 16))[2:]
-        print("0" * (8 - len(d1)) + d1)
-        d2 = bin(d2)[2:]
-        print("0" * (8 - len(d2)) + d2)
-
-    with open("logs/nestest.log") as fp:
-        test_lines = fp.readlines()
-
-    test = [
-        {
-            "addr": x[:4],
-            # "op": re.search(r"  ([0-9A-F]{2})", x).group(1),
-            "A": re.search(r"A:([0-9A-F]{2}) ", x).group(1),
-            "X": re.search(r"X:([0-9A-F]{2}) ", x).group(1),
-            "Y": re.search(r"Y:([0-9A-F]{2}) ", x).group(1),
-            "P": re.search(r"P:([0-9A-F]{2}) ", x).group(1),
-            "SP": re.search(r"SP:([0-9A-F]{2}) ", x).group(1),
-        }
-        for x in test_lines
-    ]
-
-    cpu = CPU(log="nestest")
-    cpu.load_rom("nestest.nes")
-    cpu.reset()
-    cpu.program_counter.write(0xC000)
-
-    # TODO: I don't know why but the SP starts at 0xFD for this ROM
-    cpu.stack_push16(0x0000)
-
-    log_str = "{addr}  A:{A} X:{X} Y:{Y} P:{P} SP:{SP}\n"
-
-    for i in range(len(test)):
-        pc = hex_format(cpu.program_counter.read(), n_bytes=2)
-        a = hex_format(cpu.accumulator.read())
-        x = hex_format(cpu.register_x.read())
-        y = hex_format(cpu.register_y.read())
-        p = hex_format(cpu.status.read())
-        sp = hex_format(cpu.stack_pointer.read())
-        info_dict = {"addr": pc, "A": a, "X": x, "Y": y, "P": p, "SP": sp}
-
-        cpu.log_file.write(log_str.format(**info_dict))
-        if info_dict != test[i]:
-            break
-        opcode = cpu.bus.read(cpu.program_counter.read())
-        cpu.operation(opcode)
-
-    cpu.log_file.close()
-    print(f"Lines executed: {i}/{(len(test)-1)} ({i/(len(test)-1):.1%})")
+    from conformance import run_nestest
+
+    print(run_nestest())
@@ -0,0 +1,216 @@
+import numpy as np
+
+
+class Stop:
+    def __init__(self, reason, pc, address=None, value=None, instruction=None):
+        self.reason = reason
+        self.pc = pc
+        self.address = address
+        self.value = value
+        self.instruction = instruction
+
+    def __repr__(self):
+        pc = "----" if self.pc is None else f"{self.pc:04X}"
+        text = f"{self.reason} at PC {pc}"
+        if self.instruction is not None:
+            text += f" ({self.instruction})"
+        if self.address is not None:
+            text += f", ${self.address:04X} = {self.value:02X}"
+        return text
+
+
+class Debugger:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.breakpoints = {}
+        self.watchpoints = []
+        # per-address lookups used by the watched pages, indexed by CPU address
+        self.watch_reads = np.zeros((0x10000,), dtype=bool)
+        self.watch_writes = np.zeros((0x10000,), dtype=bool)
+        self.stop = None
+        # address of the instruction being executed, set by the debug loop
+        # and None outside of it
+        self.pc = None
+        # PC of the last breakpoint hit, the next run steps over it once
+        self.resume_pc = None
+        cpu.debugger = self
+
+    @property
+    def active(self):
+        return bool(self.breakpoints or self.watchpoints)
+
+    def run(self, steps=None):
+        self.cpu.main_loop(steps)
+        return self.stop
+
+    def add_breakpoint(self, pc, condition=None):
+        # `condition(cpu)` is evaluated when PC hits, it stops if truthy
+        was_active = self.active
+        self.breakpoints[pc] = condition
+        if not was_active:
+            self.cpu._select_loop()
+
+    def remove_breakpoint(self, pc):
+        del self.breakpoints[pc]
+        if not self.active:
+            self.cpu._select_loop()
+
+    def add_watchpoint(
+        self, start, end=None, read=False, write=True, condition=None
+    ):
+        # `condition(address, value)` filters hits, like for breakpoints
+        end = start if end is None else end
+        was_active = self.active
+        self.watchpoints.append((start, end, read, write, condition))
+        self._install_watchpoints()
+        if not was_active:
+            self.cpu._select_loop()
+
+    def remove_watchpoint(self, start, end=None):
+        end = start if end is None else end
+        self.watchpoints = [
+            watchpoint
+            for watchpoint in self.watchpoints
+            if watchpoint[:2] != (start, end)
+        ]
+        self._install_watchpoints()
+        if not self.active:
+            self.cpu._select_loop()
+
+    def clear(self):
+        self.breakpoints.clear()
+        self.watchpoints.clear()
+        self._install_watchpoints()
+        self.cpu._select_loop()
+
+    def check_breakpoint(self, pc):
+        condition = self.breakpoints[pc]
+        if condition is None or condition(self.cpu):
+            self.stop = Stop("breakpoint", pc, instruction=self._text(pc))
+            return True
+        return False
+
+    def watch_hit(self, reason, address, value):
+        # `address` is canonical, a watch on any mirror of it matches
+        for start, end, read, write, condition in self.watchpoints:
+            if address not in self.canonical(start, end):
+                continue
+            if not (read if reason == "read" else write):
+                continue
+            if condition is None or condition(address, value):
+                # the instruction finishes first, the loop stops after it.
+                # accesses from outside the loop, e.g. the host poking RAM,
+                # are reported at the current PC
+                pc = self.pc
+                if pc is None:
+                    pc = int(self.cpu.program_counter.read())
+                self.stop = Stop(
+                    f"{reason} watchpoint",
+                    pc,
+                    address,
+                    int(value),
+                    self._text(pc),
+                )
+                return
+
+    def _text(self, pc):
+        disassembler = self.cpu.bus.disassembler
+        return None if disassembler is None else disassembler.text(pc)
+
+    def canonical(self, start, end):
+        # addresses in [start, end] folded onto the first copy of their
+        # mirrored region, unmapped ones stay as they are
+        regions = [
+            (region_start, 0xFFFF) if mask is None else (region_start, mask)
+            for _, region_start, mask in self.cpu.bus.page_table
+        ]
+        addresses = np.arange(start, end + 1)
+        region_starts, masks = np.array(regions)[addresses >> 8].T
+        return (region_starts + ((addresses - region_starts) & masks)) & 0xFFFF
+
+    def _install_watchpoints(self):
+        bus = self.cpu.bus
+        # drop the old proxies, unwatched pages go back to their component
+        for page, (component, start, mask) in enumerate(bus.page_table):
+            if isinstance(component, WatchedPage):
+                bus.page_table[page] = (component.component, start, mask)
+
+        self.watch_reads[:] = False
+        self.watch_writes[:] = False
+        for start, end, read, write, _ in self.watchpoints:
+            for page in range(start >> 8, (end >> 8) + 1):
+                _, _, mask = bus.page_table[page]
+                assert mask is not None, f"Can't watch ${page << 8:04X}"
+            # the proxies look hits up by canonical address
+            addresses = self.canonical(start, end)
+            self.watch_reads[addresses] |= read
+            self.watch_writes[addresses] |= write
+        self.wrap_pages()
+
+    def wrap_pages(self):
+        # puts the proxies on every page that reaches a watched address,
+        # mirrors included. the bus calls this again after a bank switch or
+        # remap replaced page table entries. pages with nothing mapped yet
+        # are wrapped once something is
+        bus = self.cpu.bus
+        watched = self.watch_reads | self.watch_writes
+        pages = watched[self.canonical(0x0000, 0xFFFF)].reshape(0x100, 0x100)
+        for page in np.flatnonzero(pages.any(axis=1)):
+            component, region_start, mask = bus.page_table[page]
+            if mask is not None and not isinstance(component, WatchedPage):
+                component = WatchedPage(component, region_start, self)
+                bus.page_table[page] = (component, region_start, mask)
+
+
+class WatchedPage:
+    # stands in for a component in the bus page table, only on watched pages
+    def __init__(self, component, region_start, debugger):
+        self.component = component
+        # component addresses are offsets from here, mirrors fold onto it
+        self.region_start = region_start
+        self.debugger = debugger
+
+    def _address(self, address):
+        return (self.region_start + int(address)) & 0xFFFF
+
+    def _check(self, lookup, reason, address, value):
+        address = self._address(address)
+        if lookup[address]:
+            self.debugger.watch_hit(reason, address, value)
+
+    def read(self, address):
+        value = self.component.read(address)
+        self._check(self.debugger.watch_reads, "read", address, value)
+        return value
+
+    def read16(self, address, page_wrap=False):
+        value = self.component.read16(address, page_wrap=page_wrap)
+        self._check(self.debugger.watch_reads, "read", address, value & 0xFF)
+        self._check(self.debugger.watch_reads, "read", address + 1, value >> 8)
+        return value
+
+    def read_chunk(self, address, size):
+        data = self.component.read_chunk(address, size)
+        for offset, value in enumerate(data):
+            self._check(
+                self.debugger.watch_reads, "read", address + offset, value
+            )
+        return data
+
+    def write(self, address, data):
+        self.component.write(address, data)
+        self._check(self.debugger.watch_writes, "write", address, data)
+
+    def write16(self, address, data):
+        self.component.write16(address, data)
+        self._check(self.debugger.watch_writes, "write", address, data & 0xFF)
+        self._check(
+            self.debugger.watch_writes, "write", address + 1, data >> 8
+        )
+
+    def write_chunk(self, address, data):
+        self.component.write_chunk(address, data)
+        for offset, value in enumerate(data):
+            self._check(
+                self.debugger.watch_writes, "write", address + offset, value
+            )
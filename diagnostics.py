@@ -0,0 +1,67 @@
+import bisect
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# CPU address space, for reporting where an unhandled access landed
+REGIONS = (
+    (0x0000, "ram"),
+    (0x2000, "ppu"),
+    (0x4000, "io"),
+    (0x4020, "expansion"),
+    (0x6000, "prg_ram"),
+    (0x8000, "prg_rom"),
+)
+_STARTS = [start for start, _ in REGIONS]
+
+
+class UnhandledAccess(Exception):
+    pass
+
+
+def region(address):
+    return REGIONS[bisect.bisect_right(_STARTS, address) - 1][1]
+
+
+class Diagnostics:
+    # accesses the bus can't serve are counted per region and per address,
+    # the first `limit` of each address are logged and the rest only
+    # counted, so a ROM polling a missing register doesn't flood the log or
+    # slow the loop down. `strict` raises instead, for test runs
+    def __init__(self, strict=False, limit=3):
+        self.strict = strict
+        self.limit = limit
+        self.regions = Counter()
+        self.addresses = Counter()
+
+    def __len__(self):
+        return sum(self.regions.values())
+
+    def unhandled(self, address, write=False):
+        address = int(address)
+        name = region(address)
+        kind = "write" if write else "read"
+        if self.strict:
+            raise UnhandledAccess(f"Unhandled {name} {kind} at ${address:04X}")
+        self.regions[name] += 1
+        self.addresses[address] += 1
+        count = self.addresses[address]
+        if count > self.limit:
+            return
+        more = ", further ones are only counted" if count == self.limit else ""
+        logger.warning("Ignoring %s %s at $%04X%s", name, kind, address, more)
+
+    def summary(self, top=10):
+        if not self.regions:
+            return "No unhandled bus accesses"
+        lines = [f"{len(self)} unhandled bus accesses"]
+        for name, count in self.regions.most_common():
+            lines.append(f"  {name:<10}{count:>10}")
+        for address, count in self.addresses.most_common(top):
+            lines.append(f"  ${address:04X}{count:>15}")
+        return "\n".join(lines)
+
+    def report(self):
+        if self.regions:
+            logger.warning("%s", self.summary())
@@ -0,0 +1,191 @@
+import argparse
+import copy
+import hashlib
+
+import numpy as np
+
+from bench import load_engine
+from conformance import STATE_DTYPE, format_state, probe
+from movie import Movie
+
+# everything `probe` records, the opcode bytes follow from the PC and RAM
+FIELDS = ("pc", "a", "x", "y", "p", "sp", "cycle")
+
+
+def boot(engine, rom):
+    cpu = engine()
+    cpu.load_rom(rom, synthesize=False)
+    cpu.reset()
+    return cpu
+
+
+def advance(cpu, steps, movie=None):
+    # controller 1 follows the movie by the engine's own frame count
+    ppu = cpu.bus.ppu
+    port = cpu.bus.controllers[0]
+    for _ in range(steps):
+        if movie is not None and len(movie):
+            port.buttons = movie.frames[min(ppu.frame_count, len(movie) - 1)]
+        cpu.operation(cpu.bus.read(cpu.program_counter.read()))
+
+
+def memories(cpu):
+    bus = cpu.bus
+    if bus.prg_ram is None:
+        return (bus.cpu_vram.data,)
+    return bus.cpu_vram.data, bus.prg_ram.data
+
+
+def memory_hash(cpu):
+    digest = hashlib.blake2b(digest_size=16)
+    for data in memories(cpu):
+        digest.update(data)
+    return digest.digest()
+
+
+def capture(cpu):
+    state = np.zeros((1,), dtype=STATE_DTYPE)[0]
+    probe(cpu, state)
+    return state, memory_hash(cpu)
+
+
+def differences(expected, actual):
+    (expected_state, expected_hash), (actual_state, actual_hash) = (
+        expected,
+        actual,
+    )
+    fields = [
+        field
+        for field in FIELDS
+        if expected_state[field] != actual_state[field]
+    ]
+    if expected_hash != actual_hash:
+        fields.append("memory")
+    return fields
+
+
+class Divergence:
+    def __init__(self, step, fields, before, engines, error=None):
+        # `before` is the last state both engines agree on, `engines` the
+        # two CPUs one instruction later
+        self.step = step
+        self.fields = fields
+        self.before = before
+        self.engines = engines
+        self.error = error
+
+    def __str__(self):
+        lines = [
+            f"First divergence at instruction {self.step}"
+            f" on {', '.join(self.fields)}",
+            f"  {format_state(self.before)}",
+        ]
+        if self.error is not None:
+            lines.append(f"raised {self.error!r}")
+        for name, cpu in zip(("reference", "candidate"), self.engines):
+            state, _ = capture(cpu)
+            lines.append(f"{name}:")
+            lines.append(f"> {format_state(state)}")
+        if "memory" in self.fields:
+            expected, actual = (memories(cpu) for cpu in self.engines)
+            for region, (left, right) in enumerate(zip(expected, actual)):
+                base = 0x0000 if region == 0 else 0x6000
+                for address in np.flatnonzero(left != right)[:16]:
+                    lines.append(
+                        f"  ${base + int(address):04X}:"
+                        f" {left[address]:02X} != {right[address]:02X}"
+                    )
+        return "\n".join(lines)
+
+
+class LockstepResult:
+    def __init__(self, steps, divergence=None):
+        self.steps = steps
+        self.divergence = divergence
+
+    @property
+    def passed(self):
+        return self.divergence is None
+
+    def __str__(self):
+        if self.divergence is None:
+            return f"Engines agree after {self.steps} instructions"
+        return str(self.divergence)
+
+
+def _run(engines, steps, movie):
+    # (differing fields, error), an engine raising counts as a divergence
+    try:
+        for cpu in engines:
+            advance(cpu, steps, movie)
+    except Exception as e:
+        return ["error"], e
+    return differences(*(capture(cpu) for cpu in engines)), None
+
+
+def run_lockstep(
+    reference, candidate, rom, movie=None, steps=100_000, interval=1000
+):
+    # both engines run `interval` instructions at a time and are compared,
+    # registers and a hash of RAM. the last matching pair is kept as a
+    # checkpoint to bisect from
+    engines = [boot(reference, rom), boot(candidate, rom)]
+    fields, error = _run(engines, 0, movie)
+    if fields:
+        # they disagree straight after reset
+        before, _ = capture(engines[0])
+        return LockstepResult(0, Divergence(0, fields, before, engines))
+    checkpoint = (0, copy.deepcopy(engines))
+    step = 0
+    while step < steps:
+        count = min(interval, steps - step)
+        fields, error = _run(engines, count, movie)
+        if fields:
+            divergence = _bisect(checkpoint, step + count, movie)
+            return LockstepResult(divergence.step, divergence)
+        step += count
+        checkpoint = (step, copy.deepcopy(engines))
+    return LockstepResult(step)
+
+
+def _bisect(checkpoint, bad, movie):
+    # the engines agree at `good` and not at `bad`, halve that until they
+    # are one instruction apart. a matching probe becomes the new checkpoint
+    # so each instruction runs about twice
+    good, engines = checkpoint
+    while bad - good > 1:
+        middle = (good + bad) // 2
+        probes = copy.deepcopy(engines)
+        fields, _ = _run(probes, middle - good, movie)
+        if fields:
+            bad = middle
+        else:
+            good, engines = middle, probes
+    before, _ = capture(engines[0])
+    fields, error = _run(engines, 1, movie)
+    return Divergence(good, fields, before, engines, error)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run two engines in lockstep and find where they diverge"
+    )
+    parser.add_argument("rom")
+    parser.add_argument("--engine", required=True)
+    parser.add_argument("--reference", default="cpu:CPU")
+    parser.add_argument("--movie")
+    parser.add_argument("--steps", type=int, default=100_000)
+    parser.add_argument("--interval", type=int, default=1000)
+    args = parser.parse_args()
+
+    movie = None if args.movie is None else Movie.load(args.movie)
+    result = run_lockstep(
+        load_engine(args.reference),
+        load_engine(args.engine),
+        args.rom,
+        movie,
+        args.steps,
+        args.interval,
+    )
+    print(result)
+    raise SystemExit(0 if result.passed else 1)
@@ -0,0 +1,135 @@
+import numpy as np
+
+from opcodes import MNEMONICS, MODES, SIZES, UNOFFICIAL
+
+OPERAND_FORMATS = {
+    "implied": "",
+    "accumulator": "A",
+    "immediate": "#${:02X}",
+    "zero_page": "${:02X}",
+    "zero_page_x": "${:02X},X",
+    "zero_page_y": "${:02X},Y",
+    "relative": "${:04X}",
+    "indirect_x": "(${:02X},X)",
+    "indirect_y": "(${:02X}),Y",
+    "absolute": "${:04X}",
+    "absolute_x": "${:04X},X",
+    "absolute_y": "${:04X},Y",
+    "indirect": "(${:04X})",
+}
+
+SIZE_TABLE = np.array(SIZES, dtype=np.uint8)
+
+
+class Disassembler:
+    def __init__(self, bus):
+        self.bus = bus
+        self.rom_start = bus.PRG_ROM_START
+        # RAM code can change, entries remember the bytes they came from
+        self._ram_text = {}
+        # PRG is decoded on the first lookup, most buses never need it
+        self._rom_text = {}
+        self.stale = True
+
+    def refresh(self):
+        # decode the mapped PRG ROM at once as if an instruction started at
+        # every address, lookups are then plain array indexing. watched
+        # pages are read through their proxy's component, like `_peek`
+        pages = []
+        for page, (component, start, mask) in enumerate(
+            self.bus.page_table[self.rom_start >> 8 :], self.rom_start >> 8
+        ):
+            component = getattr(component, "component", component)
+            pages.append(component.data[(page << 8) - start & mask :][:0x100])
+        data = np.concatenate(pages + [np.zeros((2,), dtype=np.uint8)])
+        self.opcodes = data[:-2]
+        self.sizes = SIZE_TABLE[self.opcodes]
+        self.operands = data[1:-1].astype(np.uint16) | (
+            data[2:].astype(np.uint16) << 8
+        )
+        # one byte operands only use the low half
+        self.operands[self.sizes == 2] &= 0xFF
+        self._rom_text = {}
+        # set by the bus on bank switches, decoded again on the next lookup
+        self.stale = False
+
+    def in_rom(self, address):
+        return address >= self.rom_start
+
+    def decode(self, address):
+        address = int(address)
+        if self.in_rom(address):
+            if self.stale:
+                self.refresh()
+            index = address - self.rom_start
+            return (
+                int(self.opcodes[index]),
+                int(self.operands[index]),
+                int(self.sizes[index]),
+            )
+        opcode = self._peek(address)
+        size = SIZES[opcode]
+        operand = 0
+        for offset in range(1, size):
+            operand |= self._peek(address + offset) << (8 * (offset - 1))
+        return opcode, operand, size
+
+    def instruction_bytes(self, address):
+        opcode, operand, size = self.decode(address)
+        return [opcode, operand & 0xFF, operand >> 8][:size]
+
+    def text(self, address):
+        address = int(address)
+        if self.in_rom(address):
+            if self.stale:
+                self.refresh()
+            text = self._rom_text.get(address)
+            if text is None:
+                text = self._rom_text[address] = self._format(
+                    address, *self.decode(address)
+                )
+            return text
+
+        decoded = self.decode(address)
+        cached = self._ram_text.get(address)
+        if cached is None or cached[0] != decoded:
+            cached = self._ram_text[address] = (
+                decoded,
+                self._format(address, *decoded),
+            )
+        return cached[1]
+
+    def line(self, address):
+        # same layout as the first columns of nestest.log
+        opcode_bytes = " ".join(
+            f"{byte:02X}" for byte in self.instruction_bytes(address)
+        )
+        text = self.text(address)
+        # unofficial opcodes are starred in the gap before the mnemonic
+        gap = " " if text.startswith("*") else "  "
+        return f"{int(address):04X}  {opcode_bytes:<8}{gap}{text}"
+
+    def invalidate(self, start=0x0000, end=0xFFFF):
+        for address in [a for a in self._ram_text if start <= a <= end]:
+            del self._ram_text[address]
+
+    def _peek(self, address):
+        # straight from the component, disassembling must not trigger
+        # watchpoints or unmapped access reports
+        component, start, mask = self.bus.page_table[(address >> 8) & 0xFF]
+        component = getattr(component, "component", component)
+        # registers like the PPU's have side effects on read, never peek them
+        if mask is None or not hasattr(component, "data"):
+            return 0
+        return int(component.data[(address - start) & mask])
+
+    @staticmethod
+    def _format(address, opcode, operand, size):
+        mode = MODES[opcode]
+        if mode == "relative":
+            offset = operand - 0x100 if operand >= 0x80 else operand
+            operand = (address + size + offset) & 0xFFFF
+        mnemonic = MNEMONICS[opcode].upper()
+        if opcode in UNOFFICIAL:
+            mnemonic = "*" + mnemonic
+        return f"{mnemonic} {OPERAND_FORMATS[mode].format(operand)}".rstrip()
@@ -0,0 +1,142 @@
+import argparse
+
+import numpy as np
+
+# 2C02 system palette, RGB of the 64 colours a PPU palette entry can hold
+NES_PALETTE = np.array(
+    [
+        [0x80, 0x80, 0x80], [0x00, 0x3D, 0xA6], [0x00, 0x12, 0xB0],
+        [0x44, 0x00, 0x96], [0xA1, 0x00, 0x5E], [0xC7, 0x00, 0x28],
+        [0xBA, 0x06, 0x00], [0x8C, 0x17, 0x00], [0x5C, 0x2F, 0x00],
+        [0x10, 0x45, 0x00], [0x05, 0x4A, 0x00], [0x00, 0x47, 0x2E],
+        [0x00, 0x41, 0x66], [0x00, 0x00, 0x00], [0x05, 0x05, 0x05],
+        [0x05, 0x05, 0x05], [0xC7, 0xC7, 0xC7], [0x00, 0x77, 0xFF],
+        [0x21, 0x55, 0xFF], [0x82, 0x37, 0xFA], [0xEB, 0x2F, 0xB5],
+        [0xFF, 0x29, 0x50], [0xFF, 0x22, 0x00], [0xD6, 0x32, 0x00],
+        [0xC4, 0x62, 0x00], [0x35, 0x80, 0x00], [0x05, 0x8F, 0x00],
+        [0x00, 0x8A, 0x55], [0x00, 0x99, 0xCC], [0x21, 0x21, 0x21],
+        [0x09, 0x09, 0x09], [0x09, 0x09, 0x09], [0xFF, 0xFF, 0xFF],
+        [0x0F, 0xD7, 0xFF], [0x69, 0xA2, 0xFF], [0xD4, 0x80, 0xFF],
+        [0xFF, 0x45, 0xF3], [0xFF, 0x61, 0x8B], [0xFF, 0x88, 0x33],
+        [0xFF, 0x9C, 0x12], [0xFA, 0xBC, 0x20], [0x9F, 0xE3, 0x0E],
+        [0x2B, 0xF0, 0x35], [0x0C, 0xF0, 0xA4], [0x05, 0xFB, 0xFF],
+        [0x5E, 0x5E, 0x5E], [0x0D, 0x0D, 0x0D], [0x0D, 0x0D, 0x0D],
+        [0xFF, 0xFF, 0xFF], [0xA6, 0xFC, 0xFF], [0xB3, 0xEC, 0xFF],
+        [0xDA, 0xAB, 0xEB], [0xFF, 0xA8, 0xF9], [0xFF, 0xAB, 0xB3],
+        [0xFF, 0xD2, 0xB0], [0xFF, 0xEF, 0xA6], [0xFF, 0xF7, 0x9C],
+        [0xD7, 0xE8, 0x95], [0xA6, 0xED, 0xAF], [0xA2, 0xF2, 0xDA],
+        [0x99, 0xFF, 0xFC], [0xDD, 0xDD, 0xDD], [0x11, 0x11, 0x11],
+        [0x11, 0x11, 0x11],
+    ],
+    dtype=np.uint8,
+)  # fmt: skip
+
+
+class Display:
+    def __init__(
+        self, palette, width, height, scale=1, caption=None, headless=False
+    ):
+        # `palette` is an (n, 3) uint8 RGB lookup table for the indices in
+        # the framebuffers given to `convert`/`show`
+        self.palette = palette
+        # surfarray layout, columns first
+        self.rgb = np.zeros((width, height, 3), dtype=np.uint8)
+        # np.take would otherwise cast the uint8 indices to a new array
+        self.indices = np.zeros((width, height), dtype=np.intp)
+        self.window = None
+        if not headless:
+            # only windowed users need pygame
+            import pygame
+
+            pygame.init()
+            self.window = pygame.display.set_mode(
+                (scale * width, scale * height)
+            )
+            if caption is not None:
+                pygame.display.set_caption(caption)
+            self.surface = pygame.Surface((width, height))
+
+    def convert(self, indices):
+        # (H, W) indices to RGB in the preallocated arrays, "clip" keeps
+        # np.take from buffering the output
+        np.copyto(self.indices, indices.T)
+        np.take(self.palette, self.indices, axis=0, out=self.rgb, mode="clip")
+        return self.rgb
+
+    def show(self, indices):
+        import pygame
+
+        pygame.surfarray.blit_array(self.surface, self.convert(indices))
+        pygame.transform.scale(
+            self.surface, self.window.get_size(), self.window
+        )
+
+    def screenshot(self, indices):
+        # (H, W, 3) copy, the usual image layout
+        return self.convert(indices).transpose(1, 0, 2).copy()
+
+
+def run(rom, scale, record=None):
+    import pygame
+
+    import controller
+    from apu import SAMPLE_RATE
+    from cpu import CPU
+    from movie import Movie, run_frame
+    from ppu import HEIGHT, WIDTH
+
+    keys = {
+        pygame.K_x: controller.A,
+        pygame.K_z: controller.B,
+        pygame.K_RSHIFT: controller.SELECT,
+        pygame.K_RETURN: controller.START,
+        pygame.K_UP: controller.UP,
+        pygame.K_DOWN: controller.DOWN,
+        pygame.K_LEFT: controller.LEFT,
+        pygame.K_RIGHT: controller.RIGHT,
+    }
+
+    cpu = CPU()
+    # battery saves are only kept when playing
+    cpu.load_rom(rom, persist=True)
+    cpu.reset()
+    ppu = cpu.bus.ppu
+    display = Display(NES_PALETTE, WIDTH, HEIGHT, scale, caption=rom)
+    clock = pygame.time.Clock()
+    try:
+        # float32 mono, the APU buffer can be queued as it is
+        pygame.mixer.init(SAMPLE_RATE, 32, 1)
+        audio = pygame.mixer.Channel(0)
+    except pygame.error:
+        # no audio device, the APU still runs
+        audio = None
+    movie = Movie()
+    port = cpu.bus.controllers[0]
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                if record is not None:
+                    movie.save(record)
+                cpu.close()
+                return
+        pressed = pygame.key.get_pressed()
+        port.buttons = sum(
+            button for key, button in keys.items() if pressed[key]
+        )
+        movie.record(port.buttons)
+        run_frame(cpu)
+        display.show(ppu.frame)
+        pygame.display.flip()
+        if audio is not None and audio.get_queue() is None:
+            samples = cpu.bus.apu.buffer.drain()
+            audio.queue(pygame.mixer.Sound(buffer=samples.tobytes()))
+        clock.tick(60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a ROM in a window")
+    parser.add_argument("rom")
+    parser.add_argument("--scale", type=int, default=3)
+    parser.add_argument("--record", help="save the input movie here")
+    args = parser.parse_args()
+    run(args.rom, args.scale, args.record)
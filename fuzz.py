@@ -0,0 +1,716 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bus import RAM
+from cpu import CPU
+from opcodes import (
+    CYCLES,
+    HANDLERS,
+    MNEMONICS,
+    MODES,
+    PAGE_PENALTY,
+    SIZES,
+)
+
+FIXTURES = "fuzz_fixtures.jsonl"
+
+CARRY = 0x01
+ZERO = 0x02
+INTERRUPT = 0x04
+BREAK = 0x10
+UNUSED = 0x20
+OVERFLOW = 0x40
+NEGATIVE = 0x80
+
+# flag tested and the value that takes the branch
+BRANCHES = {
+    "bcc": (CARRY, False),
+    "bcs": (CARRY, True),
+    "bne": (ZERO, False),
+    "beq": (ZERO, True),
+    "bpl": (NEGATIVE, False),
+    "bmi": (NEGATIVE, True),
+    "bvc": (OVERFLOW, False),
+    "bvs": (OVERFLOW, True),
+}
+# no reference for these, xaa and lxa depend on an unstable chip-specific
+# constant and jam halts the CPU. they are skipped and reported as such
+UNMODELLED = frozenset({"xaa", "lxa", "jam"})
+# why an opcode was not compared, printed with the results
+SKIPPED = {
+    "unmodelled": "skipped, no reference model",
+    "unsupported": "skipped, the CPU has no handler",
+}
+
+# `pc` is kept clear of the vectors and `sp` away from the ends of the
+# stack page, where the CPU raises on purpose instead of wrapping
+PC_RANGE = (0x0000, 0xFFF0)
+SP_RANGE = (0x08, 0xF8)
+
+CASE_DTYPE = np.dtype(
+    [
+        ("pc", "<u2"),
+        ("a", "u1"),
+        ("x", "u1"),
+        ("y", "u1"),
+        ("sp", "u1"),
+        ("p", "u1"),
+        ("operand", "u1", (2,)),
+    ]
+)
+# at most three bytes are written, by brk, unused slots have address -1
+RESULT_DTYPE = np.dtype(
+    [
+        ("pc", "<u2"),
+        ("a", "u1"),
+        ("x", "u1"),
+        ("y", "u1"),
+        ("sp", "u1"),
+        ("p", "u1"),
+        ("cycles", "u1"),
+        ("write_address", "<i4", (3,)),
+        ("write_value", "u1", (3,)),
+    ]
+)
+REGISTERS = ("pc", "a", "x", "y", "sp", "p", "cycles")
+
+
+def generate(opcode, count, rng):
+    cases = np.zeros((count,), dtype=CASE_DTYPE)
+    cases["pc"] = rng.integers(*PC_RANGE, size=count)
+    cases["sp"] = rng.integers(*SP_RANGE, size=count)
+    for field in ("a", "x", "y", "p"):
+        cases[field] = rng.integers(0, 0x100, size=count)
+    cases["operand"] = rng.integers(0, 0x100, size=(count, 2))
+    # one random background per batch, each case overlays its instruction
+    memory = rng.integers(0, 0x100, size=0x10000, dtype=np.uint8)
+    return cases, memory
+
+
+# vectorized reference, every case in a batch runs the same opcode so the
+# instruction decodes once and only the data is in arrays
+
+
+def _zn(p, value):
+    return (p & ~(ZERO | NEGATIVE)) | (value & NEGATIVE) | (value == 0) * ZERO
+
+
+def _add(a, value, p):
+    total = a + value + (p & CARRY)
+    result = total & 0xFF
+    overflow = (~(a ^ value) & (a ^ result) & 0x80) != 0
+    p = (p & ~(CARRY | OVERFLOW)) | (total > 0xFF) | overflow * OVERFLOW
+    return result, _zn(p, result)
+
+
+def _compare(register, value, p):
+    p = (p & ~CARRY) | (register >= value)
+    return _zn(p, (register - value) & 0xFF)
+
+
+def _shift(mnemonic, value, p):
+    # asl/lsr/rol/ror, returns the result and the flags with the new carry
+    carry = p & CARRY
+    match mnemonic:
+        case "asl":
+            result, carry_out = (value << 1) & 0xFF, value >> 7
+        case "lsr":
+            result, carry_out = value >> 1, value & 0x01
+        case "rol":
+            result, carry_out = ((value << 1) | carry) & 0xFF, value >> 7
+        case "ror":
+            result, carry_out = (value >> 1) | (carry << 7), value & 0x01
+    return result, (p & ~CARRY) | carry_out
+
+
+class Reference:
+    def __init__(self, opcode, cases, memory):
+        self.opcode = opcode
+        self.size = SIZES[opcode]
+        self.memory = memory
+        self.pc = cases["pc"].astype(np.int64)
+        self.operand = cases["operand"].astype(np.int64)
+        self.a = cases["a"].astype(np.int64)
+        self.x = cases["x"].astype(np.int64)
+        self.y = cases["y"].astype(np.int64)
+        self.sp = cases["sp"].astype(np.int64)
+        self.p = cases["p"].astype(np.int64)
+        self.writes = []
+
+    def read(self, address):
+        # memory as the CPU sees it, the background under the instruction
+        address = address & 0xFFFF
+        value = self.memory[address].astype(np.int64)
+        for offset in range(self.size):
+            byte = self.opcode if offset == 0 else self.operand[:, offset - 1]
+            value = np.where(
+                address == (self.pc + offset) & 0xFFFF, byte, value
+            )
+        return value
+
+    def read16(self, address, wrapped):
+        return self.read(address) | (self.read(wrapped) << 8)
+
+    def write(self, address, value):
+        self.writes.append((address & 0xFFFF, value & 0xFF))
+
+    def push(self, value):
+        self.write(0x100 + self.sp, value)
+        self.sp = (self.sp - 1) & 0xFF
+
+    def pull(self):
+        self.sp = (self.sp + 1) & 0xFF
+        return self.read(0x100 + self.sp)
+
+    def address(self, mode):
+        # effective address and whether indexing crossed a page
+        low, high = self.operand[:, 0], self.operand[:, 1]
+        crossed = np.zeros(low.shape, dtype=bool)
+        match mode:
+            case "zero_page":
+                address = low
+            case "zero_page_x":
+                address = (low + self.x) & 0xFF
+            case "zero_page_y":
+                address = (low + self.y) & 0xFF
+            case "absolute" | "indirect":
+                address = low | (high << 8)
+                if mode == "indirect":
+                    # the pointer high byte does not carry into the page
+                    address = self.read16(
+                        address, (address & 0xFF00) | ((address + 1) & 0xFF)
+                    )
+            case "absolute_x" | "absolute_y":
+                base = low | (high << 8)
+                index = self.x if mode == "absolute_x" else self.y
+                address = (base + index) & 0xFFFF
+                crossed = (base ^ address) > 0xFF
+            case "indirect_x":
+                pointer = (low + self.x) & 0xFF
+                address = self.read16(pointer, (pointer + 1) & 0xFF)
+            case "indirect_y":
+                base = self.read16(low, (low + 1) & 0xFF)
+                address = (base + self.y) & 0xFFFF
+                crossed = (base ^ address) > 0xFF
+            case _:
+                address = None
+        return address, crossed
+
+    def run(self):
+        opcode = self.opcode
+        mnemonic = MNEMONICS[opcode]
+        mode = MODES[opcode]
+        address, crossed = self.address(mode)
+        match mode:
+            case "immediate" | "relative":
+                value = self.operand[:, 0]
+            case "accumulator":
+                value = self.a
+            case "implied":
+                value = None
+            case _:
+                value = self.read(address)
+        next_pc = (self.pc + self.size) & 0xFFFF
+        pc = next_pc
+        cycles = CYCLES[opcode] + crossed * PAGE_PENALTY[opcode]
+        a, x, y, p = self.a, self.x, self.y, self.p
+
+        match mnemonic:
+            case "adc":
+                a, p = _add(a, value, p)
+            case "sbc":
+                a, p = _add(a, value ^ 0xFF, p)
+            case "and":
+                a = a & value
+                p = _zn(p, a)
+            case "ora":
+                a = a | value
+                p = _zn(p, a)
+            case "eor":
+                a = a ^ value
+                p = _zn(p, a)
+            case "asl" | "lsr" | "rol" | "ror":
+                result, p = _shift(mnemonic, value, p)
+                p = _zn(p, result)
+                if mode == "accumulator":
+                    a = result
+                else:
+                    self.write(address, result)
+            case "bit":
+                p = (p & ~(ZERO | OVERFLOW | NEGATIVE)) | (value & 0xC0)
+                p |= ((a & value) == 0) * ZERO
+            case "bcc" | "bcs" | "beq" | "bmi" | "bne" | "bpl" | "bvc" | "bvs":
+                flag, set_ = BRANCHES[mnemonic]
+                taken = ((p & flag) != 0) == set_
+                offset = np.where(value & 0x80, value - 0x100, value)
+                target = (next_pc + offset) & 0xFFFF
+                pc = np.where(taken, target, next_pc)
+                cycles = cycles + taken + (taken & ((next_pc ^ target) > 0xFF))
+            case "brk":
+                ret = (self.pc + 2) & 0xFFFF
+                self.push(ret >> 8)
+                self.push(ret)
+                self.push(p | BREAK | UNUSED)
+                p = p | INTERRUPT
+                pc = self.read16(
+                    np.full_like(p, 0xFFFE), np.full_like(p, 0xFFFF)
+                )
+            case "clc" | "cld" | "cli" | "clv" | "sec" | "sed" | "sei":
+                bit = {"c": CARRY, "d": 0x08, "i": INTERRUPT, "v": OVERFLOW}
+                bit = bit[mnemonic[2]]
+                p = p | bit if mnemonic[0] == "s" else p & ~bit
+            case "cmp" | "cpx" | "cpy":
+                register = {"cmp": a, "cpx": x, "cpy": y}[mnemonic]
+                p = _compare(register, value, p)
+            case "dec" | "inc" | "dcp" | "isc":
+                step = -1 if mnemonic in ("dec", "dcp") else 1
+                result = (value + step) & 0xFF
+                self.write(address, result)
+                match mnemonic:
+                    case "dcp":
+                        p = _compare(a, result, p)
+                    case "isc":
+                        a, p = _add(a, result ^ 0xFF, p)
+                    case _:
+                        p = _zn(p, result)
+            case "dex" | "inx":
+                x = (x + (1 if mnemonic == "inx" else -1)) & 0xFF
+                p = _zn(p, x)
+            case "dey" | "iny":
+                y = (y + (1 if mnemonic == "iny" else -1)) & 0xFF
+                p = _zn(p, y)
+            case "jmp":
+                pc = address
+            case "jsr":
+                ret = (self.pc + 2) & 0xFFFF
+                self.push(ret >> 8)
+                self.push(ret)
+                pc = address
+            case "rts":
+                low = self.pull()
+                pc = ((low | (self.pull() << 8)) + 1) & 0xFFFF
+            case "rti":
+                p = self.pull()
+                low = self.pull()
+                pc = low | (self.pull() << 8)
+            case "lda":
+                a = value
+                p = _zn(p, a)
+            case "ldx":
+                x = value
+                p = _zn(p, x)
+            case "ldy":
+                y = value
+                p = _zn(p, y)
+            case "lax":
+                a = x = value
+                p = _zn(p, a)
+            case "nop":
+                pass
+            case "pha":
+                self.push(a)
+            case "php":
+                self.push(p | BREAK | UNUSED)
+            case "pla":
+                a = self.pull()
+                p = _zn(p, a)
+            case "plp":
+                p = self.pull()
+            case "sta":
+                self.write(address, a)
+            case "stx":
+                self.write(address, x)
+            case "sty":
+                self.write(address, y)
+            case "sax":
+                self.write(address, a & x)
+            case "tax" | "tay" | "txa" | "tya" | "tsx":
+                source = {"a": a, "x": x, "y": y, "s": self.sp}[mnemonic[1]]
+                match mnemonic[2]:
+                    case "a":
+                        a = source
+                    case "x":
+                        x = source
+                    case "y":
+                        y = source
+                p = _zn(p, source)
+            case "txs":
+                self.sp = x
+            case "rla" | "rra" | "slo" | "sre":
+                shift = {"rla": "rol", "rra": "ror", "slo": "asl"}
+                result, p = _shift(shift.get(mnemonic, "lsr"), value, p)
+                self.write(address, result)
+                match mnemonic:
+                    case "rla":
+                        a = a & result
+                    case "slo":
+                        a = a | result
+                    case "sre":
+                        a = a ^ result
+                    case "rra":
+                        a, p = _add(a, result, p)
+                p = _zn(p, a)
+            case "alr":
+                a, p = _shift("lsr", a & value, p)
+                p = _zn(p, a)
+            case "anc":
+                a = a & value
+                p = _zn(p, a)
+                p = (p & ~CARRY) | (a >> 7)
+            case "arr":
+                a = ((a & value) >> 1) | ((p & CARRY) << 7)
+                p = _zn(p, a)
+                p = (p & ~(CARRY | OVERFLOW)) | ((a >> 6) & 0x01)
+                p |= (((a >> 6) ^ (a >> 5)) & 0x01) * OVERFLOW
+            case "sbx":
+                result = (a & x) - value
+                p = (p & ~CARRY) | (result >= 0)
+                x = result & 0xFF
+                p = _zn(p, x)
+            case "las":
+                a = x = self.sp = value & self.sp
+                p = _zn(p, a)
+            case "sha" | "shx" | "shy" | "tas":
+                # the stored value is ANDed with the base address high byte
+                # plus one, and replaces that high byte if indexing crossed
+                # a page
+                index = x if mode == "absolute_x" else y
+                high = (((address - index) & 0xFFFF) >> 8) + 1
+                match mnemonic:
+                    case "sha":
+                        value = a & x
+                    case "shx":
+                        value = x
+                    case "shy":
+                        value = y
+                    case "tas":
+                        value = self.sp = a & x
+                value = value & high
+                address = np.where(
+                    crossed, (address & 0xFF) | (value << 8), address
+                )
+                self.write(address, value)
+
+        results = np.zeros((self.pc.shape[0],), dtype=RESULT_DTYPE)
+        results["pc"] = pc
+        results["a"] = a
+        results["x"] = x
+        results["y"] = y
+        results["sp"] = self.sp
+        # the B flag only exists on the stack
+        results["p"] = (p & ~BREAK) | UNUSED
+        results["cycles"] = cycles
+        results["write_address"] = -1
+        for slot, (address, value) in enumerate(self.writes):
+            results["write_address"][:, slot] = address
+            results["write_value"][:, slot] = value
+        return results
+
+
+def reference(opcode, cases, memory):
+    # every other mnemonic is modelled, see UNMODELLED
+    assert MNEMONICS[opcode] not in UNMODELLED, "No reference for this opcode"
+    return Reference(opcode, cases, memory).run()
+
+
+class Harness:
+    # one CPU over a flat 64KB RAM, reused for every case
+    def __init__(self):
+        self.cpu = CPU()
+        self.ram = RAM(0x10000)
+        self.cpu.bus.page_table = [(self.ram, 0, 0xFFFF)] * 0x100
+        self.image = np.zeros((0x10000,), dtype=np.uint8)
+
+    def run(self, opcode, case, memory, result):
+        # runs one case, fills `result` and returns the error raised if any
+        cpu = self.cpu
+        image = self.image
+        np.copyto(image, memory)
+        pc = int(case["pc"])
+        instruction = (opcode, *case["operand"])
+        for offset in range(SIZES[opcode]):
+            image[(pc + offset) & 0xFFFF] = instruction[offset]
+        np.copyto(self.ram.data, image)
+        cpu.accumulator.write(case["a"])
+        cpu.register_x.write(case["x"])
+        cpu.register_y.write(case["y"])
+        cpu.stack_pointer.write(case["sp"])
+        cpu.status.write(case["p"])
+        cpu.program_counter.write(pc)
+        cpu.cycles = 0
+        result["write_address"] = -1
+        try:
+            cpu.operation(opcode)
+        except Exception as e:
+            return e
+        result["pc"] = cpu.program_counter.read()
+        result["a"] = cpu.accumulator.read()
+        result["x"] = cpu.register_x.read()
+        result["y"] = cpu.register_y.read()
+        result["sp"] = cpu.stack_pointer.read()
+        result["p"] = cpu.status.read()
+        result["cycles"] = cpu.cycles
+        changed = np.flatnonzero(self.ram.data != image)[:3]
+        result["write_address"][: changed.shape[0]] = changed
+        result["write_value"][: changed.shape[0]] = self.ram.data[changed]
+        return None
+
+    def mismatch(self, opcode, case, memory, expected):
+        # (fields that differ from the reference or None, CPU result, error)
+        actual = np.zeros((1,), dtype=RESULT_DTYPE)[0]
+        error = self.run(opcode, case, memory, actual)
+        if error is not None:
+            return [f"error: {type(error).__name__}"], actual, error
+        fields = [f for f in REGISTERS if expected[f] != actual[f]]
+        if _final_writes(expected, self.image) != _final_writes(
+            actual, self.image
+        ):
+            fields.append("memory")
+        return fields or None, actual, None
+
+
+def _final_writes(result, image):
+    # {address: value} of the bytes that end up changed
+    writes = {}
+    for address, value in zip(result["write_address"], result["write_value"]):
+        if address >= 0:
+            writes[int(address)] = int(value)
+    return {
+        address: value
+        for address, value in writes.items()
+        if image[address] != value
+    }
+
+
+def minimise(harness, opcode, case, memory, fields):
+    # zero whatever the failure does not depend on: every register that can
+    # be, then memory in ever smaller blocks
+    case = case.copy()
+    memory = memory.copy()
+
+    def fails():
+        expected = reference(opcode, case[None], memory)[0]
+        found, _, _ = harness.mismatch(opcode, case, memory, expected)
+        return found == fields
+
+    for field in ("a", "x", "y", "p", "operand", "pc", "sp"):
+        original = case[field].copy()
+        if field == "sp":
+            case[field] = SP_RANGE[0]
+        else:
+            case[field] = 0
+        if not fails():
+            case[field] = original
+    size = 0x10000
+    while size >= 0x10:
+        for start in np.flatnonzero(memory.reshape(-1, size).any(axis=1)):
+            block = memory[start * size : (start + 1) * size].copy()
+            memory[start * size : (start + 1) * size] = 0
+            if not fails():
+                memory[start * size : (start + 1) * size] = block
+        size //= 0x10
+    return case, memory
+
+
+def fixture(opcode, case, memory, fields, expected, actual):
+    def registers(result):
+        return {f: int(result[f]) for f in REGISTERS} | {
+            "writes": {
+                f"{int(address):04X}": int(value)
+                for address, value in zip(
+                    result["write_address"], result["write_value"]
+                )
+                if address >= 0
+            }
+        }
+
+    return {
+        "opcode": opcode,
+        "mnemonic": MNEMONICS[opcode],
+        "mode": MODES[opcode],
+        "fields": fields,
+        "case": {
+            "pc": int(case["pc"]),
+            "a": int(case["a"]),
+            "x": int(case["x"]),
+            "y": int(case["y"]),
+            "sp": int(case["sp"]),
+            "p": int(case["p"]),
+            "operand": [int(byte) for byte in case["operand"]],
+        },
+        "memory": {
+            f"{int(address):04X}": int(memory[address])
+            for address in np.flatnonzero(memory)
+        },
+        "expected": registers(expected),
+        "actual": registers(actual),
+    }
+
+
+def load_fixture(record):
+    case = np.zeros((1,), dtype=CASE_DTYPE)[0]
+    for field, value in record["case"].items():
+        case[field] = value
+    memory = np.zeros((0x10000,), dtype=np.uint8)
+    for address, value in record["memory"].items():
+        memory[int(address, 16)] = value
+    return record["opcode"], case, memory
+
+
+_harness = None
+
+
+def fuzz_batch(opcode, count, seed):
+    # runs in the worker processes, returns (opcode, cases run, status,
+    # first failure as a fixture). each process builds its CPU once
+    global _harness
+    if _harness is None:
+        _harness = Harness()
+    if MNEMONICS[opcode] in UNMODELLED:
+        return opcode, 0, "unmodelled", None
+    if not hasattr(_harness.cpu, HANDLERS[opcode]):
+        return opcode, 0, "unsupported", None
+    rng = np.random.default_rng(seed)
+    cases, memory = generate(opcode, count, rng)
+    expected = reference(opcode, cases, memory)
+    for i in range(count):
+        fields, _, _ = _harness.mismatch(opcode, cases[i], memory, expected[i])
+        if fields is None:
+            continue
+        case, small = minimise(_harness, opcode, cases[i], memory, fields)
+        small_expected = reference(opcode, case[None], small)[0]
+        _, actual, _ = _harness.mismatch(opcode, case, small, small_expected)
+        return (
+            opcode,
+            i + 1,
+            "failed",
+            fixture(opcode, case, small, fields, small_expected, actual),
+        )
+    return opcode, count, "passed", None
+
+
+def fuzz(opcodes, cases, batch, seed=0, workers=None):
+    # every opcode gets `cases` cases in batches of `batch`, each batch
+    # seeded from `seed` so a run can be repeated exactly
+    seeds = np.random.SeedSequence(seed)
+    jobs = []
+    for opcode in opcodes:
+        for start in range(0, cases, batch):
+            child = seeds.spawn(1)[0]
+            jobs.append((opcode, min(batch, cases - start), child))
+    summary = {}
+    failures = []
+    with ProcessPoolExecutor(workers) as pool:
+        for opcode, count, status, failure in pool.map(
+            fuzz_batch, *zip(*jobs)
+        ):
+            ran, statuses = summary.get(opcode, (0, set()))
+            summary[opcode] = (ran + count, statuses | {status})
+            if failure is not None:
+                failures.append(failure)
+    return summary, failures
+
+
+def save_fixtures(failures, filepath=FIXTURES):
+    # one failure per opcode and set of differing fields, appended to what
+    # was saved before
+    known = set()
+    if os.path.exists(filepath):
+        with open(filepath) as fp:
+            for line in fp:
+                record = json.loads(line)
+                known.add((record["opcode"], tuple(record["fields"])))
+    added = 0
+    with open(filepath, "a") as fp:
+        for record in failures:
+            key = (record["opcode"], tuple(record["fields"]))
+            if key in known:
+                continue
+            known.add(key)
+            fp.write(json.dumps(record, sort_keys=True) + "\n")
+            added += 1
+    return added
+
+
+def check_fixtures(filepath=FIXTURES):
+    # replays saved failures, returns the ones that still fail
+    harness = Harness()
+    still_failing = []
+    with open(filepath) as fp:
+        for line in fp:
+            record = json.loads(line)
+            opcode, case, memory = load_fixture(record)
+            expected = reference(opcode, case[None], memory)[0]
+            fields, _, _ = harness.mismatch(opcode, case, memory, expected)
+            if fields is not None:
+                still_failing.append((record, fields))
+    return still_failing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuzz the CPU per opcode")
+    parser.add_argument("--cases", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument(
+        "--opcodes", help="comma separated hex opcodes, all by default"
+    )
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument(
+        "--check", action="store_true", help="only replay saved fixtures"
+    )
+    args = parser.parse_args()
+
+    if args.check:
+        failing = check_fixtures(args.fixtures)
+        for record, fields in failing:
+            print(
+                f"{record['opcode']:02X} {record['mnemonic']}"
+                f" {record['mode']}: {', '.join(fields)}"
+            )
+        raise SystemExit(1 if failing else 0)
+
+    if args.opcodes is None:
+        opcodes = range(0x100)
+    else:
+        opcodes = [int(opcode, 16) for opcode in args.opcodes.split(",")]
+    start = time.perf_counter()
+    summary, failures = fuzz(
+        opcodes, args.cases, args.batch, args.seed, args.workers
+    )
+    seconds = time.perf_counter() - start
+    total = sum(ran for ran, _ in summary.values())
+    skipped = 0
+    for opcode, (ran, statuses) in sorted(summary.items()):
+        if statuses == {"passed"}:
+            continue
+        status = "failed" if "failed" in statuses else min(statuses)
+        if status in SKIPPED:
+            skipped += 1
+            status = SKIPPED[status]
+        else:
+            status = f"{status} after {ran} cases"
+        print(
+            f"{opcode:02X} {MNEMONICS[opcode]:<4} {MODES[opcode]:<12} {status}"
+        )
+    reported = set()
+    for record in failures:
+        key = (record["opcode"], tuple(record["fields"]))
+        if key not in reported:
+            reported.add(key)
+            print(
+                f"{record['opcode']:02X} {record['mnemonic']}"
+                f" {record['mode']}: {', '.join(record['fields'])}"
+            )
+    added = save_fixtures(failures, args.fixtures)
+    print(
+        f"{total:,} cases in {seconds:.1f}s ({total / seconds * 60:,.0f}"
+        f"/min), {len(failures)} failing batches, {added} new fixtures,"
+        f" {skipped} opcodes skipped"
+    )
@@ -0,0 +1,281 @@
+import numpy as np
+
+from ppu import (
+    DOTS_PER_FRAME,
+    DOTS_PER_SCANLINE,
+    SHOW_BACKGROUND,
+    SHOW_SPRITES,
+)
+
+
+class Bank:
+    # stands in for a component in the bus page table, reads come straight
+    # from a view of the ROM buffer and writes go to the mapper registers
+    def __init__(self, data, mapper, start):
+        self.data = data
+        self.mapper = mapper
+        # CPU address the bank is mapped at, registers are decoded from it
+        self.start = start
+
+    def read(self, address):
+        return self.data[address]
+
+    def read16(self, address, page_wrap=False):
+        address = int(address)
+        hi_address = address + 1
+        if page_wrap:
+            hi_address = (address & 0xFF00) | (hi_address & 0xFF)
+        if hi_address < len(self.data):
+            hi = int(self.data[hi_address])
+        else:
+            # the high byte is past the window, in whatever is mapped next
+            bus = self.mapper.bus
+            hi = int(bus.read((self.start + hi_address) & 0xFFFF))
+        return np.uint16(int(self.data[address]) | (hi << 8))
+
+    def read_chunk(self, address, size):
+        return self.data[address : address + size].copy()
+
+    def write(self, address, data):
+        self.mapper.write(self.start + int(address), int(data))
+
+    def write16(self, address, data):
+        self.write(address, data & 0xFF)
+        self.write(address + 1, (data >> 8) & 0xFF)
+
+    def write_chunk(self, address, data):
+        for offset, value in enumerate(data):
+            self.write(address + offset, value)
+
+
+class Mapper:
+    # PRG and CHR are switched in windows of these sizes
+    prg_window = 0x4000
+    chr_window = 0x2000
+
+    def __init__(self, rom, bus):
+        self.rom = rom
+        self.bus = bus
+        self.ppu = bus.ppu
+        self.prg = rom.prg_rom_data
+        self.prg_banks = self.prg.shape[0] // self.prg_window
+        self.chr_banks = max(rom.number_chr_rom_banks * 0x2000, 0x2000) // (
+            self.chr_window
+        )
+        # one Bank per (window address, bank) pair, built on first use so a
+        # switch is just a page table update
+        self._banks = {}
+
+    def reset(self):
+        self.map_prg(0x8000, 0)
+        self.map_prg(0xC000, -1)
+        self.map_chr(0x0000, 0)
+
+    def write(self, address, data):
+        ...
+
+    def map_prg(self, start, bank):
+        # negative banks count from the last one
+        bank %= self.prg_banks
+        key = (start, bank)
+        component = self._banks.get(key)
+        if component is None:
+            offset = bank * self.prg_window
+            component = self._banks[key] = Bank(
+                self.prg[offset : offset + self.prg_window], self, start
+            )
+        self.bus.map_prg(start, self.prg_window, component)
+
+    def map_chr(self, start, bank):
+        bank %= self.chr_banks
+        self.ppu.map_chr(start, self.chr_window, bank * self.chr_window)
+
+
+class NROM(Mapper):
+    # mapper 0, 16KB carts see their only bank at $8000 and $C000
+    pass
+
+
+class UxROM(Mapper):
+    # mapper 2, 16KB switchable at $8000 and the last bank fixed at $C000
+    def write(self, address, data):
+        self.map_prg(0x8000, data)
+
+
+class CNROM(Mapper):
+    # mapper 3, fixed PRG and 8KB of switchable CHR
+    def write(self, address, data):
+        self.map_chr(0x0000, data)
+
+
+class MMC1(Mapper):
+    # mapper 1, registers are written one bit at a time through a serial port
+    prg_window = 0x4000
+    chr_window = 0x1000
+    MIRRORING = (
+        "single_screen_lower",
+        "single_screen_upper",
+        "vertical",
+        "horizontal",
+    )
+
+    def reset(self):
+        self.shift = 0
+        self.shift_count = 0
+        self.control = 0x0C
+        self.chr_bank0 = 0
+        self.chr_bank1 = 0
+        self.prg_bank = 0
+        self._update()
+
+    def write(self, address, data):
+        if data & 0x80:
+            self.shift = 0
+            self.shift_count = 0
+            self.control |= 0x0C
+            self._update()
+            return
+        self.shift |= (data & 0x01) << self.shift_count
+        self.shift_count += 1
+        if self.shift_count < 5:
+            return
+
+        value = self.shift
+        self.shift = 0
+        self.shift_count = 0
+        match (address >> 13) & 0x03:
+            case 0:
+                self.control = value
+            case 1:
+                self.chr_bank0 = value
+            case 2:
+                self.chr_bank1 = value
+            case 3:
+                self.prg_bank = value & 0x0F
+        self._update()
+
+    def _update(self):
+        self.ppu.set_mirroring(self.MIRRORING[self.control & 0x03])
+        match (self.control >> 2) & 0x03:
+            case 0 | 1:
+                # 32KB at once, the low bit is ignored
+                self.map_prg(0x8000, self.prg_bank & 0x0E)
+                self.map_prg(0xC000, self.prg_bank | 0x01)
+            case 2:
+                self.map_prg(0x8000, 0)
+                self.map_prg(0xC000, self.prg_bank)
+            case 3:
+                self.map_prg(0x8000, self.prg_bank)
+                self.map_prg(0xC000, -1)
+        if self.control & 0x10:
+            self.map_chr(0x0000, self.chr_bank0)
+            self.map_chr(0x1000, self.chr_bank1)
+        else:
+            self.map_chr(0x0000, self.chr_bank0 & 0x1E)
+            self.map_chr(0x1000, self.chr_bank0 | 0x01)
+
+
+class MMC3(Mapper):
+    # mapper 4, 8KB PRG and 1KB CHR windows plus a scanline counter IRQ
+    prg_window = 0x2000
+    chr_window = 0x0400
+    # PPU dot of each scanline where the counter is clocked, when sprites
+    # use $1000 and the background $0000 as most games set it up
+    CLOCK_DOT = 260
+
+    def reset(self):
+        self.bank_select = 0
+        self.registers = [0, 2, 4, 5, 6, 7, 0, 1]
+        self.irq_latch = 0
+        self.irq_counter = 0
+        self.irq_reload = False
+        self.irq_enabled = False
+        # scanline and frame origin of the next counter clock
+        self.scanline = 0
+        self.frame_start = 0
+        self._update()
+
+    def write(self, address, data):
+        even = not address & 0x01
+        match address & 0xE000:
+            case 0x8000 if even:
+                self.bank_select = data
+                self._update()
+            case 0x8000:
+                self.registers[self.bank_select & 0x07] = data
+                self._update()
+            case 0xA000 if even:
+                if self.rom.mirroring != "four_screen":
+                    mirroring = "horizontal" if data & 0x01 else "vertical"
+                    self.ppu.set_mirroring(mirroring)
+            case 0xC000 if even:
+                self.irq_latch = data
+            case 0xC000:
+                self.irq_counter = 0
+                self.irq_reload = True
+            case 0xE000 if even:
+                self.irq_enabled = False
+                self.bus.irq.discard(self)
+            case 0xE000:
+                self.irq_enabled = True
+
+    def _update(self):
+        registers = self.registers
+        if self.bank_select & 0x40:
+            self.map_prg(0x8000, -2)
+            self.map_prg(0xC000, registers[6])
+        else:
+            self.map_prg(0x8000, registers[6])
+            self.map_prg(0xC000, -2)
+        self.map_prg(0xA000, registers[7])
+        self.map_prg(0xE000, -1)
+
+        # 2KB banks ignore their low bit, inversion swaps the two halves
+        inversion = 0x1000 if self.bank_select & 0x80 else 0x0000
+        self.map_chr(inversion, registers[0] & 0xFE)
+        self.map_chr(inversion + 0x0400, registers[0] | 0x01)
+        self.map_chr(inversion + 0x0800, registers[1] & 0xFE)
+        self.map_chr(inversion + 0x0C00, registers[1] | 0x01)
+        for i in range(4):
+            self.map_chr((inversion ^ 0x1000) + i * 0x0400, registers[2 + i])
+
+    # clocked through the bus event scheduler, like the PPU
+
+    def run_until(self, cycle):
+        dot = cycle * 3
+        while dot >= self._next_clock():
+            if self.ppu.mask & (SHOW_BACKGROUND | SHOW_SPRITES):
+                self._clock()
+            # visible scanlines and the pre-render one
+            if self.scanline == 239:
+                self.scanline = 261
+            elif self.scanline == 261:
+                self.scanline = 0
+                self.frame_start += DOTS_PER_FRAME
+            else:
+                self.scanline += 1
+        return -(-self._next_clock() // 3)
+
+    def _next_clock(self):
+        return (
+            self.frame_start
+            + self.scanline * DOTS_PER_SCANLINE
+            + self.CLOCK_DOT
+        )
+
+    def _clock(self):
+        if self.irq_counter == 0 or self.irq_reload:
+            self.irq_counter = self.irq_latch
+            self.irq_reload = False
+        else:
+            self.irq_counter -= 1
+        if self.irq_counter == 0 and self.irq_enabled:
+            self.bus.irq.add(self)
+
+
+MAPPERS = {0: NROM, 1: MMC1, 2: UxROM, 3: CNROM, 4: MMC3}
+
+
+def create_mapper(rom, bus):
+    assert rom.mapper in MAPPERS, f"Mapper {rom.mapper} not supported"
+    return MAPPERS[rom.mapper](rom, bus)
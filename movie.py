@@ -0,0 +1,108 @@
+import argparse
+import struct
+import time
+import zlib
+
+# magic, RNG seed and frame count, then one button byte per frame
+HEADER = struct.Struct("<4sQI")
+MAGIC = b"HMV\x1a"
+
+
+class Movie:
+    def __init__(self, seed=0, frames=b""):
+        # `seed` feeds the frontend RNG, the snake game draws from it every
+        # instruction so it has to be replayed too
+        self.seed = seed
+        self.frames = bytearray(frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def record(self, buttons):
+        self.frames.append(buttons)
+
+    def save(self, filepath):
+        with open(filepath, "wb") as fp:
+            fp.write(HEADER.pack(MAGIC, self.seed, len(self.frames)))
+            fp.write(self.frames)
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath, "rb") as fp:
+            data = fp.read()
+        magic, seed, count = HEADER.unpack_from(data)
+        assert magic == MAGIC, "Invalid movie file."
+        frames = data[HEADER.size : HEADER.size + count]
+        assert len(frames) == count, "Truncated movie file."
+        return cls(seed, frames)
+
+
+def run_frame(cpu):
+    # one video frame, until the PPU starts the next one
+    ppu = cpu.bus.ppu
+    frame_count = ppu.frame_count
+    steps = 0
+    while ppu.frame_count == frame_count:
+        cpu.operation(cpu.bus.read(cpu.program_counter.read()))
+        steps += 1
+    return steps
+
+
+def load(rom, engine=None):
+    if engine is None:
+        from cpu import CPU as engine
+
+    cpu = engine()
+    cpu.load_rom(rom, synthesize=False)
+    cpu.reset()
+    return cpu
+
+
+def replay(rom, movie, engine=None):
+    # headless and unthrottled, controller 1 plays back the movie
+    return play(load(rom, engine), movie)
+
+
+def play(cpu, movie):
+    controller = cpu.bus.controllers[0]
+    steps = 0
+    for buttons in movie:
+        controller.buttons = buttons
+        steps += run_frame(cpu)
+    return cpu, steps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay an input movie")
+    parser.add_argument("rom")
+    parser.add_argument("movie")
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="fail on the first bus access the emulator can't handle",
+    )
+    args = parser.parse_args()
+
+    movie = Movie.load(args.movie)
+    start = time.perf_counter()
+    if args.rom.endswith("snake.nes"):
+        # snake polls $FF instead of the controller port
+        import snake
+
+        cpu, steps = snake.replay(movie)
+    else:
+        cpu = load(args.rom)
+        cpu.bus.diagnostics.strict = args.strict
+        cpu, steps = play(cpu, movie)
+    seconds = time.perf_counter() - start
+    # same movie, same RAM, a quick check that a replay reproduces
+    crc = zlib.crc32(cpu.bus.cpu_vram.data.tobytes())
+    print(
+        f"{len(movie)} frames, {steps} instructions in {seconds:.2f}s"
+        f" ({steps / seconds:,.0f} instr/s), RAM crc {crc:08x}"
+    )
+    print(cpu.bus.diagnostics.summary())
+    cpu.close()
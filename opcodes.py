@@ -0,0 +1,294 @@
+# https://www.nesdev.org/obelisk-6502-guide/reference.html
+# https://www.masswerk.at/6502/6502_instruction_set.html
+# https://www.nesdev.org/wiki/CPU_unofficial_opcodes
+
+# opcode: (mnemonic, addressing mode, cycles, +1 cycle on page cross)
+OPCODES = {
+    0x69: ("adc", "immediate", 2, False),
+    0x65: ("adc", "zero_page", 3, False),
+    0x75: ("adc", "zero_page_x", 4, False),
+    0x6D: ("adc", "absolute", 4, False),
+    0x7D: ("adc", "absolute_x", 4, True),
+    0x79: ("adc", "absolute_y", 4, True),
+    0x61: ("adc", "indirect_x", 6, False),
+    0x71: ("adc", "indirect_y", 5, True),
+    0x29: ("and", "immediate", 2, False),
+    0x25: ("and", "zero_page", 3, False),
+    0x35: ("and", "zero_page_x", 4, False),
+    0x2D: ("and", "absolute", 4, False),
+    0x3D: ("and", "absolute_x", 4, True),
+    0x39: ("and", "absolute_y", 4, True),
+    0x21: ("and", "indirect_x", 6, False),
+    0x31: ("and", "indirect_y", 5, True),
+    0x0A: ("asl", "accumulator", 2, False),
+    0x06: ("asl", "zero_page", 5, False),
+    0x16: ("asl", "zero_page_x", 6, False),
+    0x0E: ("asl", "absolute", 6, False),
+    0x1E: ("asl", "absolute_x", 7, False),
+    0x90: ("bcc", "relative", 2, False),
+    0xB0: ("bcs", "relative", 2, False),
+    0xF0: ("beq", "relative", 2, False),
+    0x24: ("bit", "zero_page", 3, False),
+    0x2C: ("bit", "absolute", 4, False),
+    0x30: ("bmi", "relative", 2, False),
+    0xD0: ("bne", "relative", 2, False),
+    0x10: ("bpl", "relative", 2, False),
+    0x00: ("brk", "implied", 7, False),
+    0x50: ("bvc", "relative", 2, False),
+    0x70: ("bvs", "relative", 2, False),
+    0x18: ("clc", "implied", 2, False),
+    0xD8: ("cld", "implied", 2, False),
+    0x58: ("cli", "implied", 2, False),
+    0xB8: ("clv", "implied", 2, False),
+    0xC9: ("cmp", "immediate", 2, False),
+    0xC5: ("cmp", "zero_page", 3, False),
+    0xD5: ("cmp", "zero_page_x", 4, False),
+    0xCD: ("cmp", "absolute", 4, False),
+    0xDD: ("cmp", "absolute_x", 4, True),
+    0xD9: ("cmp", "absolute_y", 4, True),
+    0xC1: ("cmp", "indirect_x", 6, False),
+    0xD1: ("cmp", "indirect_y", 5, True),
+    0xE0: ("cpx", "immediate", 2, False),
+    0xE4: ("cpx", "zero_page", 3, False),
+    0xEC: ("cpx", "absolute", 4, False),
+    0xC0: ("cpy", "immediate", 2, False),
+    0xC4: ("cpy", "zero_page", 3, False),
+    0xCC: ("cpy", "absolute", 4, False),
+    0xC6: ("dec", "zero_page", 5, False),
+    0xD6: ("dec", "zero_page_x", 6, False),
+    0xCE: ("dec", "absolute", 6, False),
+    0xDE: ("dec", "absolute_x", 7, False),
+    0xCA: ("dex", "implied", 2, False),
+    0x88: ("dey", "implied", 2, False),
+    0x49: ("eor", "immediate", 2, False),
+    0x45: ("eor", "zero_page", 3, False),
+    0x55: ("eor", "zero_page_x", 4, False),
+    0x4D: ("eor", "absolute", 4, False),
+    0x5D: ("eor", "absolute_x", 4, True),
+    0x59: ("eor", "absolute_y", 4, True),
+    0x41: ("eor", "indirect_x", 6, False),
+    0x51: ("eor", "indirect_y", 5, True),
+    0xE6: ("inc", "zero_page", 5, False),
+    0xF6: ("inc", "zero_page_x", 6, False),
+    0xEE: ("inc", "absolute", 6, False),
+    0xFE: ("inc", "absolute_x", 7, False),
+    0xE8: ("inx", "implied", 2, False),
+    0xC8: ("iny", "implied", 2, False),
+    0x4C: ("jmp", "absolute", 3, False),
+    0x6C: ("jmp", "indirect", 5, False),
+    0x20: ("jsr", "absolute", 6, False),
+    0xA9: ("lda", "immediate", 2, False),
+    0xA5: ("lda", "zero_page", 3, False),
+    0xB5: ("lda", "zero_page_x", 4, False),
+    0xAD: ("lda", "absolute", 4, False),
+    0xBD: ("lda", "absolute_x", 4, True),
+    0xB9: ("lda", "absolute_y", 4, True),
+    0xA1: ("lda", "indirect_x", 6, False),
+    0xB1: ("lda", "indirect_y", 5, True),
+    0xA2: ("ldx", "immediate", 2, False),
+    0xA6: ("ldx", "zero_page", 3, False),
+    0xB6: ("ldx", "zero_page_y", 4, False),
+    0xAE: ("ldx", "absolute", 4, False),
+    0xBE: ("ldx", "absolute_y", 4, True),
+    0xA0: ("ldy", "immediate", 2, False),
+    0xA4: ("ldy", "zero_page", 3, False),
+    0xB4: ("ldy", "zero_page_x", 4, False),
+    0xAC: ("ldy", "absolute", 4, False),
+    0xBC: ("ldy", "absolute_x", 4, True),
+    0x4A: ("lsr", "accumulator", 2, False),
+    0x46: ("lsr", "zero_page", 5, False),
+    0x56: ("lsr", "zero_page_x", 6, False),
+    0x4E: ("lsr", "absolute", 6, False),
+    0x5E: ("lsr", "absolute_x", 7, False),
+    0xEA: ("nop", "implied", 2, False),
+    0x09: ("ora", "immediate", 2, False),
+    0x05: ("ora", "zero_page", 3, False),
+    0x15: ("ora", "zero_page_x", 4, False),
+    0x0D: ("ora", "absolute", 4, False),
+    0x1D: ("ora", "absolute_x", 4, True),
+    0x19: ("ora", "absolute_y", 4, True),
+    0x01: ("ora", "indirect_x", 6, False),
+    0x11: ("ora", "indirect_y", 5, True),
+    0x48: ("pha", "implied", 3, False),
+    0x08: ("php", "implied", 3, False),
+    0x68: ("pla", "implied", 4, False),
+    0x28: ("plp", "implied", 4, False),
+    0x2A: ("rol", "accumulator", 2, False),
+    0x26: ("rol", "zero_page", 5, False),
+    0x36: ("rol", "zero_page_x", 6, False),
+    0x2E: ("rol", "absolute", 6, False),
+    0x3E: ("rol", "absolute_x", 7, False),
+    0x6A: ("ror", "accumulator", 2, False),
+    0x66: ("ror", "zero_page", 5, False),
+    0x76: ("ror", "zero_page_x", 6, False),
+    0x6E: ("ror", "absolute", 6, False),
+    0x7E: ("ror", "absolute_x", 7, False),
+    0x40: ("rti", "implied", 6, False),
+    0x60: ("rts", "implied", 6, False),
+    0xE9: ("sbc", "immediate", 2, False),
+    0xE5: ("sbc", "zero_page", 3, False),
+    0xF5: ("sbc", "zero_page_x", 4, False),
+    0xED: ("sbc", "absolute", 4, False),
+    0xFD: ("sbc", "absolute_x", 4, True),
+    0xF9: ("sbc", "absolute_y", 4, True),
+    0xE1: ("sbc", "indirect_x", 6, False),
+    0xF1: ("sbc", "indirect_y", 5, True),
+    0x38: ("sec", "implied", 2, False),
+    0xF8: ("sed", "implied", 2, False),
+    0x78: ("sei", "implied", 2, False),
+    0x85: ("sta", "zero_page", 3, False),
+    0x95: ("sta", "zero_page_x", 4, False),
+    0x8D: ("sta", "absolute", 4, False),
+    0x9D: ("sta", "absolute_x", 5, False),
+    0x99: ("sta", "absolute_y", 5, False),
+    0x81: ("sta", "indirect_x", 6, False),
+    0x91: ("sta", "indirect_y", 6, False),
+    0x86: ("stx", "zero_page", 3, False),
+    0x96: ("stx", "zero_page_y", 4, False),
+    0x8E: ("stx", "absolute", 4, False),
+    0x84: ("sty", "zero_page", 3, False),
+    0x94: ("sty", "zero_page_x", 4, False),
+    0x8C: ("sty", "absolute", 4, False),
+    0xAA: ("tax", "implied", 2, False),
+    0xA8: ("tay", "implied", 2, False),
+    0xBA: ("tsx", "implied", 2, False),
+    0x8A: ("txa", "implied", 2, False),
+    0x9A: ("txs", "implied", 2, False),
+    0x98: ("tya", "implied", 2, False),
+    # all opcodes below are illegal
+    0x4B: ("alr", "immediate", 2, False),
+    0x0B: ("anc", "immediate", 2, False),
+    0x2B: ("anc", "immediate", 2, False),
+    0x8B: ("xaa", "immediate", 2, False),
+    0x6B: ("arr", "immediate", 2, False),
+    0xC7: ("dcp", "zero_page", 5, False),
+    0xD7: ("dcp", "zero_page_x", 6, False),
+    0xCF: ("dcp", "absolute", 6, False),
+    0xDF: ("dcp", "absolute_x", 7, False),
+    0xDB: ("dcp", "absolute_y", 7, False),
+    0xC3: ("dcp", "indirect_x", 8, False),
+    0xD3: ("dcp", "indirect_y", 8, False),
+    0xE7: ("isc", "zero_page", 5, False),
+    0xF7: ("isc", "zero_page_x", 6, False),
+    0xEF: ("isc", "absolute", 6, False),
+    0xFF: ("isc", "absolute_x", 7, False),
+    0xFB: ("isc", "absolute_y", 7, False),
+    0xE3: ("isc", "indirect_x", 8, False),
+    0xF3: ("isc", "indirect_y", 8, False),
+    0xBB: ("las", "absolute_y", 4, True),
+    0xA7: ("lax", "zero_page", 3, False),
+    0xB7: ("lax", "zero_page_y", 4, False),
+    0xAF: ("lax", "absolute", 4, False),
+    0xBF: ("lax", "absolute_y", 4, True),
+    0xA3: ("lax", "indirect_x", 6, False),
+    0xB3: ("lax", "indirect_y", 5, True),
+    0xAB: ("lxa", "immediate", 2, False),
+    0x27: ("rla", "zero_page", 5, False),
+    0x37: ("rla", "zero_page_x", 6, False),
+    0x2F: ("rla", "absolute", 6, False),
+    0x3F: ("rla", "absolute_x", 7, False),
+    0x3B: ("rla", "absolute_y", 7, False),
+    0x23: ("rla", "indirect_x", 8, False),
+    0x33: ("rla", "indirect_y", 8, False),
+    0x67: ("rra", "zero_page", 5, False),
+    0x77: ("rra", "zero_page_x", 6, False),
+    0x6F: ("rra", "absolute", 6, False),
+    0x7F: ("rra", "absolute_x", 7, False),
+    0x7B: ("rra", "absolute_y", 7, False),
+    0x63: ("rra", "indirect_x", 8, False),
+    0x73: ("rra", "indirect_y", 8, False),
+    0x87: ("sax", "zero_page", 3, False),
+    0x97: ("sax", "zero_page_y", 4, False),
+    0x8F: ("sax", "absolute", 4, False),
+    0x83: ("sax", "indirect_x", 6, False),
+    0xCB: ("sbx", "immediate", 2, False),
+    0x9F: ("sha", "absolute_y", 5, False),
+    0x93: ("sha", "indirect_y", 6, False),
+    0x9E: ("shx", "absolute_y", 5, False),
+    0x9C: ("shy", "absolute_x", 5, False),
+    0x07: ("slo", "zero_page", 5, False),
+    0x17: ("slo", "zero_page_x", 6, False),
+    0x0F: ("slo", "absolute", 6, False),
+    0x1F: ("slo", "absolute_x", 7, False),
+    0x1B: ("slo", "absolute_y", 7, False),
+    0x03: ("slo", "indirect_x", 8, False),
+    0x13: ("slo", "indirect_y", 8, False),
+    0x47: ("sre", "zero_page", 5, False),
+    0x57: ("sre", "zero_page_x", 6, False),
+    0x4F: ("sre", "absolute", 6, False),
+    0x5F: ("sre", "absolute_x", 7, False),
+    0x5B: ("sre", "absolute_y", 7, False),
+    0x43: ("sre", "indirect_x", 8, False),
+    0x53: ("sre", "indirect_y", 8, False),
+    0x9B: ("tas", "absolute_y", 5, False),
+    0xEB: ("sbc", "immediate", 2, False),
+    0x1A: ("nop", "implied", 2, False),
+    0x3A: ("nop", "implied", 2, False),
+    0x5A: ("nop", "implied", 2, False),
+    0x7A: ("nop", "implied", 2, False),
+    0xDA: ("nop", "implied", 2, False),
+    0xFA: ("nop", "implied", 2, False),
+    0x80: ("nop", "immediate", 2, False),
+    0x82: ("nop", "immediate", 2, False),
+    0x89: ("nop", "immediate", 2, False),
+    0xC2: ("nop", "immediate", 2, False),
+    0xE2: ("nop", "immediate", 2, False),
+    0x04: ("nop", "zero_page", 3, False),
+    0x44: ("nop", "zero_page", 3, False),
+    0x64: ("nop", "zero_page", 3, False),
+    0x14: ("nop", "zero_page_x", 4, False),
+    0x34: ("nop", "zero_page_x", 4, False),
+    0x54: ("nop", "zero_page_x", 4, False),
+    0x74: ("nop", "zero_page_x", 4, False),
+    0xD4: ("nop", "zero_page_x", 4, False),
+    0xF4: ("nop", "zero_page_x", 4, False),
+    0x0C: ("nop", "absolute", 4, False),
+    0x1C: ("nop", "absolute_x", 4, True),
+    0x3C: ("nop", "absolute_x", 4, True),
+    0x5C: ("nop", "absolute_x", 4, True),
+    0x7C: ("nop", "absolute_x", 4, True),
+    0xDC: ("nop", "absolute_x", 4, True),
+    0xFC: ("nop", "absolute_x", 4, True),
+    0x02: ("jam", "implied", 0, False),
+    0x12: ("jam", "implied", 0, False),
+    0x22: ("jam", "implied", 0, False),
+    0x32: ("jam", "implied", 0, False),
+    0x42: ("jam", "implied", 0, False),
+    0x52: ("jam", "implied", 0, False),
+    0x62: ("jam", "implied", 0, False),
+    0x72: ("jam", "implied", 0, False),
+    0x92: ("jam", "implied", 0, False),
+    0xB2: ("jam", "implied", 0, False),
+    0xD2: ("jam", "implied", 0, False),
+    0xF2: ("jam", "implied", 0, False),
+}
+
+LENGTHS = {
+    "implied": 1,
+    "accumulator": 1,
+    "immediate": 2,
+    "zero_page": 2,
+    "zero_page_x": 2,
+    "zero_page_y": 2,
+    "relative": 2,
+    "indirect_x": 2,
+    "indirect_y": 2,
+    "absolute": 3,
+    "absolute_x": 3,
+    "absolute_y": 3,
+    "indirect": 3,
+}
+
+# the table lists official opcodes first, illegal ones start at `alr`
+UNOFFICIAL = frozenset(tuple(OPCODES)[tuple(OPCODES).index(0x4B) :])
+
+# flat lookups indexed by opcode, cheaper than the dict in the hot loop
+MNEMONICS = tuple(OPCODES[opcode][0] for opcode in range(0x100))
+MODES = tuple(OPCODES[opcode][1] for opcode in range(0x100))
+CYCLES = tuple(OPCODES[opcode][2] for opcode in range(0x100))
+PAGE_PENALTY = tuple(OPCODES[opcode][3] for opcode in range(0x100))
+SIZES = tuple(LENGTHS[mode] for mode in MODES)
+# name of the CPU method implementing each opcode
+HANDLERS = tuple(
+    "and_" if mnemonic == "and" else mnemonic for mnemonic in MNEMONICS
+)
@@ -0,0 +1,413 @@
+import numpy as np
+
+from tiles import FLIP_VERTICAL, TileCache
+
+# NTSC timing in PPU dots, the CPU runs one cycle every 3 dots
+DOTS_PER_SCANLINE = 341
+SCANLINES = 262
+DOTS_PER_FRAME = DOTS_PER_SCANLINE * SCANLINES
+VBLANK_START = 241 * DOTS_PER_SCANLINE + 1
+# dot 1 of the pre-render scanline
+VBLANK_END = 261 * DOTS_PER_SCANLINE + 1
+
+WIDTH = 256
+HEIGHT = 240
+
+# PPUCTRL
+INCREMENT_32 = 0x04
+SPRITE_TABLE = 0x08
+BACKGROUND_TABLE = 0x10
+SPRITE_SIZE_16 = 0x20
+GENERATE_NMI = 0x80
+# PPUMASK
+GRAYSCALE = 0x01
+SHOW_BACKGROUND_LEFT = 0x02
+SHOW_SPRITES_LEFT = 0x04
+SHOW_BACKGROUND = 0x08
+SHOW_SPRITES = 0x10
+# PPUSTATUS
+SPRITE_OVERFLOW = 0x20
+SPRITE_ZERO_HIT = 0x40
+VBLANK = 0x80
+
+# physical 1KB nametable behind each of the 4 logical ones
+NAMETABLE_MIRRORING = {
+    "horizontal": (0, 0, 1, 1),
+    "vertical": (0, 1, 0, 1),
+    "four_screen": (0, 1, 2, 3),
+    "single_screen_lower": (0, 0, 0, 0),
+    "single_screen_upper": (1, 1, 1, 1),
+}
+
+# attribute byte and bit shift of every tile of a 32x30 nametable
+_tile_rows = np.arange(30)[:, None]
+_tile_cols = np.arange(32)[None, :]
+ATTRIBUTE_INDEX = 0x3C0 + (_tile_rows // 4) * 8 + _tile_cols // 4
+ATTRIBUTE_SHIFT = ((_tile_rows & 2) << 1) | (_tile_cols & 2)
+
+# OAM attributes
+SPRITE_PALETTE = 0x03
+BEHIND_BACKGROUND = 0x20
+
+SPRITES_PER_LINE = 8
+
+ROWS = np.arange(HEIGHT)
+COLS = np.arange(WIDTH)
+SPRITE_COLS = np.arange(8)
+
+
+class PPU:
+    def __init__(self, rom, bus):
+        self.bus = bus
+        # pattern tables, carts without CHR ROM have 8KB of CHR RAM instead
+        chr_ram = rom.number_chr_rom_banks == 0
+        # decoded once, CHR RAM writes only invalidate their tile. CHR ROM
+        # is decoded by the ROM and shared with every PPU running it
+        if chr_ram:
+            data = np.zeros((0x2000,), dtype=np.uint8)
+            self.tile_cache = TileCache(data, writable=True)
+        else:
+            self.tile_cache = rom.tile_cache
+        self.chr = self.tile_cache.data
+        # offset in CHR of the 1KB bank behind each of the 8 pattern table
+        # slots, and the resulting cache index of the 512 visible tiles.
+        # mappers switch banks by updating these two
+        self.chr_banks = np.arange(8) * 0x400
+        self.tile_map = np.arange(512)
+        # room for 4 nametables, mirroring decides which ones are used
+        self.vram = np.zeros((0x1000,), dtype=np.uint8)
+        self.set_mirroring(rom.mirroring)
+        self.palette = np.zeros((0x20,), dtype=np.uint8)
+        # 64 sprites of 4 bytes: y, tile, attributes, x
+        self.oam = np.zeros((0x100,), dtype=np.uint8)
+        # palette indices of the last rendered frame, in the 0-63 range
+        self.frame = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        # 2 bit background pixel values, 0 is transparent
+        self.background = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        # palette RAM indices behind the background pixels
+        self.background_colors = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        # same for the front-most sprite on each pixel
+        self.sprites = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        self.sprite_colors = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        self.sprite_behind = np.zeros((HEIGHT, WIDTH), dtype=bool)
+        # palette RAM indices of the composited frame
+        self.colors = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        self.reset()
+
+    def reset(self):
+        self.ctrl = 0
+        self.mask = 0
+        self.status = 0
+        # loopy registers: current and temporary VRAM address, fine X scroll
+        # and the first/second write toggle shared by $2005 and $2006
+        self.v = 0
+        self.t = 0
+        self.fine_x = 0
+        self.w = 0
+        self.read_buffer = 0
+        # last value written to any register, returned by write-only ones
+        self.latch = 0
+        self.oam_address = 0
+        self.frame_count = 0
+        # dot where the frame being drawn started
+        self.frame_start = 0
+        # pending events as {handler: dot}
+        self.events = {self._start_vblank: VBLANK_START}
+
+    # CPU side, `register` is the address already masked down to 0-7
+
+    def read(self, register):
+        match register:
+            case 2:
+                value = (self.status & 0xE0) | (self.latch & 0x1F)
+                self.status &= ~VBLANK
+                self.w = 0
+            case 7:
+                address = self.v & 0x3FFF
+                if address < 0x3F00:
+                    # reads lag one behind, except for the palette
+                    value = self.read_buffer
+                    self.read_buffer = self.read_memory(address)
+                else:
+                    value = self.read_memory(address)
+                    self.read_buffer = self.read_memory(address - 0x1000)
+                self._increment_address()
+            case 4:
+                value = int(self.oam[self.oam_address])
+            case _:
+                value = self.latch
+        self.latch = value
+        return np.uint8(value)
+
+    def write(self, register, data):
+        data = int(data)
+        self.latch = data
+        match register:
+            case 0:
+                nmi_enabled = self.ctrl & GENERATE_NMI
+                self.ctrl = data
+                self.t = (self.t & 0xF3FF) | ((data & 0x03) << 10)
+                # enabling NMI during vblank fires one right away
+                if (
+                    not nmi_enabled
+                    and data & GENERATE_NMI
+                    and self.status & VBLANK
+                ):
+                    self.bus.request_nmi()
+            case 1:
+                self.mask = data
+            case 3:
+                self.oam_address = data
+            case 4:
+                # attribute bits 2-4 don't exist and read back as 0
+                if self.oam_address & 0x03 == 0x02:
+                    data &= 0xE3
+                self.oam[self.oam_address] = data
+                self.oam_address = (self.oam_address + 1) & 0xFF
+            case 5:
+                if not self.w:
+                    self.t = (self.t & 0xFFE0) | (data >> 3)
+                    self.fine_x = data & 0x07
+                else:
+                    self.t = (
+                        (self.t & 0x8C1F)
+                        | ((data & 0x07) << 12)
+                        | ((data & 0xF8) << 2)
+                    )
+                self.w ^= 1
+            case 6:
+                if not self.w:
+                    self.t = (self.t & 0x00FF) | ((data & 0x3F) << 8)
+                else:
+                    self.t = (self.t & 0xFF00) | data
+                    self.v = self.t
+                self.w ^= 1
+            case 7:
+                self.write_memory(self.v & 0x3FFF, data)
+                self._increment_address()
+
+    def write_oam(self, data):
+        # OAM DMA, 256 bytes starting at the current OAM address
+        split = 0x100 - self.oam_address
+        self.oam[self.oam_address :] = data[:split]
+        self.oam[: self.oam_address] = data[split:]
+        self.oam[2::4] &= 0xE3
+
+    def _increment_address(self):
+        self.v = (self.v + (32 if self.ctrl & INCREMENT_32 else 1)) & 0x7FFF
+
+    # PPU address space
+
+    def read_memory(self, address):
+        if address < 0x2000:
+            return int(self.chr[self._chr_address(address)])
+        if address < 0x3F00:
+            return int(self.vram[self._nametable_address(address)])
+        return int(self.palette[self._palette_address(address)])
+
+    def write_memory(self, address, data):
+        if address < 0x2000:
+            self.tile_cache.write(self._chr_address(address), data)
+        elif address < 0x3F00:
+            self.vram[self._nametable_address(address)] = data
+        else:
+            self.palette[self._palette_address(address)] = data & 0x3F
+
+    def set_mirroring(self, mirroring):
+        self.nametable_map = np.array(NAMETABLE_MIRRORING[mirroring])
+
+    def map_chr(self, start, size, offset):
+        slots = slice(start >> 10, (start + size) >> 10)
+        self.chr_banks[slots] = offset + np.arange(size >> 10) * 0x400
+        self.tile_map[:] = (
+            (self.chr_banks >> 4)[:, None] + np.arange(64)
+        ).reshape(512)
+
+    def _chr_address(self, address):
+        return self.chr_banks[address >> 10] + (address & 0x3FF)
+
+    def _nametable_address(self, address):
+        table = (address >> 10) & 0x03
+        return self.nametable_map[table] * 0x400 + (address & 0x3FF)
+
+    @staticmethod
+    def _palette_address(address):
+        address &= 0x1F
+        # $3F10/$3F14/$3F18/$3F1C mirror the background entries
+        if address & 0x13 == 0x10:
+            address &= 0x0F
+        return address
+
+    # timing, driven by the bus event scheduler
+
+    def run_until(self, cycle):
+        dot = cycle * 3
+        while True:
+            handler, when = min(self.events.items(), key=lambda e: e[1])
+            if dot < when:
+                # first CPU cycle at or after the next event
+                return -(-when // 3)
+            del self.events[handler]
+            handler()
+
+    def _start_vblank(self):
+        self.frame_count += 1
+        self.status |= VBLANK
+        if self.ctrl & GENERATE_NMI:
+            self.bus.request_nmi()
+        self.events[self._start_frame] = self.frame_start + VBLANK_END
+
+    def _start_frame(self):
+        # pre-render scanline: everything written during vblank is in place,
+        # so the next frame is drawn in one go from here
+        self.status &= ~(VBLANK | SPRITE_ZERO_HIT | SPRITE_OVERFLOW)
+        self.frame_start += DOTS_PER_FRAME
+        self.events[self._start_vblank] = self.frame_start + VBLANK_START
+        sprite_zero_hit, overflow_line = self.render_frame()
+        # flags the CPU polls for mid-frame are raised when the beam gets there
+        if sprite_zero_hit is not None:
+            line, x = sprite_zero_hit
+            self.events[self._sprite_zero_hit] = (
+                self.frame_start + line * DOTS_PER_SCANLINE + x + 1
+            )
+        if overflow_line is not None:
+            self.events[self._sprite_overflow] = (
+                self.frame_start + overflow_line * DOTS_PER_SCANLINE
+            )
+
+    def _sprite_zero_hit(self):
+        self.status |= SPRITE_ZERO_HIT
+
+    def _sprite_overflow(self):
+        self.status |= SPRITE_OVERFLOW
+
+    # rendering
+
+    def render_frame(self):
+        self.render_background()
+        sprite_zero_hit, overflow_line = self.render_sprites()
+
+        colors = self.colors
+        colors[:] = self.background_colors
+        # sprites behind the background only show through its transparent
+        # pixels, the front-most sprite decides even when it is behind
+        front = (self.sprites != 0) & (
+            ~self.sprite_behind | (self.background == 0)
+        )
+        np.copyto(colors, self.sprite_colors, where=front)
+        np.take(self.palette, colors, out=self.frame)
+        if self.mask & GRAYSCALE:
+            self.frame &= 0x30
+        return sprite_zero_hit, overflow_line
+
+    def render_background(self):
+        t, fine_x, ctrl, mask = self.t, self.fine_x, self.ctrl, self.mask
+        if not mask & SHOW_BACKGROUND:
+            self.background[:] = 0
+            self.background_colors[:] = 0
+            return
+
+        tiles, palettes = self.background_tiles()
+        self.tile_cache.refresh()
+        table = ((ctrl & BACKGROUND_TABLE) >> 4) * 256
+        patterns = self.tile_cache.tiles[self.tile_map[table : table + 256]]
+        # pixel coordinates inside the 512x480 map of the 4 nametables
+        x = (((t & 0x1F) << 3) | fine_x) + ((t >> 10) & 1) * WIDTH
+        y = ((((t >> 5) & 0x1F) << 3) | (t >> 12)) + ((t >> 11) & 1) * HEIGHT
+        rows = ((y + ROWS) % (2 * HEIGHT))[:, None]
+        cols = ((x + COLS) % (2 * WIDTH))[None, :]
+
+        tile_rows = rows >> 3
+        tile_cols = cols >> 3
+        pixels = patterns[tiles[tile_rows, tile_cols], rows & 7, cols & 7]
+        if not mask & SHOW_BACKGROUND_LEFT:
+            pixels[:, :8] = 0
+        colors = (palettes[tile_rows, tile_cols] << 2) | pixels
+        # every transparent pixel shows the universal background colour
+        colors[pixels == 0] = 0
+        self.background[:] = pixels
+        self.background_colors[:] = colors
+
+    def background_tiles(self):
+        # tile indices and palette numbers of the 4 logical nametables laid
+        # out as one 64x60 tile map
+        nametables = self.vram.reshape(4, 0x400)[self.nametable_map]
+        tiles = nametables[:, :0x3C0].reshape(2, 2, 30, 32)
+        attributes = nametables[:, ATTRIBUTE_INDEX].reshape(2, 2, 30, 32)
+        palettes = (attributes >> ATTRIBUTE_SHIFT) & 0x03
+        return (
+            tiles.transpose(0, 2, 1, 3).reshape(60, 64),
+            palettes.transpose(0, 2, 1, 3).reshape(60, 64),
+        )
+
+    def evaluate_sprites(self):
+        # (240, 64) row of each sprite inside its tile on every scanline and
+        # the mask of those drawn there, after the 8 sprites per line limit.
+        # sprites show up one line below their OAM y
+        height = 16 if self.ctrl & SPRITE_SIZE_16 else 8
+        rows = ROWS[:, None] - self.oam[0::4].astype(np.intp) - 1
+        in_range = (rows >= 0) & (rows < height)
+        counts = np.cumsum(in_range, axis=1)
+        selected = in_range & (counts <= SPRITES_PER_LINE)
+        overflow = np.flatnonzero(counts[:, -1] > SPRITES_PER_LINE)
+        overflow_line = int(overflow[0]) if overflow.size else None
+        return rows, selected, overflow_line
+
+    def render_sprites(self):
+        # returns the (line, x) of the sprite 0 hit and the first scanline
+        # with too many sprites, or None
+        self.sprites[:] = 0
+        self.sprite_behind[:] = False
+        ctrl, mask = self.ctrl, self.mask
+        if not mask & (SHOW_BACKGROUND | SHOW_SPRITES):
+            return None, None
+        rows, selected, overflow_line = self.evaluate_sprites()
+        if not mask & SHOW_SPRITES:
+            return None, overflow_line
+
+        # one entry per (scanline, sprite) pair, at most 8 per line
+        lines, sprites = np.nonzero(selected)
+        rows = rows[lines, sprites]
+        tiles = self.oam[1::4][sprites].astype(np.intp)
+        attributes = self.oam[2::4][sprites]
+        flips = attributes >> 6
+        if ctrl & SPRITE_SIZE_16:
+            # bit 0 picks the table, vertical flips also swap the two halves
+            bottom = (rows >= 8) ^ ((flips & FLIP_VERTICAL) > 0)
+            tiles = ((tiles & 0x01) << 8) + (tiles & 0xFE) + bottom
+        else:
+            tiles += (ctrl & SPRITE_TABLE) << 5
+
+        self.tile_cache.refresh()
+        pixels = self.tile_cache.variants[
+            flips, self.tile_map[tiles], rows & 7
+        ]
+        xs = self.oam[3::4][sprites].astype(np.intp)[:, None] + SPRITE_COLS
+        visible = (pixels != 0) & (xs < WIDTH)
+        if not mask & SHOW_SPRITES_LEFT:
+            visible &= xs >= 8
+        ys = np.broadcast_to(lines[:, None], xs.shape)[visible]
+        xs = xs[visible]
+        owners = np.broadcast_to(sprites[:, None], visible.shape)[visible]
+        colors = 0x10 | ((attributes & SPRITE_PALETTE) << 2)[:, None] | pixels
+        behind = np.broadcast_to(
+            (attributes & BEHIND_BACKGROUND > 0)[:, None], visible.shape
+        )
+
+        # the lowest OAM index wins where opaque sprite pixels overlap
+        position = ys * WIDTH + xs
+        order = np.lexsort((owners, position))
+        first = np.ones((order.shape[0],), dtype=bool)
+        first[1:] = position[order][1:] != position[order][:-1]
+        front = order[first]
+        self.sprites[ys[front], xs[front]] = pixels[visible][front]
+        self.sprite_colors[ys[front], xs[front]] = colors[visible][front]
+        self.sprite_behind[ys[front], xs[front]] = behind[visible][front]
+
+        # sprite 0 against the opaque background, never on the last column
+        zero = owners == 0
+        hits = zero & (self.background[ys, xs] != 0) & (xs != WIDTH - 1)
+        if not hits.any():
+            return None, overflow_line
+        hit = np.argmin(np.where(hits, position, WIDTH * HEIGHT))
+        return (int(ys[hit]), int(xs[hit])), overflow_line
@@ -0,0 +1,158 @@
+import argparse
+import marshal
+
+import numpy as np
+
+from cpu import CPU
+from opcodes import HANDLERS, MNEMONICS, MODES
+
+
+class Profiler:
+    def __init__(self, sample_every=64):
+        self.sample_every = sample_every
+        self.opcode_counts = np.zeros((0x100,), dtype=np.int64)
+        self.pc_counts = np.zeros((0x10000,), dtype=np.int64)
+        # wall time is only taken on every `sample_every`-th instruction
+        self.handler_ns = np.zeros((0x100,), dtype=np.int64)
+        self.handler_samples = np.zeros((0x100,), dtype=np.int64)
+
+    @property
+    def instructions(self):
+        return int(self.opcode_counts.sum())
+
+    def reset(self):
+        for counters in (
+            self.opcode_counts,
+            self.pc_counts,
+            self.handler_ns,
+            self.handler_samples,
+        ):
+            counters[:] = 0
+
+    def estimated_ns(self):
+        # mean sampled time per opcode scaled by its execution count, opcodes
+        # that were never sampled fall back to the overall mean
+        total_samples = self.handler_samples.sum()
+        overall = self.handler_ns.sum() / total_samples if total_samples else 0
+        mean = np.divide(
+            self.handler_ns,
+            self.handler_samples,
+            out=np.full((0x100,), overall, dtype=np.float64),
+            where=self.handler_samples > 0,
+        )
+        return mean * self.opcode_counts
+
+    def hotspots(self, top=20, labels=None, describe=None):
+        total = self.instructions
+        lines = [f"{total} instructions"]
+        if not total:
+            return "\n".join(lines)
+
+        if labels:
+            # each label covers the addresses up to the next one
+            starts = sorted(
+                (address, name) for name, address in labels.items()
+            )
+            ends = [address - 1 for address, _ in starts[1:]] + [0xFFFF]
+            rows = [
+                (
+                    int(self.pc_counts[start : end + 1].sum()),
+                    f"{start:04X}-{end:04X}",
+                    name,
+                )
+                for (start, name), end in zip(starts, ends)
+            ]
+            rows.sort(reverse=True)
+        else:
+            hottest = np.argsort(self.pc_counts)[::-1][:top]
+            rows = [
+                (
+                    int(self.pc_counts[pc]),
+                    f"{pc:04X}",
+                    describe(pc) if describe is not None else "",
+                )
+                for pc in hottest
+                if self.pc_counts[pc]
+            ]
+
+        lines.append(f"{'count':>10} {'share':>7}  {'address':<9}  code")
+        for hits, address, text in rows[:top]:
+            if hits:
+                lines.append(
+                    f"{hits:>10} {hits / total:>7.1%}  {address:<9}  {text}"
+                )
+        return "\n".join(lines)
+
+    def opcode_report(self, top=20):
+        estimated = self.estimated_ns()
+        lines = [f"{'count':>10} {'est. ms':>9}  opcode"]
+        for opcode in np.argsort(estimated)[::-1][:top]:
+            if self.opcode_counts[opcode]:
+                lines.append(
+                    f"{self.opcode_counts[opcode]:>10}"
+                    f" {estimated[opcode] / 1e6:>9.1f}"
+                    f"  {opcode:02X} {MNEMONICS[opcode]} {MODES[opcode]}"
+                )
+        return "\n".join(lines)
+
+    def pstats(self):
+        # host-level view in the format cProfile dumps, one entry per CPU
+        # handler called from `CPU.operation`, times in seconds
+        estimated = self.estimated_ns() / 1e9
+        operation = self._function_key(CPU.operation)
+        handlers = {}
+        for opcode in range(0x100):
+            if not self.opcode_counts[opcode]:
+                continue
+            key = self._function_key(getattr(CPU, HANDLERS[opcode]))
+            calls, seconds = handlers.get(key, (0, 0.0))
+            handlers[key] = (
+                calls + int(self.opcode_counts[opcode]),
+                seconds + float(estimated[opcode]),
+            )
+
+        total_calls = self.instructions
+        total_seconds = float(estimated.sum())
+        stats = {operation: (total_calls, total_calls, 0.0, total_seconds, {})}
+        for key, (calls, seconds) in handlers.items():
+            stats[key] = (
+                calls,
+                calls,
+                seconds,
+                seconds,
+                {operation: (calls, calls, seconds, seconds)},
+            )
+        return stats
+
+    def dump_stats(self, filepath):
+        # loadable with `pstats.Stats(filepath)` and `snakeviz filepath`
+        with open(filepath, "wb") as fp:
+            marshal.dump(self.pstats(), fp)
+
+    @staticmethod
+    def _function_key(function):
+        code = function.__code__
+        return code.co_filename, code.co_firstlineno, code.co_name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile a ROM")
+    parser.add_argument("rom")
+    parser.add_argument("--steps", type=int, default=10000)
+    parser.add_argument("--sample-every", type=int, default=64)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--pstats")
+    args = parser.parse_args()
+
+    cpu = CPU()
+    cpu.load_rom(args.rom)
+    cpu.reset()
+    profiler = Profiler(args.sample_every)
+    cpu.attach_profiler(profiler)
+    cpu.main_loop(args.steps)
+
+    print(profiler.hotspots(args.top, describe=cpu.bus.disassembler.text))
+    print()
+    print(profiler.opcode_report(args.top))
+    if args.pstats:
+        profiler.dump_stats(args.pstats)
@@ -0,0 +1,193 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import movie as movies
+from differential import memories
+
+GOLDEN = "golden.json"
+
+
+def state_hash(cpu):
+    # RAM and the last rendered frame, enough to catch a divergence within
+    # a few frames of it happening
+    digest = hashlib.blake2b(digest_size=16)
+    for data in memories(cpu):
+        digest.update(data)
+    digest.update(cpu.bus.ppu.frame)
+    return digest.hexdigest()
+
+
+def frames(rom, movie, count, strict=False):
+    # yields the CPU after each of `count` frames, the movie's buttons are
+    # held on controller 1 and the last ones stay pressed past its end.
+    # `strict` fails on bus accesses the emulator can't handle
+    buttons = [] if movie is None else list(movie)
+    if rom.endswith("snake.nes"):
+        # snake polls $FF once per pass of its game loop and draws from the
+        # frontend RNG, same as `snake.replay`. it ends at game over
+        import snake
+
+        cpu = movies.load(rom)
+        cpu.bus.diagnostics.strict = strict
+        rng = np.random.default_rng(0 if movie is None else movie.seed)
+        for frame in range(count):
+            if cpu.program_counter.read() == snake.GAME_OVER_ADDRESS:
+                return
+            if frame < len(buttons):
+                snake.press(cpu, buttons[frame])
+            snake.run_frame(cpu, rng)
+            yield cpu
+        return
+
+    cpu = movies.load(rom)
+    cpu.bus.diagnostics.strict = strict
+    controller = cpu.bus.controllers[0]
+    for frame in range(count):
+        if frame < len(buttons):
+            controller.buttons = buttons[frame]
+        movies.run_frame(cpu)
+        yield cpu
+
+
+def run_case(case, golden=None, strict=False):
+    # (case, hashes, first differing checkpoint, error). with `golden` it
+    # stops at the first hash that differs, otherwise it records them all.
+    # an exception fails this case only, at the checkpoint it was heading to
+    hashes = []
+    try:
+        checkpoint = _run_case(case, golden, strict, hashes)
+    except Exception as e:
+        return case, hashes, len(hashes), f"{type(e).__name__}: {e}"
+    return case, hashes, checkpoint, None
+
+
+def _run_case(case, golden, strict, hashes):
+    movie = None if case["movie"] is None else movies.Movie.load(case["movie"])
+    interval = case["interval"]
+    for frame, cpu in enumerate(
+        frames(case["rom"], movie, case["frames"], strict)
+    ):
+        if (frame + 1) % interval:
+            continue
+        hashes.append(state_hash(cpu))
+        checkpoint = len(hashes) - 1
+        if golden is not None and (
+            checkpoint >= len(golden) or hashes[-1] != golden[checkpoint]
+        ):
+            return checkpoint
+    if golden is not None and len(hashes) != len(golden):
+        return len(hashes)
+    return None
+
+
+def run_cases(cases, check=True, workers=None, strict=False):
+    # one process per case, `check` compares against the recorded hashes
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(
+            run_case,
+            cases,
+            [case["hashes"] if check else None for case in cases],
+            [strict] * len(cases),
+        )
+
+
+def make_case(rom, movie=None, frames=None, interval=60):
+    if frames is None:
+        assert movie is not None, "Cases without a movie need --frames"
+        frames = len(movies.Movie.load(movie))
+    name = os.path.basename(rom)
+    if movie is not None:
+        name += f":{os.path.basename(movie)}"
+    return {
+        "name": name,
+        "rom": rom,
+        "movie": movie,
+        "frames": frames,
+        "interval": interval,
+        "hashes": [],
+    }
+
+
+def load_golden(filepath=GOLDEN):
+    with open(filepath) as fp:
+        return json.load(fp)["cases"]
+
+
+def save_golden(cases, filepath=GOLDEN):
+    with open(filepath, "w") as fp:
+        json.dump({"cases": cases}, fp, indent=1)
+        fp.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check ROMs and movies against recorded state hashes"
+    )
+    parser.add_argument("--golden", default=GOLDEN)
+    parser.add_argument(
+        "--record",
+        nargs="+",
+        action="append",
+        metavar=("ROM", "MOVIE"),
+        help="record a case, replaces one with the same ROM and movie",
+    )
+    parser.add_argument("--frames", type=int, help="movie length by default")
+    parser.add_argument(
+        "--interval", type=int, default=60, help="frames between hashes"
+    )
+    parser.add_argument("--filter", default="")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="fail on bus accesses the emulator can't handle",
+    )
+    args = parser.parse_args()
+
+    cases = load_golden(args.golden) if os.path.exists(args.golden) else []
+    start = time.perf_counter()
+    if args.record:
+        recorded = [
+            make_case(rom, next(iter(movie), None), args.frames, args.interval)
+            for rom, *movie in args.record
+        ]
+        failed = 0
+        for case, hashes, _, error in run_cases(
+            recorded, False, args.workers, args.strict
+        ):
+            if error is not None:
+                # an earlier recording of the case, if any, is kept
+                failed += 1
+                print(f"{case['name']}: FAILED while recording, {error}")
+                continue
+            case["hashes"] = hashes
+            cases = [known for known in cases if known["name"] != case["name"]]
+            cases.append(case)
+            print(f"{case['name']}: recorded {len(hashes)} checkpoints")
+        save_golden(cases, args.golden)
+        raise SystemExit(1 if failed else 0)
+
+    cases = [case for case in cases if args.filter in case["name"]]
+    assert cases, f"No cases in {args.golden}, add some with --record"
+    failed = 0
+    for case, hashes, checkpoint, error in run_cases(
+        cases, True, args.workers, args.strict
+    ):
+        if checkpoint is None:
+            print(f"{case['name']}: ok, {len(hashes)} checkpoints")
+            continue
+        failed += 1
+        reason = "" if error is None else f", {error}"
+        print(
+            f"{case['name']}: FAILED at checkpoint {checkpoint}, frame"
+            f" {(checkpoint + 1) * case['interval']}{reason}"
+        )
+    seconds = time.perf_counter() - start
+    print(f"{len(cases) - failed}/{len(cases)} passed in {seconds:.1f}s")
+    raise SystemExit(1 if failed else 0)
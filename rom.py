@@ -1,57 +1,135 @@
+import hashlib
+import mmap
+import os
+
 import numpy as np
 
+from tiles import TileCache
+
+HEADER_SIZE = 16
+TRAINER_SIZE = 512
+PRG_BANK_SIZE = 16 * 1024
+CHR_BANK_SIZE = 8 * 1024
+
+# one ROM per distinct image by BLAKE2 digest, and the digest of each file
+# seen so far by (path, size, mtime) so it is only hashed once
+_IMAGES = {}
+_DIGESTS = {}
+
+
+def parse_header(header):
+    # iNES and NES 2.0 headers with plain integer bit operations, shared
+    # with the ROM indexer which never loads the whole file
+    header = bytes(header[:HEADER_SIZE])
+    assert header[:4] == b"NES\x1a", "Invalid iNES ROM file."
+    flags6 = header[6]
+    flags7 = header[7]
+    nes2 = flags7 & 0x0C == 0x08
+
+    mapper = (flags7 & 0xF0) | (flags6 >> 4)
+    submapper = 0
+    prg_size = header[4] * PRG_BANK_SIZE
+    chr_size = header[5] * CHR_BANK_SIZE
+    if nes2:
+        mapper |= (header[8] & 0x0F) << 8
+        submapper = header[8] >> 4
+        prg_size = _nes2_size(header[4], header[9] & 0x0F, PRG_BANK_SIZE)
+        chr_size = _nes2_size(header[5], header[9] >> 4, CHR_BANK_SIZE)
+    elif any(header[12:16]):
+        # old dumping tools left signatures here, flags 7 is garbage then
+        mapper &= 0x0F
+
+    if flags6 & 0x08:
+        mirroring = "four_screen"
+    elif flags6 & 0x01:
+        mirroring = "vertical"
+    else:
+        mirroring = "horizontal"
+
+    return {
+        "nes2": nes2,
+        "mapper": mapper,
+        "submapper": submapper,
+        "prg_size": prg_size,
+        "chr_size": chr_size,
+        "mirroring": mirroring,
+        "battery": bool(flags6 & 0x02),
+        "trainer": bool(flags6 & 0x04),
+    }
+
+
+def _nes2_size(lsb, msb, unit):
+    if msb == 0x0F:
+        # exponent-multiplier notation, 2^E * (MM * 2 + 1) bytes
+        return (1 << (lsb >> 2)) * ((lsb & 0x03) * 2 + 1)
+    return ((msb << 8) | lsb) * unit
+
 
 class ROM:
-    def __init__(self, filepath):
+    def __init__(self, source):
+        # `source` is a path or any buffer, e.g. an mmap from `ROM.mmap`
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as file:
+                source = file.read()
+        # the whole image stays in one buffer, PRG and CHR are views of it
+        # that mappers bank switch over without copying
+        self.data = np.frombuffer(source, dtype=np.uint8)
+        self.digest = hashlib.blake2b(self.data, digest_size=16).hexdigest()
+        self._parse_ines_header(self.data[:HEADER_SIZE])
+        self._load_prg_rom()
+        self._tile_cache = None
+
+    @classmethod
+    def mmap(cls, filepath):
+        # zero-copy load, pages are read in by the OS as they are touched
         with open(filepath, "rb") as file:
-            header = file.read(16)
-            self._parse_ines_header(header)
-            self._load_prg_rom(file)
+            source = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(source)
+
+    @classmethod
+    def shared(cls, filepath):
+        # every bus loading the same image gets the same read-only ROM, its
+        # mmap is opened once per process and the OS page cache backs it,
+        # so pooled and forked workers share the pages too
+        stat = os.stat(filepath)
+        key = (os.path.realpath(filepath), stat.st_size, stat.st_mtime_ns)
+        digest = _DIGESTS.get(key)
+        if digest is None:
+            rom = cls.mmap(filepath)
+            digest = _DIGESTS[key] = rom.digest
+            _IMAGES.setdefault(digest, rom)
+        return _IMAGES[digest]
+
+    def __deepcopy__(self, memo):
+        # nothing in here changes, snapshots can keep pointing at it
+        return self
+
+    @property
+    def tile_cache(self):
+        # CHR ROM decoded once per image for all the PPUs using it
+        if self._tile_cache is None:
+            cache = TileCache(self.chr_rom_data)
+            cache.variants.flags.writeable = False
+            cache.tiles.flags.writeable = False
+            self._tile_cache = cache
+        return self._tile_cache
 
     def _parse_ines_header(self, header):
-        assert header[:4] == b"NES\x1a", "Invalid iNES ROM file."
-
-        self.number_prg_rom_banks = header[4]
-        self.number_chr_rom_banks = header[5]
-        self._parse_control_byte1(header[6])
-        self._parse_control_byte2(header[7])
-        self._parse_mapper()
-
-    def _parse_control_byte1(self, byte):
-        bits = np.binary_repr(byte, width=8)
-        vertical_mirroring = bool(bits[-1])
-        self.battery_ram = bool(bits[-2])
-        self.trainer = bool(bits[-3])
-        four_screen_vram = bool(bits[-4])
-        self.lower_mapper = bits[-8:-4]
-
-        mirroring = (vertical_mirroring, four_screen_vram)
-        match mirroring:
-            case True, _:
-                self.mirroring = "four_screen"
-            case False, True:
-                self.mirroring = "vertical"
-            case False, False:
-                self.mirroring = "horizontal"
-
-    def _parse_control_byte2(self, byte):
-        bits = np.binary_repr(byte, width=8)
-        assert (
-            int(bits[-4:-2], base=2) == 0
-        ), "iNES different than v1.0 not supported"
-        self.upper_mapper = bits[-8:-4]
-
-    def _parse_mapper(self):
-        self.mapper = int(self.upper_mapper + self.lower_mapper)
-        assert self.mapper == 0, f"Mapper {self.mapper} not supported"
-
-    def _load_prg_rom(self, file):
-        prg_rom_size = self.number_prg_rom_banks * 16 * 1024  # 16KB per bank
-        prg_rom_data = file.read(prg_rom_size)
-        prg_rom_data = np.frombuffer(prg_rom_data, dtype=np.uint8)
-        self.prg_rom_data = prg_rom_data
-
-        chr_rom_size = self.number_chr_rom_banks * 8 * 1024  # 8KB per bank
-        chr_rom_data = file.read(chr_rom_size)
-        chr_rom_data = np.frombuffer(chr_rom_data, dtype=np.uint8)
-        self.chr_rom_data = chr_rom_data
+        header = parse_header(header)
+        self.nes2 = header["nes2"]
+        self.mapper = header["mapper"]
+        self.submapper = header["submapper"]
+        self.prg_rom_size = header["prg_size"]
+        self.chr_rom_size = header["chr_size"]
+        self.number_prg_rom_banks = self.prg_rom_size // PRG_BANK_SIZE
+        self.number_chr_rom_banks = self.chr_rom_size // CHR_BANK_SIZE
+        self.mirroring = header["mirroring"]
+        self.battery_ram = header["battery"]
+        self.trainer = header["trainer"]
+
+    def _load_prg_rom(self):
+        start = HEADER_SIZE + (TRAINER_SIZE if self.trainer else 0)
+        self.prg_rom_data = self.data[start : start + self.prg_rom_size]
+
+        start += self.prg_rom_size
+        self.chr_rom_data = self.data[start : start + self.chr_rom_size]
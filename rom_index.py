@@ -0,0 +1,125 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from rom import (
+    CHR_BANK_SIZE,
+    HEADER_SIZE,
+    PRG_BANK_SIZE,
+    TRAINER_SIZE,
+    parse_header,
+)
+
+INDEX = "rom_index.json"
+EXTENSIONS = (".nes",)
+
+
+def index_rom(filepath):
+    # runs in the worker processes, the file is mmap'd and hashed in place
+    with open(filepath, "rb") as file:
+        if os.fstat(file.fileno()).st_size < HEADER_SIZE:
+            return {"error": "File too small for an iNES header"}
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                header = parse_header(data[:HEADER_SIZE])
+            except AssertionError as e:
+                return {"error": str(e)}
+            start = HEADER_SIZE + (TRAINER_SIZE if header["trainer"] else 0)
+            end = start + header["prg_size"]
+            view = memoryview(data)
+            try:
+                prg = hashlib.sha256(view[start:end]).hexdigest()
+                chr_ = hashlib.sha256(
+                    view[end : end + header["chr_size"]]
+                ).hexdigest()
+                rom = hashlib.sha256(
+                    view[start : end + header["chr_size"]]
+                ).hexdigest()
+            finally:
+                view.release()
+    return {
+        **header,
+        "prg_banks": header["prg_size"] // PRG_BANK_SIZE,
+        "chr_banks": header["chr_size"] // CHR_BANK_SIZE,
+        "sha256": rom,
+        "prg_sha256": prg,
+        "chr_sha256": chr_,
+    }
+
+
+def find_roms(directory):
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def load_index(filepath):
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath) as fp:
+        return json.load(fp)
+
+
+def update_index(directory, index_path=INDEX, workers=None):
+    # only files that are new or whose mtime/size changed are hashed again,
+    # entries for removed files are dropped
+    index = load_index(index_path)
+    seen = set()
+    stale = []
+    for filepath in find_roms(directory):
+        stat = os.stat(filepath)
+        seen.add(filepath)
+        entry = index.get(filepath)
+        if (
+            entry is None
+            or entry["mtime"] != stat.st_mtime_ns
+            or entry["size"] != stat.st_size
+        ):
+            stale.append((filepath, stat))
+
+    removed = [filepath for filepath in index if filepath not in seen]
+    for filepath in removed:
+        del index[filepath]
+
+    if stale:
+        with ProcessPoolExecutor(workers) as pool:
+            records = pool.map(
+                index_rom,
+                [filepath for filepath, _ in stale],
+                chunksize=max(1, len(stale) // (4 * (os.cpu_count() or 1))),
+            )
+            for (filepath, stat), record in zip(stale, records):
+                index[filepath] = {
+                    "mtime": stat.st_mtime_ns,
+                    "size": stat.st_size,
+                    **record,
+                }
+
+    # written to a temporary file first so an interrupted run keeps the old
+    # index intact
+    temporary = f"{index_path}.tmp"
+    with open(temporary, "w") as fp:
+        json.dump(index, fp, indent=1, sort_keys=True)
+    os.replace(temporary, index_path)
+    return index, len(stale), len(removed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index a ROM library")
+    parser.add_argument("directory")
+    parser.add_argument("--index", default=INDEX)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    index, updated, removed = update_index(
+        args.directory, args.index, args.workers
+    )
+    errors = sum("error" in entry for entry in index.values())
+    print(
+        f"{len(index)} ROMs indexed, {updated} updated, {removed} removed,"
+        f" {errors} unreadable"
+    )
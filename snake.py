@@ -1,9 +1,11 @@
+import argparse
 import struct
 
 import numpy as np
-import pygame
 
+from controller import DOWN, LEFT, RIGHT, UP
 from cpu import CPU
+from movie import Movie
 
 SCALE_FACTOR = 30
 SCREEN_SIZE = 32
@@ -11,25 +13,32 @@ BG_COLOR = (0, 0, 0)
 SNAKE_COLOR = (0, 255, 0)
 FOOD_COLOR = (255, 255, 255)
 
-KEY_MAPPINGS = {
-    pygame.K_UP: 0x77,
-    pygame.K_DOWN: 0x73,
-    pygame.K_LEFT: 0x61,
-    pygame.K_RIGHT: 0x64,
-}
+# by pygame key name, pygame is only imported once there is a window
+KEY_MAPPINGS = {"up": UP, "down": DOWN, "left": LEFT, "right": RIGHT}
+# the game polls the last key pressed at $FF instead of a controller, movies
+# store controller buttons that are translated to its ASCII "wasd"
+BUTTON_KEYS = {UP: 0x77, DOWN: 0x73, LEFT: 0x61, RIGHT: 0x64}
+KEY_ADDRESS = 0xFF
+
+# screen bytes are 0 for the background, 1 for the snake and anything else
+# for the food
+PALETTE = np.array([BG_COLOR, SNAKE_COLOR] + [FOOD_COLOR] * 254, np.uint8)
 
 SCREEN_ADDRESS = 0x200
+RNG_ADDRESS = 0xFE
+GAME_LOOP_ADDRESS = 0x8638
+# snake.nes is assembled at $8600, so easy6502's $0735 `gameOver` is $8735
+GAME_OVER_ADDRESS = 0x8735
 
-pygame.init()
-display = pygame.display.set_mode(
-    (SCALE_FACTOR * SCREEN_SIZE, SCALE_FACTOR * SCREEN_SIZE)
-)
-pygame.display.set_caption("6502 Snake Game")
+display = None
+fps = None
 prev_screen = None
 
 
 class FPS:
     def __init__(self):
+        import pygame
+
         self.clock = pygame.time.Clock()
         self.font = pygame.font.Font(pygame.font.match_font("ubuntumono"), 40)
         self.text = self.font.render(
@@ -38,7 +47,7 @@ class FPS:
             FOOD_COLOR,
         )
 
-    def render(self, display: pygame.display):
+    def render(self, display):
         self.text = self.font.render(
             str(round(self.clock.get_fps())).rjust(3),
             True,
@@ -47,7 +56,29 @@ class FPS:
         display.blit(self.text, (10, 10))
 
 
-fps = FPS()
+def init_display(headless=False):
+    global display, fps, prev_screen
+    from display import Display
+
+    display = Display(
+        PALETTE,
+        SCREEN_SIZE,
+        SCREEN_SIZE,
+        SCALE_FACTOR,
+        caption="6502 Snake Game",
+        headless=headless,
+    )
+    if not headless:
+        fps = FPS()
+    prev_screen = np.zeros((SCREEN_SIZE, SCREEN_SIZE), dtype=np.uint8)
+
+
+def screen(cpu: CPU):
+    # a view straight into CPU RAM, nothing is copied
+    data = cpu.bus.cpu_vram.data[
+        SCREEN_ADDRESS : SCREEN_ADDRESS + SCREEN_SIZE**2
+    ]
+    return data.reshape(SCREEN_SIZE, SCREEN_SIZE)
 
 
 def read_snake_data():
@@ -59,90 +90,103 @@ def read_snake_data():
 
 
 def callback(cpu: CPU):
-    global prev_screen
+    import pygame
+
+    # returns the buttons pressed since the last call
+    buttons = 0
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             exit()
         elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_UP:
-                cpu.bus.write(0xFF, 0x77)
-            elif event.key == pygame.K_DOWN:
-                cpu.bus.write(0xFF, 0x73)
-            elif event.key == pygame.K_LEFT:
-                cpu.bus.write(0xFF, 0x61)
-            elif event.key == pygame.K_RIGHT:
-                cpu.bus.write(0xFF, 0x64)
-
-    screen = cpu.bus.read_chunk(SCREEN_ADDRESS, SCREEN_SIZE**2)
-    if np.array_equal(screen, prev_screen):
-        prev_screen = screen
-        return
-
-    display.fill(BG_COLOR)
-    # it would be more efficient if we checked for snake body parts and food
-    # positions from memory, but meh
-    update = False
-    for address in range(SCREEN_ADDRESS, SCREEN_ADDRESS + SCREEN_SIZE**2):
-        x = (address - SCREEN_ADDRESS) % SCREEN_SIZE
-        y = (address - SCREEN_ADDRESS) // SCREEN_SIZE
-        pixel_ram_value = cpu.bus.read(address)
-        match pixel_ram_value:
-            case 0x00:
-                color = BG_COLOR
-            case 0x01:
-                color = SNAKE_COLOR
-            case _:
-                color = FOOD_COLOR
-        if (
-            display.get_at(
-                (
-                    SCALE_FACTOR * x + SCALE_FACTOR // 2,
-                    SCALE_FACTOR * y + SCALE_FACTOR // 2,
-                )
-            )[:3]
-            != color
-        ):
-            update = True
-            pygame.draw.rect(
-                display,
-                color,
-                [
-                    SCALE_FACTOR * x,
-                    SCALE_FACTOR * y,
-                    SCALE_FACTOR,
-                    SCALE_FACTOR,
-                ],
-            )
-
-    prev_screen = screen
-    fps.render(display)
-    if update:
+            buttons |= KEY_MAPPINGS.get(pygame.key.name(event.key), 0)
+
+    current = screen(cpu)
+    if not np.array_equal(current, prev_screen):
+        prev_screen[:] = current
+        display.show(current)
+        fps.render(display.window)
         pygame.display.update()
-    fps.clock.tick()
+        fps.clock.tick()
+    return buttons
+
+
+def press(cpu: CPU, buttons):
+    # $FF holds a single key, with several buttons down the last one in
+    # BUTTON_KEYS order wins (right, then left, down, up), whatever order
+    # they were pressed in
+    for button, key in BUTTON_KEYS.items():
+        if buttons & button:
+            cpu.bus.write(KEY_ADDRESS, key)
+
+
+def screenshot(cpu: CPU):
+    # (32, 32, 3) RGB, works with a headless display too
+    return display.screenshot(screen(cpu))
 
 
 def screen_dump(cpu: CPU):
-    data = cpu.bus.data[SCREEN_ADDRESS : SCREEN_ADDRESS + SCREEN_SIZE**2]
-    data = data.reshape(32, 32)
-    np.savetxt("screen.csv", data, fmt="%d", delimiter=",")
+    np.savetxt("screen.csv", screen(cpu), fmt="%d", delimiter=",")
+
+
+def step(cpu: CPU, rng: np.random.Generator):
+    cpu.bus.write(RNG_ADDRESS, rng.integers(low=0, high=255, dtype=np.uint8))
+    opcode = cpu.bus.read(cpu.program_counter.read())
+    cpu.operation(opcode)
 
 
-def run():
+def run_frame(cpu: CPU, rng: np.random.Generator):
+    # headless: one pass of the game loop, until it jumps back to its start
+    steps = 0
+    while True:
+        step(cpu, rng)
+        steps += 1
+        pc = cpu.program_counter.read()
+        if pc == GAME_LOOP_ADDRESS or pc == GAME_OVER_ADDRESS:
+            return steps
+
+
+def run(record=None, seed=None):
+    init_display()
     cpu = CPU()
     cpu.load_rom("snake.nes")
     # cpu.bus.write16(0xFFFC, 0x0600)
     cpu.reset()
 
-    game_over = False
-    rng = np.random.default_rng()
-    while not game_over:
-        cpu.bus.write(0xFE, rng.integers(low=0, high=255, dtype=np.uint8))
-        callback(cpu)
-        opcode = cpu.bus.read(cpu.program_counter.read())
-        cpu.operation(opcode)
-        if cpu.program_counter.read() == 0x735:
-            game_over = True
+    # input is sampled once per pass of the game loop, so the movie can
+    # replay it at the same points
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1, np.uint64)[0])
+    movie = Movie(seed)
+    rng = np.random.default_rng(seed)
+    try:
+        while cpu.program_counter.read() != GAME_OVER_ADDRESS:
+            buttons = callback(cpu)
+            movie.record(buttons)
+            press(cpu, buttons)
+            run_frame(cpu, rng)
+    finally:
+        if record is not None:
+            movie.save(record)
+
+
+def replay(movie: Movie):
+    # no display, as fast as the core goes
+    cpu = CPU()
+    cpu.load_rom("snake.nes", synthesize=False)
+    cpu.reset()
+    rng = np.random.default_rng(movie.seed)
+    steps = 0
+    for buttons in movie:
+        if cpu.program_counter.read() == GAME_OVER_ADDRESS:
+            break
+        press(cpu, buttons)
+        steps += run_frame(cpu, rng)
+    return cpu, steps
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="6502 snake")
+    parser.add_argument("--record", help="save the input movie here")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    run(args.record, args.seed)
@@ -0,0 +1,120 @@
+import numpy as np
+
+import snake
+from bus import Bus
+from controller import DOWN, LEFT, RIGHT, UP
+from cpu import CPU
+
+# action index to buttons, 0 keeps the current direction
+ACTIONS = (0, UP, DOWN, LEFT, RIGHT)
+
+APPLE_ADDRESS = 0x00
+# two bytes per segment, the game starts with three
+LENGTH_ADDRESS = 0x03
+INITIAL_LENGTH = 6
+
+
+def snapshot(cpu: CPU):
+    # snake only lives in CPU RAM and the registers
+    return (
+        cpu.bus.cpu_vram.data.copy(),
+        cpu.accumulator.read(),
+        cpu.register_x.read(),
+        cpu.register_y.read(),
+        cpu.stack_pointer.read(),
+        cpu.program_counter.read(),
+        cpu.status.read(),
+    )
+
+
+def restore(cpu: CPU, state):
+    ram, a, x, y, sp, pc, status = state
+    # in place, the RAM may be a view the observations are taken from
+    np.copyto(cpu.bus.cpu_vram.data, ram)
+    cpu.accumulator.write(a)
+    cpu.register_x.write(x)
+    cpu.register_y.write(y)
+    cpu.stack_pointer.write(sp)
+    cpu.program_counter.write(pc)
+    cpu.status.write(status)
+
+
+class SnakeEnv:
+    def __init__(self, frames_per_step=1, seed=None, memory=None):
+        # `memory` is the 2KB of CPU RAM to run in, `VectorSnakeEnv` gives
+        # each environment a row of one shared array
+        self.frames_per_step = frames_per_step
+        self.rng = np.random.default_rng(seed)
+        self.cpu = CPU()
+        self.cpu.load_rom("snake.nes", synthesize=False)
+        self.cpu.reset()
+        if memory is not None:
+            np.copyto(memory, self.cpu.bus.cpu_vram.data)
+            self.cpu.bus.cpu_vram.data = memory
+        # booting once is enough, every reset restores this
+        snake.run_frame(self.cpu, self.rng)
+        self.boot = snapshot(self.cpu)
+        self.observation = snake.screen(self.cpu)
+        self.ram = self.cpu.bus.cpu_vram.data
+        self.done = False
+
+    @property
+    def score(self):
+        return (int(self.ram[LENGTH_ADDRESS]) - INITIAL_LENGTH) // 2
+
+    def reset(self):
+        restore(self.cpu, self.boot)
+        # the snapshot has the apple the boot placed, draw a new one like
+        # the game does
+        self.ram[APPLE_ADDRESS] = self.rng.integers(256)
+        self.ram[APPLE_ADDRESS + 1] = self.rng.integers(4) + 2
+        self.done = False
+        return self.observation
+
+    def step(self, action):
+        # returns (observation, reward, done), the observation is a view of
+        # CPU RAM and changes with the next step
+        assert not self.done, "Episode is over, call reset()"
+        score = self.score
+        snake.press(self.cpu, ACTIONS[action])
+        for _ in range(self.frames_per_step):
+            snake.run_frame(self.cpu, self.rng)
+            if self.cpu.program_counter.read() == snake.GAME_OVER_ADDRESS:
+                self.done = True
+                break
+        return self.observation, self.score - score, self.done
+
+
+class VectorSnakeEnv:
+    # finished environments are reset by `step`, their last observation is
+    # lost like in gym's vector environments
+    def __init__(self, num_envs, frames_per_step=1, seed=None):
+        seeds = np.random.SeedSequence(seed).spawn(num_envs)
+        # all the RAM in one array so the observations are a single view
+        self.memory = np.zeros((num_envs, Bus.RAM_SIZE), dtype=np.uint8)
+        self.envs = [
+            SnakeEnv(frames_per_step, seed, memory)
+            for seed, memory in zip(seeds, self.memory)
+        ]
+        start = snake.SCREEN_ADDRESS
+        end = start + snake.SCREEN_SIZE**2
+        self.observations = self.memory[:, start:end].reshape(
+            num_envs, snake.SCREEN_SIZE, snake.SCREEN_SIZE
+        )
+        self.rewards = np.zeros((num_envs,), dtype=np.int64)
+        self.dones = np.zeros((num_envs,), dtype=bool)
+
+    def __len__(self):
+        return len(self.envs)
+
+    def reset(self):
+        for env in self.envs:
+            env.reset()
+        return self.observations
+
+    def step(self, actions):
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            _, self.rewards[i], self.dones[i] = env.step(action)
+            if self.dones[i]:
+                env.reset()
+        return self.observations, self.rewards, self.dones
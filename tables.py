@@ -0,0 +1,93 @@
+import argparse
+import os
+
+import numpy as np
+
+# bump whenever a builder changes, files of other versions are rebuilt
+VERSION = 1
+FILEPATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tables.npz"
+)
+
+
+def noise_long():
+    return _lfsr(1)
+
+
+def noise_short():
+    return _lfsr(6)
+
+
+def _lfsr(tap):
+    # output of the APU's 15 bit noise LFSR over a full period
+    shift = 1
+    output = []
+    while True:
+        output.append(1 - (shift & 1))
+        feedback = (shift ^ (shift >> tap)) & 1
+        shift = (shift >> 1) | (feedback << 14)
+        if shift == 1:
+            return np.array(output, dtype=np.uint8)
+
+
+# everything that is slow enough to be worth keeping on disk, by name
+BUILDERS = {
+    "noise_long": noise_long,
+    "noise_short": noise_short,
+}
+
+_tables = None
+
+
+def load(filepath=FILEPATH):
+    # all tables from one np.load, {} if the file is missing, unreadable or
+    # from another version. whatever is wrong with it, it is just rebuilt
+    try:
+        with np.load(filepath) as data:
+            if int(data["version"]) != VERSION:
+                return {}
+            return {name: data[name] for name in data.files}
+    except Exception:
+        return {}
+
+
+def build(filepath=FILEPATH):
+    tables = {name: builder() for name, builder in BUILDERS.items()}
+    save(tables, filepath)
+    return tables
+
+
+def save(tables, filepath=FILEPATH):
+    # written aside and renamed, workers starting together never see half a
+    # file. a read-only checkout just rebuilds in every process
+    temporary = f"{filepath}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "wb") as fp:
+            np.savez(fp, version=VERSION, **tables)
+        os.replace(temporary, filepath)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def get(name):
+    # read-only, the first call loads the file and builds it if needed
+    global _tables
+    if _tables is None:
+        _tables = load()
+        if any(name not in _tables for name in BUILDERS):
+            _tables = build()
+        for table in _tables.values():
+            table.flags.writeable = False
+    return _tables[name]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild the precomputed lookup tables"
+    )
+    parser.add_argument("--output", default=FILEPATH)
+    args = parser.parse_args()
+
+    for name, table in build(args.output).items():
+        print(f"{name}: {table.shape} {table.dtype}")
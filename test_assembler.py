@@ -0,0 +1,44 @@
+import pytest
+
+from assembler import assemble, to_ines
+from rom import ROM
+
+EXPLICIT = """
+.org $8000
+start:
+    jmp start
+handler:
+    rti
+.org $FFFA
+.word handler, start, handler
+"""
+
+
+def vectors(tmp_path, image):
+    filepath = tmp_path / "vectors.nes"
+    filepath.write_bytes(image)
+    prg = ROM(str(filepath)).prg_rom_data
+    return [int(prg[i - 6]) | (int(prg[i - 5]) << 8) for i in (0, 2, 4)]
+
+
+def test_program_vectors_are_kept(tmp_path):
+    program = assemble(EXPLICIT)
+    start, handler = program.symbols["start"], program.symbols["handler"]
+    image = to_ines(program)
+    assert vectors(tmp_path, image) == [handler, start, handler]
+
+
+def test_missing_vectors_default_to_labels(tmp_path):
+    program = assemble(".org $C000\nnmi:\n    rti\nreset:\n    jmp reset\n")
+    nmi, reset = program.symbols["nmi"], program.symbols["reset"]
+    assert vectors(tmp_path, to_ines(program)) == [nmi, reset, 0xC000]
+
+
+def test_explicit_vectors_override_the_program(tmp_path):
+    image = to_ines(assemble(EXPLICIT), vectors={"reset": 0x8003})
+    assert vectors(tmp_path, image)[1] == 0x8003
+
+
+def test_program_ending_inside_a_vector():
+    with pytest.raises(AssertionError):
+        to_ines(assemble(".org $FFFA\n.byte $00, $80, $00\n"))
@@ -0,0 +1,52 @@
+from assembler import assemble
+from cpu import CPU
+from debugger import Debugger, Stop
+
+PROGRAM_START = 0x0600
+
+
+def debugged(source):
+    cpu = CPU()
+    cpu.load_rom("snake.nes")
+    cpu.reset()
+    program = assemble(source, PROGRAM_START)
+    for offset, value in enumerate(program.data):
+        cpu.bus.write(PROGRAM_START + offset, value)
+    cpu.program_counter.write(PROGRAM_START)
+    return Debugger(cpu)
+
+
+def test_watch_fires_through_a_mirror():
+    debugger = debugged("lda #$05\nsta $0810\nsta $0010\n")
+    debugger.add_watchpoint(0x0010)
+    stop = debugger.run(3)
+    assert stop.reason == "write watchpoint"
+    assert (stop.pc, stop.address, stop.value) == (0x0602, 0x0010, 0x05)
+
+
+def test_watch_on_a_mirror_fires_on_the_original():
+    debugger = debugged("lda #$07\nsta $0010\n")
+    debugger.add_watchpoint(0x1810)
+    stop = debugger.run(2)
+    assert (stop.pc, stop.address, stop.value) == (0x0602, 0x0010, 0x07)
+
+
+def test_watch_on_a_ppu_register_mirror():
+    debugger = debugged("lda #$00\nsta $3FFE\n")
+    debugger.add_watchpoint(0x2006)
+    stop = debugger.run(2)
+    assert (stop.pc, stop.address) == (0x0602, 0x2006)
+
+
+def test_watch_hit_from_outside_the_debug_loop():
+    debugger = debugged("nop\n")
+    debugger.add_watchpoint(0x0010)
+    debugger.cpu.bus.write(0x0010, 5)
+    stop = debugger.stop
+    assert (stop.pc, stop.address, stop.value) == (0x0600, 0x0010, 5)
+    assert repr(stop).startswith("write watchpoint at PC 0600")
+
+
+def test_stop_without_a_pc():
+    stop = Stop("write watchpoint", None, 0x0010, 5)
+    assert repr(stop) == "write watchpoint at PC ----, $0010 = 05"
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from assembler import assemble, to_ines
+from cpu import CPU
+
+
+def filled(tmp_path, mapper):
+    # 32KB of PRG, so each window holds something different
+    program = assemble(".org $8000\n" + ".byte $12, $34, $56\n" * 0x2AA8)
+    filepath = tmp_path / f"mapper{mapper}.nes"
+    filepath.write_bytes(to_ines(program, mapper=mapper))
+    return str(filepath)
+
+
+@pytest.mark.parametrize("mapper", [None, 0, 2, 4])
+def test_read16_across_window_edges(tmp_path, mapper):
+    cpu = CPU()
+    cpu.load_rom("snake.nes" if mapper is None else filled(tmp_path, mapper))
+    bus = cpu.bus
+    # $FFFF wraps around to RAM
+    bus.write(0x0000, 0x78)
+    window = bus.mapper.prg_window
+    for address in range(0x8000 + window - 1, 0x10000, window):
+        expected = int(bus.read(address)) | (
+            int(bus.read((address + 1) & 0xFFFF)) << 8
+        )
+        assert bus.read16(np.uint16(address)) == expected, f"${address:04X}"
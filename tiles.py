@@ -0,0 +1,59 @@
+import numpy as np
+
+TILE_SIZE = 16
+
+# variant index is the OAM attribute flip bits, (attributes >> 6) & 3
+NORMAL = 0
+FLIP_HORIZONTAL = 1
+FLIP_VERTICAL = 2
+FLIP_BOTH = 3
+
+
+def decode_tiles(data):
+    # each tile is 8 bytes of low bitplane followed by 8 bytes of high
+    # bitplane, the result is (n_tiles, 8, 8) 2 bit pixel values
+    planes = data.reshape(-1, 2, 8, 1)
+    bits = np.unpackbits(planes, axis=3)
+    return bits[:, 0] | (bits[:, 1] << 1)
+
+
+class TileCache:
+    def __init__(self, data, writable=False):
+        # pattern memory, CHR RAM carts write to it through `write`
+        self.data = data
+        self.writable = writable
+        n_tiles = data.shape[0] // TILE_SIZE
+        # indexed as [flip bits, tile, row, column]
+        self.variants = np.zeros((4, n_tiles, 8, 8), dtype=np.uint8)
+        self.tiles = self.variants[NORMAL]
+        self.dirty = np.zeros((n_tiles,), dtype=bool)
+        self._decode(slice(None))
+
+    def write(self, address, data):
+        if not self.writable:
+            return
+        self.data[address] = data
+        self.dirty[address // TILE_SIZE] = True
+
+    def write_chunk(self, address, data):
+        if not self.writable:
+            return
+        self.data[address : address + data.shape[0]] = data
+        first = address // TILE_SIZE
+        last = (address + data.shape[0] - 1) // TILE_SIZE
+        self.dirty[first : last + 1] = True
+
+    def refresh(self):
+        # renderers call this first, tiles written since the last frame are
+        # decoded again, once
+        if self.dirty.any():
+            self._decode(np.flatnonzero(self.dirty))
+            self.dirty[:] = False
+
+    def _decode(self, index):
+        data = self.data.reshape(-1, TILE_SIZE)[index]
+        tiles = decode_tiles(data)
+        self.variants[NORMAL, index] = tiles
+        self.variants[FLIP_HORIZONTAL, index] = tiles[:, :, ::-1]
+        self.variants[FLIP_VERTICAL, index] = tiles[:, ::-1]
+        self.variants[FLIP_BOTH, index] = tiles[:, ::-1, ::-1]
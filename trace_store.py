@@ -0,0 +1,216 @@
+import argparse
+import os
+
+import numpy as np
+
+from tracer import TRACE_DTYPE, WRITE_DTYPE, format_record, load_trace
+
+CHUNK_SIZE = 2**20
+
+
+class TraceStore:
+    # one `.npy` per field, read through memmaps:
+    #   steps/<field>.npy   one entry per executed instruction
+    #   writes/<field>.npy  one entry per byte written through the bus
+    def __init__(self, directory):
+        self.directory = directory
+        self.steps = self._load_table("steps", TRACE_DTYPE)
+        self.writes = self._load_table("writes", WRITE_DTYPE)
+
+    def __len__(self):
+        return len(self.steps["pc"])
+
+    def __getitem__(self, field):
+        return self.steps[field]
+
+    @classmethod
+    def convert(cls, trace_path, directory, writes_path=None):
+        if writes_path is None:
+            writes_path = os.path.splitext(trace_path)[0] + ".writes"
+        cls._save_table(load_trace(trace_path), directory, "steps")
+        if os.path.exists(writes_path):
+            writes = load_trace(writes_path, WRITE_DTYPE)
+        else:
+            writes = np.zeros((0,), dtype=WRITE_DTYPE)
+        cls._save_table(writes, directory, "writes")
+        return cls(directory)
+
+    def where(self, start=0, stop=None, **conditions):
+        # conditions are values (`pc=0xC72A`) or inclusive ranges
+        # (`pc=(0xC000, 0xC7FF)`)
+        return np.concatenate(
+            [
+                chunk_start + np.flatnonzero(mask)
+                for chunk_start, mask in self._scan(start, stop, conditions)
+            ]
+            or [np.zeros((0,), dtype=np.int64)]
+        )
+
+    def first(self, start=0, stop=None, **conditions):
+        for chunk_start, mask in self._scan(start, stop, conditions):
+            hits = np.flatnonzero(mask)
+            if hits.size:
+                return chunk_start + int(hits[0])
+        return None
+
+    def became(self, field, value, start=0, **conditions):
+        # records hold the state *before* each instruction, so step `i` set
+        # `field` to `value` when it differs at `i` and matches at `i + 1`
+        column = self.steps[field]
+        for chunk_start in range(start, len(self) - 1, CHUNK_SIZE):
+            chunk_stop = min(chunk_start + CHUNK_SIZE, len(self) - 1)
+            before = column[chunk_start:chunk_stop]
+            after = column[chunk_start + 1 : chunk_stop + 1]
+            mask = (before != value) & (after == value)
+            mask &= self._mask(chunk_start, chunk_stop, conditions)
+            hits = np.flatnonzero(mask)
+            if hits.size:
+                return chunk_start + int(hits[0])
+        return None
+
+    def writes_to(self, start, end=None):
+        end = start if end is None else end
+        address = self.writes["address"]
+        indices = [
+            chunk_start
+            + np.flatnonzero(
+                (address[chunk_start : chunk_start + CHUNK_SIZE] >= start)
+                & (address[chunk_start : chunk_start + CHUNK_SIZE] <= end)
+            )
+            for chunk_start in range(0, len(address), CHUNK_SIZE)
+        ]
+        indices = np.concatenate(indices or [np.zeros((0,), dtype=np.int64)])
+        result = np.zeros(indices.shape, dtype=WRITE_DTYPE)
+        for field in WRITE_DTYPE.names:
+            result[field] = self.writes[field][indices]
+        return result
+
+    def first_divergence(self, other, fields=None):
+        fields = TRACE_DTYPE.names if fields is None else fields
+        length = min(len(self), len(other))
+        for chunk_start in range(0, length, CHUNK_SIZE):
+            chunk_stop = min(chunk_start + CHUNK_SIZE, length)
+            mask = np.zeros((chunk_stop - chunk_start,), dtype=bool)
+            for field in fields:
+                mask |= (
+                    self.steps[field][chunk_start:chunk_stop]
+                    != other.steps[field][chunk_start:chunk_stop]
+                )
+            hits = np.flatnonzero(mask)
+            if hits.size:
+                return chunk_start + int(hits[0])
+        if len(self) != len(other):
+            return length
+        return None
+
+    def diff(self, other, fields=None, context=3):
+        fields = TRACE_DTYPE.names if fields is None else fields
+        index = self.first_divergence(other, fields)
+        if index is None:
+            return None
+        start = max(index - context, 0)
+        return TraceDiff(
+            index=index,
+            fields=[
+                field
+                for field in fields
+                if index < min(len(self), len(other))
+                and self.steps[field][index] != other.steps[field][index]
+            ],
+            ours=self.records(start, index + context + 1),
+            theirs=other.records(start, index + context + 1),
+            start=start,
+        )
+
+    def records(self, start, stop):
+        stop = min(stop, len(self))
+        result = np.zeros((max(stop - start, 0),), dtype=TRACE_DTYPE)
+        for field in TRACE_DTYPE.names:
+            result[field] = self.steps[field][start:stop]
+        return result
+
+    def _scan(self, start, stop, conditions):
+        stop = len(self) if stop is None else min(stop, len(self))
+        for chunk_start in range(start, stop, CHUNK_SIZE):
+            chunk_stop = min(chunk_start + CHUNK_SIZE, stop)
+            yield chunk_start, self._mask(chunk_start, chunk_stop, conditions)
+
+    def _mask(self, start, stop, conditions):
+        mask = np.ones((stop - start,), dtype=bool)
+        for field, condition in conditions.items():
+            column = self.steps[field][start:stop]
+            if isinstance(condition, tuple):
+                low, high = condition
+                mask &= (column >= low) & (column <= high)
+            else:
+                mask &= column == condition
+        return mask
+
+    def _load_table(self, table, dtype):
+        return {
+            field: np.load(
+                os.path.join(self.directory, table, f"{field}.npy"),
+                mmap_mode="r",
+            )
+            for field in dtype.names
+        }
+
+    @staticmethod
+    def _save_table(records, directory, table):
+        os.makedirs(os.path.join(directory, table), exist_ok=True)
+        for field in records.dtype.names:
+            column = np.lib.format.open_memmap(
+                os.path.join(directory, table, f"{field}.npy"),
+                mode="w+",
+                dtype=records.dtype[field],
+                shape=records.shape,
+            )
+            for start in range(0, len(records), CHUNK_SIZE):
+                stop = start + CHUNK_SIZE
+                column[start:stop] = records[field][start:stop]
+            column.flush()
+            del column
+
+
+class TraceDiff:
+    def __init__(self, index, fields, ours, theirs, start):
+        self.index = index
+        self.fields = fields
+        self.ours = ours
+        self.theirs = theirs
+        self.start = start
+
+    def __str__(self):
+        lines = [
+            f"First divergence at step {self.index}"
+            f" ({', '.join(self.fields) or 'trace length'})"
+        ]
+        for name, records in (("ours", self.ours), ("theirs", self.theirs)):
+            lines.append(f"{name}:")
+            for offset, record in enumerate(records):
+                marker = ">" if self.start + offset == self.index else " "
+                lines.append(f"{marker} {format_record(record)}")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar trace store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert")
+    convert.add_argument("trace")
+    convert.add_argument("directory")
+    diff = subparsers.add_parser("diff")
+    diff.add_argument("ours")
+    diff.add_argument("theirs")
+    diff.add_argument("--context", type=int, default=3)
+    args = parser.parse_args()
+
+    match args.command:
+        case "convert":
+            store = TraceStore.convert(args.trace, args.directory)
+            print(f"{len(store)} steps, {len(store.writes['step'])} writes")
+        case "diff":
+            result = TraceStore(args.ours).diff(
+                TraceStore(args.theirs), context=args.context
+            )
+            print("Traces match" if result is None else result)
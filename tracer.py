@@ -0,0 +1,175 @@
+import argparse
+import os
+import threading
+
+import numpy as np
+
+from bus import Bus
+from opcodes import MNEMONICS
+
+# one fixed-width record per executed instruction, state taken before it runs
+TRACE_DTYPE = np.dtype(
+    [
+        ("pc", "<u2"),
+        ("opcode", "u1"),
+        ("a", "u1"),
+        ("x", "u1"),
+        ("y", "u1"),
+        ("p", "u1"),
+        ("sp", "u1"),
+        ("cycle", "<u8"),
+    ]
+)
+# one record per byte stored through the bus, `step` indexes the trace above
+WRITE_DTYPE = np.dtype(
+    [
+        ("step", "<u8"),
+        ("address", "<u2"),
+        ("value", "u1"),
+    ]
+)
+
+
+class TraceWriter:
+    def __init__(
+        self,
+        filepath,
+        dtype=TRACE_DTYPE,
+        capacity=2**16,
+        chunk_size=2**12,
+    ):
+        assert capacity % chunk_size == 0, "Capacity must be chunk aligned"
+        self.filepath = filepath
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.buffer = np.zeros((capacity,), dtype=dtype)
+        # both are absolute record counts, the ring index is `n % capacity`
+        self.head = 0
+        self.tail = 0
+        self.closed = False
+        self._draining = False
+        self._condition = threading.Condition()
+        self._file = open(filepath, "wb")
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def record(self, *fields):
+        self.buffer[self.head % self.capacity] = fields
+        self.head += 1
+        if self.head % self.chunk_size == 0:
+            self._chunk_filled()
+
+    def flush(self):
+        with self._condition:
+            self._draining = True
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self.tail == self.head)
+            self._draining = False
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _chunk_filled(self):
+        with self._condition:
+            self._condition.notify_all()
+            # backpressure: only start a new chunk once there is room for it
+            self._condition.wait_for(
+                lambda: self.head + self.chunk_size - self.tail
+                <= self.capacity
+            )
+
+    def _flush_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self.closed
+                    or self._draining
+                    or self.head - self.tail >= self.chunk_size
+                )
+                if self.closed:
+                    return
+                start = self.tail
+                end = self.head
+                if not self._draining:
+                    end -= end % self.chunk_size
+
+            # the producer never touches [start, end) until tail moves past it
+            self._write(start, end)
+            self._file.flush()
+
+            with self._condition:
+                self.tail = end
+                self._condition.notify_all()
+
+    def _write(self, start, end):
+        while start < end:
+            index = start % self.capacity
+            stop = min(index + end - start, self.capacity)
+            self._file.write(self.buffer[index:stop].tobytes())
+            start += stop - index
+
+
+def load_trace(filepath, dtype=TRACE_DTYPE):
+    if os.path.getsize(filepath) == 0:
+        return np.zeros((0,), dtype=dtype)
+    return np.memmap(filepath, dtype=dtype, mode="r")
+
+
+def select(trace, start=0x0000, end=0xFFFF, every=1):
+    mask = (trace["pc"] >= start) & (trace["pc"] <= end)
+    return np.flatnonzero(mask)[::every]
+
+
+def format_record(record, disassembler=None):
+    pc = int(record["pc"])
+    if disassembler is not None and disassembler.in_rom(pc):
+        code = f"{disassembler.line(pc):<47}"
+    else:
+        # RAM contents aren't in the trace, only the opcode is known
+        opcode = int(record["opcode"])
+        code = f"{pc:04X}  {opcode:02X}        {MNEMONICS[opcode].upper():<31}"
+    return (
+        f"{code} "
+        f"A:{record['a']:02X} X:{record['x']:02X} Y:{record['y']:02X} "
+        f"P:{record['p']:02X} SP:{record['sp']:02X} CYC:{record['cycle']}"
+    )
+
+
+def render(filepath, start=0x0000, end=0xFFFF, every=1, rom=None):
+    disassembler = None
+    if rom is not None:
+        bus = Bus()
+        bus.load_rom(rom)
+        disassembler = bus.disassembler
+
+    trace = load_trace(filepath)
+    for index in select(trace, start, end, every):
+        yield format_record(trace[index], disassembler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render a binary execution trace as nestest-style text"
+    )
+    parser.add_argument("trace")
+    parser.add_argument("--start", type=lambda x: int(x, 16), default=0x0000)
+    parser.add_argument("--end", type=lambda x: int(x, 16), default=0xFFFF)
+    parser.add_argument("--every", type=int, default=1)
+    parser.add_argument("--rom", help="disassemble PRG ROM addresses")
+    args = parser.parse_args()
+
+    for line in render(args.trace, args.start, args.end, args.every, args.rom):
+        print(line)